@@ -0,0 +1,332 @@
+"""
+Admission control, so that a few clients hammering the expensive routes
+cannot starve everyone else. Everything here is per worker process, like the
+circuit breakers.
+
+- Priorities: every request holds one of ADMISSION_SLOTS slots while it
+  runs. Async routes under ASGI only hold an in-flight request on the event
+  loop, so they draw on their own, much larger pool
+  (ADMISSION_ASYNC_SLOTS) instead. A route's priority ("normal" unless set with @priority or @admit)
+  caps how busy the worker may be for the request to start. With the default
+  ADMISSION_SHARES, expensive routes stop being admitted at half the slots
+  and normal ones at 80%. Interactive routes (update_page, search) may use
+  every slot. A request that finds no room waits up to
+  ADMISSION_QUEUE_TIMEOUT seconds for one, then gets a 429.
+- Per-route concurrency: Slots caps how many runs of a route may be in
+  progress at once, including background work the route starts.
+- Per-user quotas: TokenBuckets gives each user `burst` requests that refill
+  at a steady rate. A request with none left gets a 429 whose Retry-After
+  says when the next one is due.
+
+    @app.route("/testgen", methods=["POST"])
+    @admit("expensive", concurrency=TESTGEN_SLOTS, quota=TESTGEN_QUOTA)
+    def testgen(): ...
+
+Rejections raise AdmissionRejected, which init_app turns into a 429. Async
+routes under ASGI never wait for a slot: they are admitted or refused at
+once, since waiting would hold up the event loop.
+"""
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from configfile import (
+    admission_async_slots,
+    admission_queue_timeout,
+    admission_retry_after,
+    admission_shares,
+    admission_slots,
+)
+from application.metrics import Counter, Histogram
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+INTERACTIVE = "interactive"
+NORMAL = "normal"
+EXPENSIVE = "expensive"
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+# Set on requests for native async routes (see services/asgi/app.py)
+ASYNC_ENVIRON_KEY = "cadence.async"
+
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Requests refused with 429, by reason: busy, concurrency or quota.",
+    ("route", "reason"),
+)
+ADMISSION_WAIT = Histogram(
+    "admission_wait_seconds",
+    "Time requests spent waiting for a slot before running.",
+    ("route",),
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised instead of running a request the worker has no room or quota for."""
+
+    def __init__(self, reason: str, retry_after: float, message: str):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class Slots:
+    """A counted pool of slots that callers wait on for up to a timeout."""
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.in_use = 0
+        self._available = threading.Condition()
+
+    def acquire(self, limit: Optional[int] = None, timeout: float = 0.0) -> bool:
+        """Takes a slot once fewer than `limit` (default: all) are in use."""
+        limit = self.capacity if limit is None else limit
+        deadline = time.monotonic() + timeout
+        with self._available:
+            while self.in_use >= limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._available.wait(remaining)
+            self.in_use += 1
+            return True
+
+    def release(self):
+        with self._available:
+            self.in_use -= 1
+            self._available.notify_all()
+
+    async def acquire_async(self, limit: Optional[int] = None, timeout: float = 0.0) -> bool:
+        """acquire() for coroutines: polls instead of blocking the loop."""
+        deadline = time.monotonic() + timeout
+        while not self.acquire(limit):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+
+class TokenBuckets:
+    """One token bucket per key: `burst` tokens, refilled at `rate` per second."""
+
+    def __init__(self, name: str, rate: float, burst: int, max_keys: int = 10000):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """Takes a token for `key`; returns 0, or the seconds until one is due."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+            self._buckets.move_to_end(key)
+            # The least recently seen buckets have long since refilled
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def refund(self, key: str):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, time.monotonic()))
+            self._buckets[key] = (min(self.burst, tokens + 1), updated)
+
+
+def parse_quota(name: str, spec: str) -> Optional[TokenBuckets]:
+    """
+    Buckets from "<count>/<period>[,burst=<n>]", e.g. "30/hour,burst=5".
+    The burst defaults to the count. "" or "off" means no quota.
+    """
+    spec = (spec or "").strip().lower()
+    if spec in ("", "off", "0"):
+        return None
+    rate_part, _, burst_part = spec.partition(",")
+    count, _, period = rate_part.partition("/")
+    count = float(count)
+    burst = int(burst_part.partition("=")[2]) if burst_part else max(1, int(count))
+    return TokenBuckets(name, count / PERIODS[period.strip() or "second"], burst)
+
+
+def _parse_shares(spec: str) -> dict:
+    shares = {INTERACTIVE: 1.0, NORMAL: 0.8, EXPENSIVE: 0.5}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            shares[name.strip()] = float(value)
+    return shares
+
+
+WORKER_SLOTS = Slots("worker", admission_slots)
+ASYNC_SLOTS = Slots("async", admission_async_slots)
+SHARES = _parse_shares(admission_shares)
+
+
+def slot_limit(priority_name: str, slots: Slots = WORKER_SLOTS) -> int:
+    """How many of `slots` may be busy for a request of this priority to start."""
+    share = SHARES.get(priority_name, SHARES[NORMAL])
+    return max(1, int(slots.capacity * share))
+
+
+def client_key() -> str:
+    """Who a quota is charged to: the signed-in user, else the client address."""
+    from flask import request, session
+
+    user = session.get("user_id") or session.get("bot_user_id")
+    if user:
+        return f"user:{user}"
+    return f"addr:{request.access_route[0] if request.access_route else request.remote_addr}"
+
+
+def _route() -> str:
+    from flask import request
+
+    rule = request.url_rule
+    return rule.rule if rule is not None else request.path
+
+
+def _is_async() -> bool:
+    from flask import request
+
+    return bool(request.environ.get(ASYNC_ENVIRON_KEY))
+
+
+def charge(quota: Optional[TokenBuckets], key: Optional[str] = None) -> Optional[str]:
+    """Takes one token from the caller's bucket, or raises AdmissionRejected."""
+    if quota is None:
+        return None
+    key = key or client_key()
+    wait = quota.take(key)
+    if wait:
+        ADMISSION_REJECTED.inc(_route(), "quota")
+        log.info("quota exceeded", quota=quota.name, key=key, retry_after=round(wait, 1))
+        raise AdmissionRejected(
+            "quota", wait, f"Too many {quota.name} requests, try again in {wait:.0f}s"
+        )
+    return key
+
+
+def busy(slots: Slots) -> AdmissionRejected:
+    ADMISSION_REJECTED.inc(_route(), "concurrency")
+    return AdmissionRejected(
+        "concurrency",
+        admission_retry_after,
+        f"Too many {slots.name} requests in progress, try again shortly",
+    )
+
+
+def priority(name: str):
+    """Sets the view's admission priority: interactive, normal or expensive."""
+
+    def decorator(view):
+        view.admission_priority = name
+        return view
+
+    return decorator
+
+
+def admit(
+    priority_name: str = NORMAL,
+    concurrency: Optional[Slots] = None,
+    quota: Optional[TokenBuckets] = None,
+    overflow: Optional[Callable] = None,
+):
+    """
+    Sets the view's priority and, optionally, a per-user quota and a cap on
+    concurrent runs. When the cap is reached for longer than the queue
+    timeout, `overflow` (called with the view's arguments) answers instead,
+    e.g. by queueing the work; without one the request gets a 429.
+    """
+
+    def decorator(view):
+        if concurrency is None and quota is None:
+            return priority(priority_name)(view)
+
+        if asyncio.iscoroutinefunction(view):
+
+            @functools.wraps(view)
+            async def wrapper(*args, **kwargs):
+                key = charge(quota)
+                if concurrency is not None and not await concurrency.acquire_async():
+                    return _overflow(key, *args, **kwargs)
+                try:
+                    return await view(*args, **kwargs)
+                finally:
+                    if concurrency is not None:
+                        concurrency.release()
+
+        else:
+
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                key = charge(quota)
+                if concurrency is not None and not concurrency.acquire(
+                    timeout=admission_queue_timeout
+                ):
+                    return _overflow(key, *args, **kwargs)
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    if concurrency is not None:
+                        concurrency.release()
+
+        def _overflow(key, *args, **kwargs):
+            if overflow is not None:
+                return overflow(*args, **kwargs)
+            if key is not None:
+                quota.refund(key)
+            raise busy(concurrency)
+
+        return priority(priority_name)(wrapper)
+
+    return decorator
+
+
+## 🌐 Flask
+
+
+def init_app(app):
+    """Admits requests by priority and answers rejections with 429."""
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def _admit():
+        view = app.view_functions.get(request.endpoint)
+        level = getattr(view, "admission_priority", NORMAL)
+        started = time.monotonic()
+        if _is_async():
+            slots, timeout = ASYNC_SLOTS, 0.0
+        else:
+            slots, timeout = WORKER_SLOTS, admission_queue_timeout
+        if not slots.acquire(slot_limit(level, slots), timeout):
+            ADMISSION_REJECTED.inc(_route(), "busy")
+            log.warning("worker busy, request refused", route=_route(), priority=level, pool=slots.name)
+            raise AdmissionRejected("busy", admission_retry_after, "Server busy, try again shortly")
+        g.admission_slot = slots
+        ADMISSION_WAIT.observe(time.monotonic() - started, _route())
+
+    @app.teardown_request
+    def _release(error=None):
+        slots = g.pop("admission_slot", None)
+        if slots is not None:
+            slots.release()
+
+    @app.errorhandler(AdmissionRejected)
+    def _rejected(e):
+        retry_after = str(max(1, round(e.retry_after)))
+        if "Dart" in request.headers.get("User-Agent", "") or request.is_json:
+            response = jsonify({"error": str(e), "reason": e.reason, "retry_after": retry_after})
+        else:
+            response = app.make_response(str(e))
+        response.status_code = 429
+        response.headers["Retry-After"] = retry_after
+        return response
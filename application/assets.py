@@ -0,0 +1,210 @@
+"""
+Fingerprinted, precompressed static assets.
+
+At startup every file under static/ is copied to ASSET_BUILD_DIR as
+`<name>.<content hash>.<ext>`, with .gz and (when the brotli package is
+installed) .br variants of the compressible ones. url() references in CSS
+are rewritten to the hashed names first, so a stylesheet's hash also covers
+the fonts and images it pulls in. Templates link assets with
+
+    <script src="{{ asset_url('js/htmx.js') }}"></script>
+
+which emits /assets/js/htmx.3f2a9c1b7e.js. That URL changes whenever the
+file does, so it is served with a year-long immutable Cache-Control, picking
+the smallest variant the client's Accept-Encoding allows.
+
+Built files are content-addressed, so workers building at the same time (or
+a restart with unchanged assets) reuse what is already there.
+ASSETS_FINGERPRINT=0 switches asset_url back to the plain static URLs, for
+editing assets locally without restarting.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import tempfile
+from typing import Dict
+
+from configfile import asset_build_dir, assets_fingerprint
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+HASH_LENGTH = 10
+MAX_AGE = 365 * 24 * 3600
+# Text formats worth compressing; images and woff2 are already compressed
+COMPRESSIBLE = {".js", ".css", ".svg", ".json", ".txt", ".html", ".otf", ".ttf", ".ico", ".map"}
+# Variants smaller than this share of the original are kept
+MIN_SAVING = 0.95
+# Preference order when the client accepts several encodings
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+# logical name ("js/htmx.js") -> hashed name ("js/htmx.3f2a9c1b7e.js")
+manifest: Dict[str, str] = {}
+# hashed name -> {"path", "mimetype", "etag", "br", "gzip"}
+_files: Dict[str, dict] = {}
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def hashed_name(name: str, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _write_once(path: str, data: bytes):
+    """Writes a content-addressed file unless it already exists."""
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+
+
+def _rewrite_css(name: str, content: bytes) -> bytes:
+    """Points url() references in a stylesheet at the hashed names."""
+    directory = os.path.dirname(name)
+
+    def replace(match):
+        quote, target = match.group(1), match.group(2)
+        if target.startswith(("data:", "http:", "https:", "/", "#")):
+            return match.group(0)
+        path, _, suffix = target.partition("?")
+        logical = os.path.normpath(os.path.join(directory, path)).replace(os.sep, "/")
+        hashed = manifest.get(logical)
+        if hashed is None:
+            return match.group(0)
+        relative = os.path.relpath(hashed, directory or ".").replace(os.sep, "/")
+        return f"url({quote}{relative}{'?' + suffix if suffix else ''}{quote})"
+
+    return _CSS_URL.sub(replace, content.decode("utf-8")).encode("utf-8")
+
+
+def _build_one(name: str, content: bytes, brotli) -> str:
+    hashed = hashed_name(name, content)
+    path = os.path.join(asset_build_dir, hashed)
+    _write_once(path, content)
+
+    ext = os.path.splitext(name)[1].lower()
+    entry = {
+        "path": os.path.abspath(path),
+        "mimetype": mimetypes.guess_type(name)[0] or "application/octet-stream",
+        "etag": hashed.rsplit("/", 1)[-1],
+    }
+    if ext in COMPRESSIBLE:
+        compressors = {"gzip": lambda data: gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            compressors["br"] = lambda data: brotli.compress(data, quality=11)
+        for encoding, suffix in ENCODINGS:
+            compress = compressors.get(encoding)
+            if compress is None:
+                continue
+            variant = path + suffix
+            if not os.path.exists(variant):
+                compressed = compress(content)
+                if len(compressed) > len(content) * MIN_SAVING:
+                    continue
+                _write_once(variant, compressed)
+            entry[encoding] = os.path.abspath(variant)
+    manifest[name] = hashed
+    _files[hashed] = entry
+    return hashed
+
+
+def build(static_folder: str) -> Dict[str, str]:
+    """Fingerprints and compresses everything under `static_folder`; returns the manifest."""
+    brotli = _brotli()
+    names = []
+    for root, _, files in os.walk(static_folder):
+        for filename in files:
+            path = os.path.join(root, filename)
+            names.append(os.path.relpath(path, static_folder).replace(os.sep, "/"))
+
+    # Stylesheets last, so the files they reference already have hashed names
+    for name in sorted(names, key=lambda name: (name.endswith(".css"), name)):
+        with open(os.path.join(static_folder, name), "rb") as f:
+            content = f.read()
+        if name.endswith(".css"):
+            content = _rewrite_css(name, content)
+        _build_one(name, content, brotli)
+
+    # For deploy tooling and CDNs that want to warm or upload the hashed files
+    _write_atomic(
+        os.path.join(asset_build_dir, "manifest.json"),
+        json.dumps(manifest, indent=2, sort_keys=True).encode(),
+    )
+    log.info(
+        "assets built",
+        files=len(manifest),
+        compressed=sum(1 for entry in _files.values() if "gzip" in entry),
+        brotli=brotli is not None,
+    )
+    return manifest
+
+
+def asset_url(name: str) -> str:
+    """URL of a static file: its fingerprinted copy if built, else the plain one."""
+    from flask import url_for
+
+    hashed = manifest.get(name)
+    if hashed is None:
+        return url_for("static", filename=name)
+    return url_for("asset", filename=hashed)
+
+
+## 🌐 Flask
+
+
+def init_app(app):
+    """Builds the manifest and registers /assets/<name> and asset_url()."""
+    from flask import abort, request, send_file
+
+    if assets_fingerprint:
+        build(app.static_folder)
+
+    app.jinja_env.globals["asset_url"] = asset_url
+
+    @app.route("/assets/<path:filename>", endpoint="asset")
+    def asset(filename):
+        entry = _files.get(filename)
+        if entry is None:
+            abort(404)
+        path, encoding = entry["path"], None
+        for candidate, _ in ENCODINGS:
+            if candidate in entry and request.accept_encodings[candidate]:
+                path, encoding = entry[candidate], candidate
+                break
+
+        response = send_file(
+            path,
+            mimetype=entry["mimetype"],
+            conditional=True,
+            etag=f"{entry['etag']}-{encoding or 'identity'}",
+            max_age=MAX_AGE,
+        )
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add("Accept-Encoding")
+        return response
@@ -0,0 +1,224 @@
+"""
+Async variants of the database helpers, for the ASGI serving mode.
+
+These talk to Supabase's PostgREST endpoint directly over one pooled
+httpx.AsyncClient per event loop rather than building a supabase client per
+call. Row-level security works the same way as in the sync helpers: passing
+the user's access token sends it as the bearer token, otherwise the anon key
+is used.
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from configfile import supabase_key, supabase_url
+from application.cache import LIBRARY, SEARCH
+from application.database import cache_row_from_volume
+from application.deadlines import timeout_for
+from application.integrations import get_httpx
+from application.metrics import httpx_operation, observe_upstream
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+REST_URL = f"{supabase_url}/rest/v1"
+
+_clients = {}
+
+
+def get_async_client():
+    """Pooled AsyncClient for the running event loop (shared by all upstreams)."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        httpx = get_httpx()
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            follow_redirects=True,
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_async_clients():
+    loop = asyncio.get_running_loop()
+    client = _clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+
+def _headers(token: Optional[str] = None, single: bool = False, prefer: str = None):
+    headers = {
+        "apikey": supabase_key or "",
+        "Authorization": f"Bearer {token or supabase_key}",
+    }
+    if single:
+        headers["Accept"] = "application/vnd.pgrst.object+json"
+    if prefer:
+        headers["Prefer"] = prefer
+    return headers
+
+
+async def select(
+    table: str,
+    params: Dict[str, str],
+    token: Optional[str] = None,
+    single: bool = False,
+) -> Any:
+    """GET /rest/v1/<table> with PostgREST query params; raises on HTTP errors."""
+    started = time.monotonic()
+    response = await get_async_client().get(
+        f"{REST_URL}/{table}",
+        params=params,
+        headers=_headers(token, single=single),
+        timeout=timeout_for("supabase"),
+    )
+    _observe(response, started)
+    response.raise_for_status()
+    return response.json()
+
+
+async def upsert(table: str, rows, on_conflict: Optional[str] = None, token=None):
+    params = {"on_conflict": on_conflict} if on_conflict else None
+    started = time.monotonic()
+    response = await get_async_client().post(
+        f"{REST_URL}/{table}",
+        params=params,
+        json=rows,
+        headers=_headers(token, prefer="resolution=merge-duplicates,return=minimal"),
+        timeout=timeout_for("supabase"),
+    )
+    _observe(response, started)
+    response.raise_for_status()
+
+
+def _observe(response, started: float):
+    # Recorded here rather than with client hooks: the pooled client is
+    # shared with upstreams that guard() already measures
+    observe_upstream(
+        "supabase",
+        httpx_operation(response.request.method, response.request.url.path),
+        response.status_code,
+        time.monotonic() - started,
+        len(response.content),
+        f"{response.request.method} {response.request.url}",
+    )
+
+
+def _in_list(values) -> str:
+    return "in.(" + ",".join(f'"{value}"' for value in values) + ")"
+
+
+## 📖 Library
+
+
+async def get_library(user: str) -> List[Dict[str, Any]]:
+    try:
+        return await LIBRARY.aget_or_load(
+            ("user", user),
+            lambda: select("library", {"select": "*", "user_id": f"eq.{user}"}),
+        )
+    except Exception as e:
+        log.warning("library fetch failed", user=user, error=e)
+        return []
+
+
+async def get_profile_row(user_id: str, columns: str) -> Optional[dict]:
+    try:
+        return await select(
+            "profiles", {"select": columns, "id": f"eq.{user_id}"}, single=True
+        )
+    except Exception as e:
+        log.warning("profile fetch failed", error=e)
+        return None
+
+
+async def check_book_db(search_term):
+    try:
+        return await SEARCH.aget_or_load(
+            ("db", search_term),
+            lambda: select(
+                "cached_library",
+                {
+                    "select": "*",
+                    "or": f"(title.ilike.*{search_term}*,authors.ilike.*{search_term}*,isbn.eq.{search_term})",
+                },
+            ),
+        )
+    except Exception as e:
+        log.warning("book cache lookup failed", error=e)
+        return []
+
+
+async def save_books_to_cache(items):
+    """Caches several Google Books volumes in one upsert."""
+    rows = [cache_row_from_volume(item) for item in items]
+    # One row per ISBN: Google Books can return two volumes with the same
+    # one, and an upsert may not touch a row twice
+    rows = list({row["isbn"]: row for row in rows if row["isbn"]}.values())
+    if rows:
+        await upsert("cached_library", rows, on_conflict="isbn")
+
+
+## 💬 Messaging
+
+
+async def get_latest_messages_for_modal(user_id, token, limit=5):
+    if not token or not user_id:
+        return []
+    try:
+        participants = await select(
+            "thread_participants",
+            {"select": "thread_id", "user_id": f"eq.{user_id}"},
+            token,
+        )
+        thread_ids = [item["thread_id"] for item in participants]
+        if not thread_ids:
+            return []
+
+        return await select(
+            "messages",
+            {
+                "select": "*,threads(display_name),profiles!sender_id(display_name)",
+                "thread_id": _in_list(thread_ids),
+                "sender_id": f"neq.{user_id}",
+                "order": "created_at.desc",
+                "limit": str(limit),
+            },
+            token,
+        )
+    except Exception as e:
+        log.warning("latest messages failed", error=e)
+        return []
+
+
+async def get_my_inbox(user_id, token):
+    if not token:
+        return []
+    rows = await select(
+        "thread_participants",
+        {
+            "select": "thread_id,threads!inner(id,name,type,updated_at,display_name)",
+            "user_id": f"eq.{user_id}",
+        },
+        token,
+    )
+    return [row["threads"] for row in rows]
+
+
+async def get_thread(thread_id, token):
+    return await select(
+        "threads", {"select": "*", "id": f"eq.{thread_id}"}, token, single=True
+    )
+
+
+async def get_thread_messages(thread_id, token):
+    return await select(
+        "messages",
+        {
+            "select": "*,threads(display_name),profiles!sender_id(display_name)",
+            "thread_id": f"eq.{thread_id}",
+            "order": "created_at.asc",
+        },
+        token,
+    )
@@ -0,0 +1,184 @@
+"""
+Async variants of the upstream helpers (Google Books, Gemini, Spotify), for
+the ASGI serving mode. They share the pooled AsyncClient from
+async_database and go through the same deadlines and circuit breakers as
+the sync helpers.
+"""
+import asyncio
+import urllib.parse
+from typing import Any, Optional
+
+from configfile import gemini_key, google_books_key, google_books_url, spotify_api_url
+from application.async_database import get_async_client
+from application.breakers import guard
+from application.deadlines import DeadlineExceeded, remaining, timeout_for
+from application.gemini import STREAM_ENDPOINT, JsonScanner, build_request_body, event_text
+from application.logic import (
+    SONG_SCHEMA,
+    cache_recommendations,
+    get_cached_recommendations,
+    valid_songs,
+)
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+SPOTIFY_API = spotify_api_url
+
+# Track searches per playlist that may be in flight at once
+SPOTIFY_SEARCH_CONCURRENCY = 8
+
+
+## 📚 Google Books
+
+
+async def search_google_books(query: str, limit: int = 10):
+    url = f"{google_books_url}/volumes?q=intitle:{urllib.parse.quote(query)}&key={google_books_key}"
+    with guard("google_books", "search", url) as call:
+        response = await get_async_client().get(url, timeout=timeout_for("google_books"))
+        call.status(response.status_code, len(response.content))
+    response.raise_for_status()
+    return response.json().get("items", [])[:limit]
+
+
+## ✨ Gemini
+
+
+async def generate_json(
+    prompt: str, schema: Optional[dict] = None, operation: str = "generate", **options
+) -> Optional[Any]:
+    """Async counterpart of application.gemini.generate_json."""
+    body = build_request_body(prompt, schema, **options)
+    scanner = JsonScanner()
+    received = 0
+    with guard("gemini", operation) as call:
+        async with get_async_client().stream(
+            "POST",
+            STREAM_ENDPOINT,
+            json=body,
+            headers={"x-goog-api-key": gemini_key or ""},
+            timeout=timeout_for("gemini"),
+        ) as response:
+            call.status(response.status_code)
+            if response.status_code != 200:
+                text = (await response.aread()).decode(errors="replace")
+                log.warning("gemini error", status=response.status_code, body=text[:500])
+                return None
+            async for line in response.aiter_lines():
+                received += len(line)
+                if scanner.feed(event_text(line)):
+                    break
+                left = remaining()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded("gemini")
+        call.status(response.status_code, received)
+
+    if not scanner.done:
+        log.warning("no JSON array or object in the gemini response", operation=operation)
+    return scanner.value
+
+
+async def get_playlist_recommendations(data: dict):
+    cached = get_cached_recommendations(data)
+    if cached is not None:
+        return data, cached
+
+    prompt = f"Act as a music recommendation engine, based on the following book: {data}, please provide a list of 20 songs that would fit the mood and themes of the book, try to make it mix of known songs as well as ambient/non vocal. Provide this in a JSON array format with each entry containing 'song_title' and 'artist' and 'spotify_id'."
+    songs = await generate_json(prompt, schema=SONG_SCHEMA)
+    if not valid_songs(songs):
+        return data, []
+    cache_recommendations(data, songs)
+    return data, songs
+
+
+## 🎵 Spotify
+
+
+async def _spotify(method: str, path: str, token: str, operation: str, **kwargs):
+    target = f"{method} {path} {kwargs.get('params') or ''}".rstrip()
+    with guard("spotify", operation, target) as call:
+        response = await get_async_client().request(
+            method,
+            f"{SPOTIFY_API}/{path}",
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=timeout_for("spotify"),
+            **kwargs,
+        )
+        call.status(response.status_code, len(response.content))
+    response.raise_for_status()
+    return response.json() if response.content else None
+
+
+async def spotify_search(token: str, songs):
+    """Looks up every song concurrently; returns the ones Spotify found."""
+    semaphore = asyncio.Semaphore(SPOTIFY_SEARCH_CONCURRENCY)
+
+    async def search(song):
+        async with semaphore:
+            try:
+                query = f"track:{song['song_title']} artist:{song['artist']}"
+                result = await _spotify(
+                    "GET",
+                    "search",
+                    token,
+                    "search",
+                    params={"q": query, "type": "track", "limit": 1},
+                )
+            except Exception as e:
+                log.warning("spotify search failed", song=song.get("song_title"), error=e)
+                return None
+            items = result.get("tracks", {}).get("items", [])
+            if not items:
+                return None
+            return {
+                "song_title": song["song_title"],
+                "artist": song["artist"],
+                "spotify_id": items[0]["id"],
+            }
+
+    found = await asyncio.gather(*(search(song) for song in songs))
+    return [track for track in found if track]
+
+
+async def create_playlist(book, songs, cover_url):
+    # Token lookup/refresh goes through spotipy's OAuth helper, which is sync
+    from application.suggestions import get_bot_access_token
+
+    token = await asyncio.to_thread(get_bot_access_token)
+    if not token:
+        return None
+
+    try:
+        # The playlist itself and the track lookups do not depend on each
+        # other, so they run concurrently
+        me = await _spotify("GET", "me", token, "current_user")
+        playlist, found_tracks = await asyncio.gather(
+            _spotify(
+                "POST",
+                f"users/{me['id']}/playlists",
+                token,
+                "create_playlist",
+                json={
+                    "name": f"cadence - {book['title']}",
+                    "public": False,
+                    "description": f"Playlist for {book['title']}",
+                },
+            ),
+            spotify_search(token, songs),
+        )
+
+        playlist_id = playlist["id"]
+        track_uris = [f"spotify:track:{t['spotify_id']}" for t in found_tracks]
+        if track_uris:
+            await _spotify(
+                "POST",
+                f"playlists/{playlist_id}/items",
+                token,
+                "add_items",
+                json=track_uris[:100],
+            )
+
+        return {"playlist_id": playlist_id}
+    except Exception as e:
+        log.warning("spotify playlist creation failed", error=e)
+        return None
@@ -0,0 +1,255 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from application.deadlines import DeadlineExceeded
+from application.metrics import observe_upstream
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+# --- Circuit breaker states ---
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, upstream: str, retry_after: float):
+        self.upstream = upstream
+        self.retry_after = retry_after
+        super().__init__(
+            f"{upstream} is unavailable (circuit open), retry in {retry_after:.0f}s"
+        )
+
+
+class CircuitBreaker:
+    """
+    Rolling-window breaker for one upstream.
+
+    Every call is recorded as (timestamp, ok, latency). Once the window holds
+    at least `min_calls` calls and either the error rate or the share of calls
+    slower than `slow_call` reaches its threshold, the breaker opens. After
+    `cooldown` seconds it goes half-open and lets a single probe through: a
+    good probe closes it again, a bad one re-opens it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        slow_call: float,
+        window: float = 60,
+        min_calls: int = 10,
+        error_threshold: float = 0.5,
+        slow_threshold: float = 0.8,
+        cooldown: float = 30,
+    ):
+        self.name = name
+        self.slow_call = slow_call
+        self.window = window
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.slow_threshold = slow_threshold
+        self.cooldown = cooldown
+
+        self._calls = deque()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def retry_after(self) -> float:
+        """Seconds until an open breaker will allow a probe (0 if not open)."""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.cooldown - time.monotonic())
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call should not be attempted."""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            retry_after = max(
+                1.0, self._opened_at + self.cooldown - time.monotonic()
+            )
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, ok: bool, latency: float):
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            if state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok and latency < self.slow_call:
+                    self._state = CLOSED
+                    self._calls.clear()
+                else:
+                    self._trip(now)
+                return
+
+            self._calls.append((now, ok, latency))
+            self._expire(now)
+            if state == CLOSED and self._should_trip():
+                self._trip(now)
+
+    def cancel(self):
+        """Forgets a call that never reached the upstream."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        """Current state and window statistics, for the status endpoint."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            self._expire(now)
+            calls = len(self._calls)
+            errors = sum(1 for _, ok, _ in self._calls if not ok)
+            slow = sum(1 for _, _, latency in self._calls if latency >= self.slow_call)
+            latencies = sorted(latency for _, _, latency in self._calls)
+            retry_after = (
+                max(0.0, self._opened_at + self.cooldown - now) if state == OPEN else 0.0
+            )
+        return {
+            "state": state,
+            "calls": calls,
+            "error_rate": round(errors / calls, 3) if calls else 0.0,
+            "slow_rate": round(slow / calls, 3) if calls else 0.0,
+            "p50_latency": round(latencies[calls // 2], 3) if calls else None,
+            "retry_after": round(retry_after, 1),
+        }
+
+    # --- internals (call with the lock held) ---
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.cooldown:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def _expire(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def _should_trip(self) -> bool:
+        calls = len(self._calls)
+        if calls < self.min_calls:
+            return False
+        errors = sum(1 for _, ok, _ in self._calls if not ok)
+        slow = sum(1 for _, _, latency in self._calls if latency >= self.slow_call)
+        return (
+            errors / calls >= self.error_threshold
+            or slow / calls >= self.slow_threshold
+        )
+
+    def _trip(self, now: float):
+        self._state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        log.warning("circuit breaker opened", upstream=self.name)
+
+
+# One breaker per upstream; `slow_call` is the latency (seconds) above which a
+# call counts as slow even when it succeeds.
+BREAKERS: Dict[str, CircuitBreaker] = {
+    "gemini": CircuitBreaker("gemini", slow_call=12),
+    "spotify": CircuitBreaker("spotify", slow_call=3),
+    "google_books": CircuitBreaker("google_books", slow_call=3),
+    "openlibrary": CircuitBreaker("openlibrary", slow_call=4),
+}
+
+
+def get_breaker(upstream: str) -> Optional[CircuitBreaker]:
+    return BREAKERS.get(upstream)
+
+
+def is_available(*upstreams: str) -> bool:
+    """True when none of the given upstreams has an open breaker."""
+    return all(
+        BREAKERS[name].state != OPEN for name in upstreams if name in BREAKERS
+    )
+
+
+def breaker_states() -> dict:
+    return {name: breaker.snapshot() for name, breaker in BREAKERS.items()}
+
+
+class _Call:
+    """Handle yielded by guard() so callers can report the HTTP status and size."""
+
+    def __init__(self):
+        self.ok = True
+        self.status_code = None
+        self.size = None
+
+    def status(self, status_code: int, size: Optional[int] = None):
+        self.status_code = status_code
+        if size is not None:
+            self.size = size
+        # Rate limiting and server errors count against the upstream;
+        # other 4xx responses are our own fault and do not.
+        if status_code == 429 or status_code >= 500:
+            self.ok = False
+
+
+def _error_status(error: Exception) -> str:
+    # spotipy's SpotifyException carries the HTTP status of the failed call
+    status = getattr(error, "http_status", None)
+    return str(status) if status else "error"
+
+
+@contextmanager
+def guard(upstream: str, operation: str = "request", target: Optional[str] = None):
+    """
+    Wraps one outbound call. Raises CircuitOpenError without calling out when
+    the breaker is open, and records the outcome and latency otherwise.
+    Every call is also recorded in the upstream metrics under `operation`
+    (`target` names what was asked for, e.g. the URL); upstreams without a
+    breaker are only measured.
+    """
+    call = _Call()
+    breaker = get_breaker(upstream)
+    if breaker is not None:
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            observe_upstream(upstream, operation, "circuit_open")
+            raise
+
+    started = time.monotonic()
+    try:
+        yield call
+    except DeadlineExceeded:
+        # Our own budget ran out; that says nothing about the upstream
+        if breaker is not None:
+            breaker.cancel()
+        observe_upstream(
+            upstream, operation, "deadline", time.monotonic() - started, target=target
+        )
+        raise
+    except Exception as e:
+        latency = time.monotonic() - started
+        if breaker is not None:
+            breaker.record(False, latency)
+        observe_upstream(upstream, operation, _error_status(e), latency, target=target)
+        raise
+    latency = time.monotonic() - started
+    if breaker is not None:
+        breaker.record(call.ok, latency)
+    observe_upstream(
+        upstream, operation, call.status_code or "ok", latency, call.size, target
+    )
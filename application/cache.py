@@ -0,0 +1,680 @@
+"""
+Two-tier cache: an in-process LRU (L1) in front of Redis (L2), which every
+worker shares.
+
+    from application.cache import LIBRARY
+
+    rows = LIBRARY.get_or_load(("user", user_id), lambda: fetch(user_id))
+    LIBRARY.invalidate(("user", user_id))   # after a write, in every worker
+
+Values are stored JSON-encoded in both tiers and decoded on every hit, so
+callers get their own copy and may modify it.
+
+- Namespaces: each kind of data (BOOKS, SEARCH, LIBRARY, TOKENS,
+  RECOMMENDATIONS, FRAGMENTS, CONVERSATIONS, CONTACTS, FOLLOWS) has its
+  own key prefix, TTLs and L1 size. Bump a namespace's version when the
+  shape of its values changes.
+- Stampede protection: concurrent misses for one key in a worker share a
+  single load. Across workers a short Redis lock lets one worker load while
+  the others wait up to CACHE_LOCK_WAIT seconds for its result.
+- Invalidation: invalidate() deletes the L2 entry and publishes the key, and
+  each worker's subscriber thread drops its L1 copy. L1 TTLs are short so a
+  missed message only means briefly stale data. Other modules can put
+  their own channels on the same connection with subscribe() and publish(),
+  and run other commands on it with command() and pipeline().
+
+REDIS_URL selects L2. Unset means L1 only, with each worker caching for
+itself and invalidations reaching only the worker that made them. Set it
+whenever there is more than one worker. Namespaces created with
+l1_needs_l2 (LIBRARY) skip L1 while there is no L2, so a write is never
+followed by another worker serving the old value. "memory://" is an in-process stand-in with the same interface, for
+tests and the benchmark. Redis errors are logged and count as misses, and
+L2 is skipped for REDIS_BACKOFF seconds afterwards. CACHE_ENABLED=0 turns
+every lookup into a load.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from configfile import cache_enabled, cache_lock_wait, redis_backoff, redis_timeout, redis_url
+from application.integrations import get_redis
+from application.metrics import Counter
+from application.tracing import add_span
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+PREFIX = "cadence"
+CHANNEL = f"{PREFIX}:cache:invalidate"
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+# Longest a cross-worker load lock is held, in case its holder dies
+LOCK_TTL = 10
+MAX_KEY_LENGTH = 200
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups by result: l1_hit, l2_hit or miss.",
+    ("namespace", "result"),
+)
+CACHE_ERRORS = Counter(
+    "cache_errors_total",
+    "Failed Redis operations (served as misses).",
+    ("operation",),
+)
+
+NAMESPACES = {}
+
+
+def _encode(value) -> bytes:
+    return json.dumps(value, separators=(",", ":"), default=str).encode()
+
+
+def _decode(raw: bytes):
+    return json.loads(raw)
+
+
+## 🧪 In-process stand-in
+
+
+class LocalRedis:
+    """The few Redis commands used here, in memory (REDIS_URL=memory://)."""
+
+    def __init__(self):
+        self._data = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def _live(self, name, now):
+        entry = self._data.get(name)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= now:
+            del self._data[name]
+            return None
+        return value
+
+    def get(self, name):
+        with self._lock:
+            return self._live(name, time.monotonic())
+
+    def mget(self, names):
+        now = time.monotonic()
+        with self._lock:
+            return [self._live(name, now) for name in names]
+
+    def set(self, name, value, px=None, nx=False):
+        now = time.monotonic()
+        if not isinstance(value, bytes):
+            value = str(value).encode()
+        with self._lock:
+            if nx and self._live(name, now) is not None:
+                return None
+            self._data[name] = (value, now + px / 1000 if px else None)
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+    def rpush(self, name, *values):
+        with self._lock:
+            items = self._live(name, time.monotonic())
+            if items is None:
+                items = []
+                self._data[name] = (items, None)
+            items.extend(value if isinstance(value, bytes) else str(value).encode() for value in values)
+            return len(items)
+
+    def lindex(self, name, index):
+        with self._lock:
+            items = self._live(name, time.monotonic()) or []
+            return items[index] if -len(items) <= index < len(items) else None
+
+    def lrem(self, name, count, value):
+        if not isinstance(value, bytes):
+            value = str(value).encode()
+        with self._lock:
+            items = self._live(name, time.monotonic()) or []
+            removed = 0
+            while value in items and (count == 0 or removed < abs(count)):
+                items.remove(value)
+                removed += 1
+            return removed
+
+    def lpush(self, name, *values):
+        with self._lock:
+            items = self._live(name, time.monotonic())
+            if items is None:
+                items = []
+                self._data[name] = (items, None)
+            for value in values:
+                items.insert(0, value if isinstance(value, bytes) else str(value).encode())
+            return len(items)
+
+    def ltrim(self, name, start, end):
+        with self._lock:
+            items = self._live(name, time.monotonic())
+            if items is not None:
+                items[:] = items[start:None if end == -1 else end + 1]
+            return True
+
+    def lrange(self, name, start, end):
+        with self._lock:
+            items = self._live(name, time.monotonic()) or []
+            return items[start:None if end == -1 else end + 1]
+
+    def pipeline(self, transaction=True):
+        return _LocalPipeline(self)
+
+    def publish(self, channel, message):
+        if isinstance(message, str):
+            message = message.encode()
+        with self._lock:
+            inboxes = [inbox for channels, inbox in self._subscribers if channel in channels]
+        for inbox in inboxes:
+            inbox.put({"type": "message", "channel": channel.encode(), "data": message})
+        return len(inboxes)
+
+    def pubsub(self, **kwargs):
+        return _LocalPubSub(self)
+
+
+class _LocalPipeline:
+    """Queues commands and runs them on execute(), like redis-py's pipeline."""
+
+    def __init__(self, server: LocalRedis):
+        self._server = server
+        self._commands = []
+
+    def __getattr__(self, operation):
+        def queue(*args, **kwargs):
+            self._commands.append((operation, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        return [getattr(self._server, op)(*args, **kwargs) for op, args, kwargs in commands]
+
+
+class _LocalPubSub:
+    def __init__(self, server: LocalRedis):
+        self._server = server
+        self._channels = set()
+        self._inbox = queue.Queue()
+
+    def subscribe(self, *channels):
+        with self._server._lock:
+            if not self._channels:
+                self._server._subscribers.append((self._channels, self._inbox))
+            self._channels.update(channels)
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            return self._inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        with self._server._lock:
+            self._server._subscribers = [
+                entry for entry in self._server._subscribers if entry[1] is not self._inbox
+            ]
+
+
+## 🔌 Redis connection
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_local_server = None
+_failed_at = 0.0
+
+
+def _connect():
+    global _local_server
+    if redis_url.startswith("memory://"):
+        if _local_server is None:
+            _local_server = LocalRedis()
+        return _local_server
+    return get_redis().Redis.from_url(
+        redis_url,
+        socket_timeout=redis_timeout,
+        socket_connect_timeout=redis_timeout,
+        health_check_interval=30,
+    )
+
+
+def _redis():
+    """This process's L2 client, or None when L2 is off or backing off."""
+    global _client, _client_pid
+    if not redis_url or not cache_enabled:
+        return None
+    if _failed_at and time.monotonic() - _failed_at < redis_backoff:
+        return None
+    if _client_pid != os.getpid():
+        with _client_lock:
+            if _client_pid != os.getpid():
+                _client = _connect()
+                _client_pid = os.getpid()
+                threading.Thread(
+                    target=_listen, args=(_client,), name="cache-invalidation", daemon=True
+                ).start()
+    return _client
+
+
+def _l2_available() -> bool:
+    """Whether L2 is configured and not backing off; does not connect."""
+    if not redis_url or not cache_enabled:
+        return False
+    return not (_failed_at and time.monotonic() - _failed_at < redis_backoff)
+
+
+def _l2(operation: str, *args, **kwargs):
+    """Runs one Redis command; an error counts as a miss and starts a backoff."""
+    global _failed_at
+    client = _redis()
+    if client is None:
+        return None
+    started = time.monotonic()
+    try:
+        result = getattr(client, operation)(*args, **kwargs)
+    except Exception as e:
+        _failed_at = time.monotonic()
+        CACHE_ERRORS.inc(operation)
+        log.warning("redis unavailable, using L1 only", operation=operation, error=e, backoff=redis_backoff)
+        return None
+    add_span(f"redis {operation}", started, time.monotonic() - started)
+    return result
+
+
+def _invalidate(data: bytes):
+    name, _, key = data.decode().partition("\x1f")
+    namespace = NAMESPACES.get(name)
+    if namespace is not None:
+        namespace._discard(key)
+
+
+# channel -> handler(data) for messages on the shared Redis connection
+_handlers = {CHANNEL: _invalidate}
+
+
+def subscribe(channel: str, handler: Callable[[bytes], None]):
+    """Calls `handler` with every message published to `channel` by any worker."""
+    _handlers[channel] = handler
+
+
+def command(operation: str, *args, **kwargs):
+    """Runs one Redis command on L2; None without Redis or on error."""
+    return _l2(operation, *args, **kwargs)
+
+
+def pipeline(commands: Iterable[tuple]) -> Optional[list]:
+    """Runs (operation, *args) commands in one Redis round trip; None without Redis or on error."""
+    global _failed_at
+    client = _redis()
+    if client is None:
+        return None
+    started = time.monotonic()
+    try:
+        pipe = client.pipeline(transaction=False)
+        for operation, *args in commands:
+            getattr(pipe, operation)(*args)
+        results = pipe.execute()
+    except Exception as e:
+        _failed_at = time.monotonic()
+        CACHE_ERRORS.inc("pipeline")
+        log.warning("redis unavailable, using L1 only", operation="pipeline", error=e, backoff=redis_backoff)
+        return None
+    add_span("redis pipeline", started, time.monotonic() - started)
+    return results
+
+
+def connected() -> bool:
+    """Connects to Redis (starting the subscriber thread) if configured; False if not."""
+    return _redis() is not None
+
+
+def publish(channel: str, message) -> bool:
+    """Publishes to every worker's subscribers; False if it reached none (or no Redis)."""
+    return bool(_l2("publish", channel, message))
+
+
+def _listen(client):
+    """Drops the L1 entries that any worker invalidated, and runs other subscribers."""
+    reconnecting = False
+    while True:
+        pubsub = None
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            subscribed = set(_handlers)
+            pubsub.subscribe(*subscribed)
+            if reconnecting:
+                # Invalidations sent while we were away were missed
+                for namespace in NAMESPACES.values():
+                    namespace._clear_local()
+                reconnecting = False
+            while True:
+                if len(_handlers) != len(subscribed):
+                    pubsub.subscribe(*(set(_handlers) - subscribed))
+                    subscribed = set(_handlers)
+                message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message and message.get("type") == "message":
+                    channel = message["channel"]
+                    channel = channel.decode() if isinstance(channel, bytes) else channel
+                    handler = _handlers.get(channel)
+                    try:
+                        if handler is not None:
+                            handler(message["data"])
+                    except Exception:
+                        log.exception("pub/sub handler failed", channel=channel)
+        except Exception as e:
+            CACHE_ERRORS.inc("subscribe")
+            log.warning("cache invalidation subscriber reconnecting", error=e)
+            reconnecting = True
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            time.sleep(redis_backoff)
+
+
+## 🗂️ Namespaces
+
+
+class _Flight:
+    """One in-progress load that concurrent misses for the same key wait on."""
+
+    __slots__ = ("waiter", "raw", "stale")
+
+    def __init__(self, waiter):
+        self.waiter = waiter
+        self.raw = None
+        # Set when the key is invalidated mid-load; the result is then not stored
+        self.stale = False
+
+
+class Namespace:
+    """One kind of cached value, with its own key prefix, TTLs and L1 size."""
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        l1_ttl: float,
+        l1_size: int = 1024,
+        version: int = 1,
+        cache_empty: bool = True,
+        l1_needs_l2: bool = False,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.l1_ttl = l1_ttl
+        self.l1_size = l1_size
+        self.cache_empty = cache_empty
+        # L1 only while invalidations can reach every worker
+        self.l1_needs_l2 = l1_needs_l2
+        self._prefix = f"{PREFIX}:{name}:v{version}:"
+        self._l1 = OrderedDict()  # key -> (expires, encoded value)
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+        NAMESPACES[name] = self
+
+    def _key(self, key) -> str:
+        if isinstance(key, (tuple, list)):
+            key = ":".join(str(part) for part in key)
+        key = str(key)
+        if len(key) > MAX_KEY_LENGTH:
+            key = hashlib.sha1(key.encode()).hexdigest()
+        return key
+
+    def _cacheable(self, value) -> bool:
+        if value is None:
+            return False
+        return self.cache_empty or not (isinstance(value, (list, dict, str)) and not value)
+
+    # --- L1 ---
+
+    def _l1_get(self, key: str) -> Optional[bytes]:
+        if self.l1_needs_l2 and not _l2_available():
+            return None
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return None
+            expires, raw = entry
+            if expires <= time.monotonic():
+                del self._l1[key]
+                return None
+            self._l1.move_to_end(key)
+            return raw
+
+    def _l1_put(self, key: str, raw: bytes, ttl: float):
+        if self.l1_needs_l2 and not _l2_available():
+            return
+        with self._lock:
+            self._l1[key] = (time.monotonic() + min(ttl, self.l1_ttl), raw)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    def _discard(self, key: str):
+        with self._lock:
+            self._l1.pop(key, None)
+            for flights in (self._flights, self._async_flights):
+                flight = flights.get(key)
+                if flight is not None:
+                    flight.stale = True
+
+    def _clear_local(self):
+        with self._lock:
+            self._l1.clear()
+
+    # --- both tiers ---
+
+    def _lookup(self, key: str, check_l1: bool = True) -> Optional[bytes]:
+        raw = self._l1_get(key) if check_l1 else None
+        if raw is not None:
+            CACHE_REQUESTS.inc(self.name, "l1_hit")
+            return raw
+        raw = _l2("get", self._prefix + key)
+        if raw is not None:
+            CACHE_REQUESTS.inc(self.name, "l2_hit")
+            self._l1_put(key, raw, self.ttl)
+            return raw
+        CACHE_REQUESTS.inc(self.name, "miss")
+        return None
+
+    def _store(self, key: str, raw: bytes, ttl: float):
+        self._l1_put(key, raw, ttl)
+        _l2("set", self._prefix + key, raw, px=int(ttl * 1000))
+
+    def get(self, key, default=None):
+        if not cache_enabled:
+            return default
+        raw = self._lookup(self._key(key))
+        return default if raw is None else _decode(raw)
+
+    def get_many(self, keys: Iterable) -> dict:
+        """Cached values for whichever of `keys` are present, in one L2 round trip."""
+        if not cache_enabled:
+            return {}
+        found = {}
+        missing = []
+        for key in keys:
+            name = self._key(key)
+            raw = self._l1_get(name)
+            if raw is not None:
+                CACHE_REQUESTS.inc(self.name, "l1_hit")
+                found[key] = raw
+            else:
+                missing.append((key, name))
+        if missing:
+            raws = _l2("mget", [self._prefix + name for _, name in missing]) or [None] * len(missing)
+            for (key, name), raw in zip(missing, raws):
+                if raw is None:
+                    CACHE_REQUESTS.inc(self.name, "miss")
+                    continue
+                CACHE_REQUESTS.inc(self.name, "l2_hit")
+                self._l1_put(name, raw, self.ttl)
+                found[key] = raw
+        return {key: _decode(raw) for key, raw in found.items()}
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        if cache_enabled:
+            self._store(self._key(key), _encode(value), ttl or self.ttl)
+
+    def invalidate(self, *keys):
+        """Drops `keys` here, in Redis and, via pub/sub, in every other worker."""
+        for key in keys:
+            key = self._key(key)
+            self._discard(key)
+            if _l2("delete", self._prefix + key) is not None:
+                _l2("publish", CHANNEL, f"{self.name}\x1f{key}")
+
+    def get_or_load(self, key, loader: Callable[[], Any]):
+        """
+        The cached value for `key`, or the result of calling `loader()`, which
+        is then cached. Only one caller per key loads at a time; the others
+        wait for its result. None is never cached, and neither are empty
+        results when the namespace has cache_empty=False. Exceptions from the
+        loader propagate and nothing is cached.
+        """
+        if not cache_enabled:
+            return loader()
+        key = self._key(key)
+        raw = self._lookup(key)
+        if raw is not None:
+            return _decode(raw)
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(threading.Event())
+        if not leader:
+            flight.waiter.wait()
+            if flight.raw is not None:
+                return _decode(flight.raw)
+            # The load failed; try for ourselves
+            return loader()
+
+        try:
+            value, flight.raw = self._load(key, loader, flight)
+            return value
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.waiter.set()
+
+    def _load(self, key: str, loader, flight: _Flight):
+        lock = None
+        if _redis() is not None:
+            lock = f"{self._prefix}{key}:lock"
+            if not _l2("set", lock, b"1", px=LOCK_TTL * 1000, nx=True):
+                # Another worker is loading this key; give it a moment
+                lock = None
+                raw = self._await_remote(key)
+                if raw is not None:
+                    return _decode(raw), raw
+        try:
+            value = loader()
+            raw = _encode(value)
+            if self._cacheable(value) and not flight.stale:
+                self._store(key, raw, self.ttl)
+            return value, raw
+        finally:
+            if lock is not None:
+                _l2("delete", lock)
+
+    def _await_remote(self, key: str) -> Optional[bytes]:
+        deadline = time.monotonic() + cache_lock_wait
+        while time.monotonic() < deadline and _redis() is not None:
+            time.sleep(0.05)
+            raw = _l2("get", self._prefix + key)
+            if raw is not None:
+                self._l1_put(key, raw, self.ttl)
+                return raw
+        return None
+
+    async def aget_or_load(self, key, loader: Callable[[], Awaitable[Any]]):
+        """
+        get_or_load for the event loop: `loader` is an async callable and
+        Redis is called from a worker thread. Concurrent misses share one
+        load within the loop; there is no cross-worker lock.
+        """
+        if not cache_enabled:
+            return await loader()
+        key = self._key(key)
+        raw = self._l1_get(key)
+        if raw is not None:
+            CACHE_REQUESTS.inc(self.name, "l1_hit")
+            return _decode(raw)
+        if _redis() is not None:
+            raw = await asyncio.to_thread(self._lookup, key, False)
+        else:
+            CACHE_REQUESTS.inc(self.name, "miss")
+        if raw is not None:
+            return _decode(raw)
+
+        flight = self._async_flights.get(key)
+        if flight is not None:
+            raw = await asyncio.shield(flight.waiter)
+            return _decode(raw) if raw is not None else await loader()
+
+        flight = self._async_flights[key] = _Flight(asyncio.get_running_loop().create_future())
+        raw = None
+        try:
+            value = await loader()
+            raw = _encode(value)
+            if self._cacheable(value) and not flight.stale:
+                if _redis() is not None:
+                    await asyncio.to_thread(self._store, key, raw, self.ttl)
+                else:
+                    self._l1_put(key, raw, self.ttl)
+            return value
+        finally:
+            self._async_flights.pop(key, None)
+            flight.waiter.set_result(raw)
+
+
+# Book metadata from OpenLibrary, keyed by work id; it rarely changes
+BOOKS = Namespace("book", ttl=7 * DAY, l1_ttl=HOUR)
+# cached_library rows per search term, and the last Google Books results per
+# query (served while Google is unavailable). Empty results are not cached:
+# the search that found nothing goes on to add the term's books.
+SEARCH = Namespace("search", ttl=10 * MINUTE, l1_ttl=MINUTE, cache_empty=False)
+# Library rows and top-five lists per user; invalidated on every write, so
+# never served from a worker's L1 without Redis to broadcast that
+LIBRARY = Namespace("library", ttl=HOUR, l1_ttl=30, l1_needs_l2=True)
+# Spotify token rows per user; replaced whenever spotipy saves a token
+TOKENS = Namespace("token", ttl=50 * MINUTE, l1_ttl=MINUTE)
+# Gemini song lists per normalised title and author
+RECOMMENDATIONS = Namespace("recs", ttl=30 * DAY, l1_ttl=DAY)
+# Rendered shelf HTML per template, shelf and library version (see
+# fragments.py). Never invalidated: a write changes the version instead, and
+# old versions expire. A 2,000-book shelf is about 2 MB, hence the small L1.
+FRAGMENTS = Namespace("fragment", ttl=DAY, l1_ttl=HOUR, l1_size=64)
+# Private thread ids per user and participant key (see
+# database.participant_key). Only found threads are stored, so a new chat is
+# never hidden, and a thread's participants never change.
+CONVERSATIONS = Namespace("conversation", ttl=7 * DAY, l1_ttl=HOUR)
+# Contact ids per user, most recent thread first (see directory.py);
+# invalidated when the user starts a chat
+CONTACTS = Namespace("contacts", ttl=10 * MINUTE, l1_ttl=MINUTE)
+# Who follows whom, per user and direction (see feed.py); invalidated on
+# every follow and unfollow
+FOLLOWS = Namespace("follows", ttl=HOUR, l1_ttl=MINUTE)
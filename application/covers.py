@@ -0,0 +1,356 @@
+"""
+Cover image proxy.
+
+Templates link covers through /covers/<key>?size=s|m|l instead of hot-linking
+Google Books and OpenLibrary:
+
+    <img src="{{ book.cover_url | cover('m') }}">
+
+The first request for a cover fetches the original once and writes every
+size in WebP and JPEG. After that the cover is served from disk with a
+year-long immutable Cache-Control and an ETag, since the image behind a cover
+URL does not change. Clients that accept WebP get WebP.
+
+A key is the source URL plus an HMAC of it under the app's secret key. The
+endpoint also only fetches from (and redirects to) COVER_HOSTS: the cover
+hosts of Google Books, OpenLibrary and Supabase storage, and the configured
+upstreams. A signature alone is not enough, since users choose their own
+cover URLs. Redirects are followed only within those hosts, and a body over
+MAX_COVER_BYTES, or an image over MAX_COVER_PIXELS, is refused before Pillow
+decodes it.
+
+The disk cache (COVER_CACHE_DIR) is an LRU capped at COVER_CACHE_MAX_MB. A hit
+refreshes the file's mtime, and the oldest covers are evicted once the
+directory outgrows the cap. If the original cannot be fetched, the request
+is redirected to it so the cover still shows.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+from typing import Iterable, Optional
+from urllib.parse import urljoin, urlsplit
+
+from configfile import (
+    cover_cache_dir,
+    cover_cache_max_mb,
+    google_books_url,
+    openlibrary_url,
+    supabase_url,
+)
+from application.breakers import CircuitOpenError, guard
+from application.deadlines import DeadlineExceeded, timeout_for
+from application.integrations import get_pil_image, get_requests
+from application.tracing import span
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+# (width, height) boxes per size: 2x the CSS sizes in profile.html and the
+# other shelves (36x54 list rows, 90x135 feature and splash, 140x210 and the
+# Flutter shelf)
+SIZES = {"s": (72, 108), "m": (180, 270), "l": (300, 450)}
+DEFAULT_SIZE = "m"
+FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+MAX_AGE = 365 * 24 * 3600
+# Hosts whose covers are fetched over https even when linked over http
+HTTPS_HOSTS = ("books.google.com", "books.googleusercontent.com", "covers.openlibrary.org")
+# Hosts (and their subdomains) covers may be fetched from; OpenLibrary
+# redirects to archive.org
+COVER_HOSTS = tuple(
+    host
+    for host in (
+        *HTTPS_HOSTS,
+        "archive.org",
+        *(urlsplit(url or "").hostname for url in (google_books_url, openlibrary_url, supabase_url)),
+    )
+    if host
+)
+MAX_COVER_BYTES = 5 * 1024 * 1024
+MAX_COVER_PIXELS = 25_000_000
+MAX_REDIRECTS = 3
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+_cache_bytes = None
+_evict_lock = threading.Lock()
+
+
+def _digest(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+
+def _signature(url: str, secret) -> str:
+    secret = secret.encode() if isinstance(secret, str) else secret
+    return hmac.new(secret, url.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def cover_key(url: str, secret) -> str:
+    encoded = base64.urlsafe_b64encode(url.encode()).decode().rstrip("=")
+    return f"{_signature(url, secret)}.{encoded}"
+
+
+def parse_key(key: str, secret) -> Optional[str]:
+    """The source URL of a key, or None if it was not signed by us."""
+    signature, _, encoded = key.partition(".")
+    try:
+        url = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not hmac.compare_digest(signature, _signature(url, secret)):
+        return None
+    return url
+
+
+def allowed_source(url: str) -> bool:
+    """Whether `url` is an http(s) URL on one of COVER_HOSTS."""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    host = (parts.hostname or "").lower()
+    return parts.scheme in ("http", "https") and any(
+        host == allowed or host.endswith("." + allowed) for allowed in COVER_HOSTS
+    )
+
+
+def source_url(url: str) -> str:
+    """Where to fetch a cover from; Google Books thumbnails are linked over http."""
+    if url.startswith("http://") and urlsplit(url).hostname in HTTPS_HOSTS:
+        return "https://" + url[len("http://"):]
+    return url
+
+
+def variant_path(digest: str, size: str, fmt: str) -> str:
+    return os.path.join(cover_cache_dir, digest[:2], f"{digest}-{size}.{fmt}")
+
+
+def _has_variants(digest: str) -> bool:
+    return all(
+        os.path.exists(variant_path(digest, size, fmt)) for size in SIZES for fmt in FORMATS
+    )
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def render_variants(content: bytes, digest: str) -> int:
+    """Writes every size and format of one cover; returns the bytes written."""
+    Image = get_pil_image()
+    written = 0
+    with span("pillow cover variants", bytes=len(content)):
+        original = Image.open(BytesIO(content))
+        width, height = original.size
+        if width * height > MAX_COVER_PIXELS:
+            raise ValueError(f"cover is {width}x{height}, over {MAX_COVER_PIXELS} pixels")
+        original = original.convert("RGB")
+        for size, box in SIZES.items():
+            image = original.copy()
+            image.thumbnail(box, Image.Resampling.LANCZOS)
+            for fmt in FORMATS:
+                out = BytesIO()
+                if fmt == "webp":
+                    image.save(out, format="WEBP", quality=80, method=4)
+                else:
+                    image.save(out, format="JPEG", quality=82, optimize=True, progressive=True)
+                _write_atomic(variant_path(digest, size, fmt), out.getvalue())
+                written += out.tell()
+    return written
+
+
+def fetch(url: str) -> bytes:
+    """
+    Downloads a cover, following redirects only within COVER_HOSTS and
+    stopping at MAX_COVER_BYTES. Raises ValueError for anything refused.
+    """
+    requests = get_requests()
+    target = source_url(url)
+    for _ in range(MAX_REDIRECTS + 1):
+        if not allowed_source(target):
+            raise ValueError(f"cover host not allowed: {urlsplit(target).hostname}")
+        with guard("covers", "fetch", target) as call:
+            response = requests.get(
+                target, timeout=timeout_for("covers"), stream=True, allow_redirects=False
+            )
+            try:
+                if response.is_redirect:
+                    call.status(response.status_code)
+                    target = source_url(urljoin(target, response.headers["Location"]))
+                    continue
+                response.raise_for_status()
+                if int(response.headers.get("Content-Length") or 0) > MAX_COVER_BYTES:
+                    raise ValueError("cover is over MAX_COVER_BYTES")
+                content = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    content += chunk
+                    if len(content) > MAX_COVER_BYTES:
+                        raise ValueError("cover is over MAX_COVER_BYTES")
+                call.status(response.status_code, len(content))
+                return bytes(content)
+            finally:
+                response.close()
+    raise ValueError(f"cover redirected more than {MAX_REDIRECTS} times")
+
+
+def ensure_variants(url: str) -> Optional[str]:
+    """
+    Fetches and renders the cover at `url` unless it is already on disk.
+    Returns its digest, or None if it could not be fetched or decoded.
+    Concurrent calls for one URL share a single fetch.
+    """
+    if not allowed_source(url):
+        return None
+    digest = _digest(url)
+    if _has_variants(digest):
+        return digest
+
+    with _inflight_lock:
+        done = _inflight.get(digest)
+        leader = done is None
+        if leader:
+            done = _inflight[digest] = threading.Event()
+    if not leader:
+        done.wait()
+        return digest if _has_variants(digest) else None
+
+    try:
+        written = render_variants(fetch(url), digest)
+    except (get_requests().RequestException, CircuitOpenError, DeadlineExceeded) as e:
+        log.warning("cover fetch failed", url=url, error=e)
+        return None
+    except (OSError, ValueError) as e:
+        # Pillow raises these for bodies that are not images; fetch() for
+        # hosts and sizes it refuses
+        log.warning("cover could not be fetched or decoded", url=url, error=e)
+        return None
+    finally:
+        with _inflight_lock:
+            _inflight.pop(digest, None)
+        done.set()
+
+    _account(written)
+    return digest
+
+
+def _scan() -> list:
+    entries = []
+    for root, _, files in os.walk(cover_cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def _account(added: int):
+    """Tracks the cache size and evicts the least recently used covers past the cap."""
+    global _cache_bytes
+    cap = cover_cache_max_mb * 1024 * 1024
+    with _evict_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(size for _, size, _ in _scan())
+        else:
+            _cache_bytes += added
+        if _cache_bytes <= cap:
+            return
+        # Other workers write here too, so re-read the directory before evicting
+        entries = sorted(_scan())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= cap * 0.9:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        _cache_bytes = total
+    log.info("cover cache evicted", files=evicted, bytes=total)
+
+
+def touch(path: str):
+    """Marks a cover as recently used (at most once an hour)."""
+    try:
+        if time.time() - os.stat(path).st_mtime > 3600:
+            os.utime(path)
+    except OSError:
+        pass
+
+
+def prefetch(urls: Iterable[str]) -> dict:
+    """Renders covers ahead of the first page that shows them."""
+    fetched = failed = 0
+    for url in dict.fromkeys(url for url in urls if url and url.startswith("http")):
+        if ensure_variants(url):
+            fetched += 1
+        else:
+            failed += 1
+    return {"fetched": fetched, "failed": failed}
+
+
+## 🌐 Flask
+
+
+def init_app(app):
+    """Registers /covers/<key> and the `cover` template filter."""
+    from flask import abort, redirect, request, send_file, url_for
+
+    from application.roundtrips import round_trip_budget
+
+    def cover(url, size=DEFAULT_SIZE):
+        """Proxied URL of a cover; anything not on COVER_HOSTS is left alone."""
+        if not url or not allowed_source(str(url)):
+            return url or ""
+        return url_for("cover", key=cover_key(str(url), app.secret_key), size=size)
+
+    app.jinja_env.filters["cover"] = cover
+
+    @app.route("/covers/<key>", endpoint="cover")
+    @round_trip_budget(1)
+    def cover_image(key):
+        url = parse_key(key, app.secret_key)
+        if url is None or not allowed_source(url):
+            abort(404)
+        size = request.args.get("size", DEFAULT_SIZE)
+        if size not in SIZES:
+            abort(404)
+        fmt = "webp" if request.accept_mimetypes["image/webp"] else "jpeg"
+
+        digest = _digest(url)
+        path = variant_path(digest, size, fmt)
+        if os.path.exists(path):
+            touch(path)
+        elif ensure_variants(url) is None:
+            response = redirect(url)
+            response.cache_control.max_age = 300
+            return response
+
+        response = send_file(
+            os.path.abspath(path),
+            mimetype=FORMATS[fmt],
+            conditional=True,
+            etag=f"{digest}-{size}-{fmt}",
+            max_age=MAX_AGE,
+        )
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add("Accept")
+        return response
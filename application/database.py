@@ -1,23 +1,36 @@
 import json
 import token
-from typing import List, Dict, Any, Optional
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 from urllib import response
 from configfile import supabase_key, supabase_url
-from PIL import Image
-import requests
 from io import BytesIO
+import math
+import re
 import uuid
 from datetime import datetime
 from flask import session, jsonify, Response
 
-# Install this package: pip install supabase
-from supabase import create_client, Client
+from application.deadlines import timeout_for
+from application.integrations import get_httpx, get_pil_image, get_requests, get_supabase
+from application.breakers import guard
+from application.cache import CONTACTS, CONVERSATIONS, LIBRARY, SEARCH
+from application import feed
+from application.events import message_sent
+from application.metrics import instrument_httpx_client
+from application.tracing import span
+from application.log import get_logger
+
+if TYPE_CHECKING:
+    # Install this package: pip install supabase
+    from supabase import Client, ClientOptions
+
+log = get_logger(__name__)
 
 # --- Supabase Configuration (Replace with your actual details) ---
 SUPABASE_URL = supabase_url
 SUPABASE_KEY = supabase_key  
 
-def get_supabase_client() -> Client:
+def get_supabase_client() -> "Client":
     """Initializes and returns the Supabase client."""
     # Ensure URL and Key are set before running
     if SUPABASE_URL == "YOUR_SUPABASE_URL" or SUPABASE_KEY == "YOUR_SUPABASE_ANON_KEY":
@@ -25,7 +38,41 @@ def get_supabase_client() -> Client:
             "Please set SUPABASE_URL and SUPABASE_KEY with your actual credentials."
         )
 
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+    return instrument_supabase_client(
+        get_supabase().create_client(
+            SUPABASE_URL, SUPABASE_KEY, options=supabase_options()
+        )
+    )
+
+
+def instrument_supabase_client(client: "Client") -> "Client":
+    """
+    Records every PostgREST and auth call the client makes in the upstream
+    metrics. The client rebuilds its PostgREST session after auth changes
+    (set_session), so the hooks go on each session as it is built.
+    """
+    instrument_httpx_client(client.auth._http_client, "supabase_auth")
+    build = client._init_postgrest_client
+
+    def build_instrumented(*args, **kwargs):
+        postgrest = build(*args, **kwargs)
+        instrument_httpx_client(postgrest.session, "supabase")
+        return postgrest
+
+    client._init_postgrest_client = build_instrumented
+    return client
+
+
+def supabase_options() -> "ClientOptions":
+    """Client options with timeouts derived from the remaining request budget."""
+    timeout = timeout_for("supabase")
+    # storage3 and functions truncate to whole seconds, so round up
+    whole_seconds = max(1, math.ceil(timeout))
+    return get_supabase().ClientOptions(
+        postgrest_client_timeout=get_httpx().Timeout(timeout),
+        storage_client_timeout=whole_seconds,
+        function_client_timeout=whole_seconds,
+    )
 
 
 # --- Table Schemas (PostgreSQL/Supabase) ---
@@ -48,24 +95,51 @@ def get_supabase_client() -> Client:
 
 
 def get_top_five_by_username(username: str) -> list:
+    return get_top_five_for_users([username])[username]
+
+
+def get_top_five_for_users(usernames: List[str]) -> Dict[str, list]:
+    """
+    Top-five lists for several users, {username: items}: cached lists in one
+    cache round trip, and the rest in a single `in` query. Users without a
+    list get [], which is cached too.
+    """
+    usernames = list(dict.fromkeys(usernames))
+    cached = LIBRARY.get_many([("topfive", username) for username in usernames])
+    found = {username: cached[("topfive", username)]
+             for username in usernames if ("topfive", username) in cached}
+    missing = [username for username in usernames if username not in found]
+    if len(missing) == 1:
+        # One user (a profile view): concurrent views share the load
+        [username] = missing
+        found[username] = LIBRARY.get_or_load(
+            ("topfive", username), lambda: _select_top_fives(missing).get(username, [])
+        )
+    elif missing:
+        loaded = _select_top_fives(missing)
+        for username in missing:
+            found[username] = loaded.get(username, [])
+            LIBRARY.set(("topfive", username), found[username])
+    return {username: found[username] for username in usernames}
+
+
+def _select_top_fives(usernames: List[str]) -> Dict[str, list]:
     supabase = get_supabase_client()
     response = (
         supabase.table("topfive")
-        .select("items")
-        .eq("username", username)
-        .limit(1)
+        .select("username, items")
+        .in_("username", usernames)
         .execute()
     )
 
-    # Returns the value of 'items' from the first dictionary found,
-    # or an empty list if no data or no 'items' key is present.
-    if response.data:
-        return response.data[0].get("items", [])
-
-    return []
+    # The first row per user wins, as with the single-user lookup
+    lists = {}
+    for row in response.data:
+        lists.setdefault(row["username"], row.get("items") or [])
+    return lists
 
 
-def amend_top_five(username: str, items: List[Any]):
+def amend_top_five(username: str, items: List[Any], user_id: Optional[str] = None):
     """
     Inserts or updates the top five list for a user.
     Note: Supabase recommends using `upsert` for "insert or update" logic,
@@ -87,11 +161,12 @@ def amend_top_five(username: str, items: List[Any]):
         # Since the original was an INSERT, we keep it as a simple insert.
         response = supabase.table("topfive").upsert(data_to_insert).execute()
 
-        print(
-            f"Top five list inserted/updated for {username}. Status: {response.status_code}"
-        )
+        log.info("top five updated", user=username, rows=len(response.data or []))
+        if user_id and response.data:
+            feed.record(user_id, "topfive", {"username": username, "items": items})
     except Exception as e:
-        print(f"Error amending top five: {e}")
+        log.warning("top five update failed", user=username, error=e)
+    LIBRARY.invalidate(("topfive", username))
 
 
 ## 📖 Library Functions
@@ -99,30 +174,46 @@ def amend_top_five(username: str, items: List[Any]):
 
 def get_library(user: str) -> List[Dict[str, Any]]:
     """Retrieves all library entries for a specific user."""
-    supabase = get_supabase_client()
     try:
-        response = supabase.table("library").select("*").eq("user_id", user).execute()
-        # Returns a list of dictionaries
-        return response.data
+        return LIBRARY.get_or_load(("user", user), lambda: _select_library(user))
     except Exception as e:
-        print(f"Error fetching library: {e}")
+        log.warning("library fetch failed", user=user, error=e)
         return []
 
-def check_book_db(search_term):
+
+def _select_library(user: str) -> List[Dict[str, Any]]:
     supabase = get_supabase_client()
+    response = supabase.table("library").select("*").eq("user_id", user).execute()
+    # Returns a list of dictionaries
+    return response.data
+
+
+def invalidate_library(user: str):
+    """Call after any write to a user's library rows."""
+    LIBRARY.invalidate(("user", user))
+
+
+def check_book_db(search_term):
     try:
-        # We use ilike for text fields, and eq for ISBN if it's an exact match.
-        # We wrap them in or_() to widen the search.
-        response = supabase.table("cached_library") \
-            .select("*") \
-            .or_(f"title.ilike.%{search_term}%,authors.ilike.%{search_term}%,isbn.eq.{search_term}") \
-            .execute()
-        return response.data
+        return SEARCH.get_or_load(("db", search_term), lambda: _search_cached_library(search_term))
     except Exception as e:
-        print(f"Error checking database: {e}")
+        log.warning("book cache lookup failed", query=search_term, error=e)
         return []
-    
-def save_book_to_cache(item):
+
+
+def _search_cached_library(search_term):
+    supabase = get_supabase_client()
+    # We use ilike for text fields, and eq for ISBN if it's an exact match.
+    # We wrap them in or_() to widen the search.
+    response = supabase.table("cached_library") \
+        .select("*") \
+        .or_(f"title.ilike.%{search_term}%,authors.ilike.%{search_term}%,isbn.eq.{search_term}") \
+        .execute()
+    return response.data
+
+
+def cache_row_from_volume(item):
+    """Maps a Google Books volume onto a cached_library row."""
     volume_info = item.get("volumeInfo", {})
     identifiers = volume_info.get("industryIdentifiers", [])
     
@@ -139,11 +230,43 @@ def save_book_to_cache(item):
         "pages": volume_info.get("pageCount"),
         "description": volume_info.get("description", "No description available.")
     }
+    return data
+
 
+def save_book_to_cache(item):
+    data = cache_row_from_volume(item)
     supabase = get_supabase_client()
     # Upsert based on the unique ISBN constraint
     return supabase.table("cached_library").upsert(data, on_conflict="isbn").execute()
 
+
+def save_books_to_cache(items):
+    """Caches several Google Books volumes in one upsert."""
+    rows = [cache_row_from_volume(item) for item in items]
+    # One row per ISBN: Google Books can return two volumes with the same
+    # one, and an upsert may not touch a row twice
+    rows = list({row["isbn"]: row for row in rows if row["isbn"]}.values())
+    if not rows:
+        return None
+    supabase = get_supabase_client()
+    return supabase.table("cached_library").upsert(rows, on_conflict="isbn").execute()
+
+def normalize_isbn(value) -> Optional[str]:
+    """
+    The ISBN as 13 digits, or None if it is not one. ISBN-10s are converted,
+    so both forms of an edition match; see library_isbn_unique.sql, which
+    does the same in the database.
+    """
+    isbn = re.sub(r"[^0-9X]", "", str(value or "").upper())
+    if re.fullmatch(r"[0-9]{13}", isbn):
+        return isbn
+    if not re.fullmatch(r"[0-9]{9}[0-9X]", isbn):
+        return None
+    isbn = "978" + isbn[:9]
+    total = sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(isbn))
+    return isbn + str((10 - total % 10) % 10)
+
+
 def add_book_to_library(
     user: str,
     title: str,
@@ -157,16 +280,12 @@ def add_book_to_library(
     """Adds a new book entry to the library."""
     supabase = get_supabase_client()
     try:
-        # Check if book already exists for user (optional enhancement)
-        # This check isn't in the original SQLite, but is good practice:
-        # response_check = supabase.table("library").select("*").eq("username", user).eq("book", book).execute()
-        # if response_check.data: print("Book already exists!")
-
         data_to_insert = {
             "user_id": user,  # Use user_id from session for consistency
             "title": title,
             "author": author,
             "isbn": isbn,
+            "isbn_normalized": normalize_isbn(isbn),
             "cover_url": cover_url,
             "total_pages": pages,
             "status": "",  # Assuming initial status is 'To Be Read'
@@ -175,11 +294,17 @@ def add_book_to_library(
             "version": version,  # Optional: track version
         }
 
-        response = supabase.table("library").insert(data_to_insert).execute()
+        # A book already on the user's shelves is left as it is
+        response = (
+            supabase.table("library")
+            .upsert(data_to_insert, on_conflict="user_id,isbn_normalized", ignore_duplicates=True)
+            .execute()
+        )
 
-        print(f"Book added to library for {user}. Status: {response.status_code}")
+        log.info("book added", user=user, rows=len(response.data or []))
     except Exception as e:
-        print(f"Error adding book to library: {e}")
+        log.warning("book add failed", user=user, error=e)
+    invalidate_library(user)
 
 
 def add_full_token_info(user: str, token_info: dict):
@@ -200,10 +325,10 @@ def add_full_token_info(user: str, token_info: dict):
 
         supabase.table("tokens").upsert(data).execute()
 
-        print(f"Full token info stored for {user}")
+        log.info("token info stored", user=user)
 
     except Exception as e:
-        print(f"Error storing token info: {e}")
+        log.warning("token info store failed", user=user, error=e)
 
 
 def remove_from_library(user: str, book_id: int):
@@ -218,11 +343,10 @@ def remove_from_library(user: str, book_id: int):
             .execute()
         )
 
-        print(
-            f"Book ID {book_id} removed from library for {user}. Status: {response.status_code}"
-        )
+        log.info("book removed", user=user, book_id=book_id, rows=len(response.data or []))
     except Exception as e:
-        print(f"Error removing book: {e}")
+        log.warning("book remove failed", user=user, book_id=book_id, error=e)
+    invalidate_library(user)
 
 
 def update_book_progress(user: str, book_id: int, pages_read: int):
@@ -245,14 +369,20 @@ def update_book_progress(user: str, book_id: int, pages_read: int):
             .execute()
         )
 
-        print(f"Progress updated for book ID {book_id}. Status: {response.status_code}")
+        log.info("progress updated", book_id=book_id, rows=len(response.data or []))
+        if response.data:
+            feed.record(
+                user, "progress", {"book_id": book_id, "pages_read": pages_read}, book=response.data[0]
+            )
     except Exception as e:
-        print(f"Error updating book progress: {e}")
+        log.warning("progress update failed", book_id=book_id, error=e)
+    invalidate_library(user)
 
 
-def update_book_status(user: str, book_id: int, status: str):
-    """Generic function to update the status of a book."""
+def update_book_status(user: str, book_id: int, status: str) -> Optional[dict]:
+    """Generic function to update the status of a book. Returns the updated row, or None."""
     supabase = get_supabase_client()
+    response = None
     try:
         response = (
             supabase.table("library")
@@ -262,15 +392,16 @@ def update_book_status(user: str, book_id: int, status: str):
             .execute()
         )
 
-        print(
-            f"Status updated to '{status}' for book ID {book_id}. Status: {response.status_code}"
-        )
+        log.info("book status updated", book_id=book_id, status=status, rows=len(response.data or []))
     except Exception as e:
-        print(f"Error updating book status: {e}")
+        log.warning("book status update failed", book_id=book_id, status=status, error=e)
+    invalidate_library(user)
+    return response.data[0] if response is not None and response.data else None
 
-def update_dnf_status(user: str, book_id: int, status: str, dnfreason: str = "No reason provided"):
-    """Generic function to update the status of a book."""
+def update_dnf_status(user: str, book_id: int, status: str, dnfreason: str = "No reason provided") -> Optional[dict]:
+    """Generic function to update the status of a book. Returns the updated row, or None."""
     supabase = get_supabase_client()
+    response = None
     try:
         response = (
             supabase.table("library")
@@ -280,11 +411,11 @@ def update_dnf_status(user: str, book_id: int, status: str, dnfreason: str = "No
             .execute()
         )
 
-        print(
-            f"Status updated to '{status}' for book ID {book_id}. Status: {response.status_code}"
-        )
+        log.info("book status updated", book_id=book_id, status=status, rows=len(response.data or []))
     except Exception as e:
-        print(f"Error updating book status: {e}")
+        log.warning("book status update failed", book_id=book_id, status=status, error=e)
+    invalidate_library(user)
+    return response.data[0] if response is not None and response.data else None
 
 
 # Rewritten functions using the generic update_book_status
@@ -295,12 +426,16 @@ def update_currentbook(user: str, book_id: int):
 
 def dnfbook(user: str, book_id: int, dnfreason: Optional[str] = "No reason provided"):
     """Sets a book's status to 'dnf' (Did Not Finish)."""
-    update_dnf_status(user, book_id, "dnf", dnfreason)
+    book = update_dnf_status(user, book_id, "dnf", dnfreason)
+    if book:
+        feed.record(user, "dnf", {"book_id": book_id, "reason": dnfreason}, book=book)
 
 
 def complete_currentbook(user: str, book_id: int):
     """Sets a book's status to 'completed'."""
-    update_book_status(user, book_id, "completed")
+    book = update_book_status(user, book_id, "completed")
+    if book:
+        feed.record(user, "completed", {"book_id": book_id}, book=book)
 
 
 def save_img_to_db(BACKGROUND_PATH):
@@ -310,24 +445,29 @@ def save_img_to_db(BACKGROUND_PATH):
     TARGET_SIZE = (1750, 1750)
     OVERLAY_MAX_WIDTH = 750
     bucket_name = "playlist"
+    Image = get_pil_image()
     supabase = get_supabase_client()
     try:
         # 1. Open the images
-        response = requests.get(BACKGROUND_PATH)
-        background = Image.open(BytesIO(response.content)).convert("RGB")
-        overlay = Image.open(OVERLAY_PATH).convert("RGBA")
+        with guard("default", "cover_download") as call:
+            response = get_requests().get(BACKGROUND_PATH, timeout=timeout_for("default"))
+            call.status(response.status_code, len(response.content))
+        with span("pillow open"):
+            background = Image.open(BytesIO(response.content)).convert("RGB")
+            overlay = Image.open(OVERLAY_PATH).convert("RGBA")
 
         # 2. Resize the background
-        background = background.resize(TARGET_SIZE, Image.Resampling.LANCZOS)
-
-        # 3. Resize overlay if needed
-        overlay_width, overlay_height = overlay.size
-        if overlay_width > OVERLAY_MAX_WIDTH:
-            ratio = OVERLAY_MAX_WIDTH / overlay_width
-            new_height = int(overlay_height * ratio)
-            overlay = overlay.resize(
-                (OVERLAY_MAX_WIDTH, new_height), Image.Resampling.LANCZOS
-            )
+        with span("pillow resize", size=TARGET_SIZE):
+            background = background.resize(TARGET_SIZE, Image.Resampling.LANCZOS)
+
+            # 3. Resize overlay if needed
+            overlay_width, overlay_height = overlay.size
+            if overlay_width > OVERLAY_MAX_WIDTH:
+                ratio = OVERLAY_MAX_WIDTH / overlay_width
+                new_height = int(overlay_height * ratio)
+                overlay = overlay.resize(
+                    (OVERLAY_MAX_WIDTH, new_height), Image.Resampling.LANCZOS
+                )
 
         # 4. Calculate bottom-right position
         bg_width, bg_height = background.size
@@ -336,36 +476,40 @@ def save_img_to_db(BACKGROUND_PATH):
         position = (bg_width - ov_width - margin, bg_height - ov_height - margin)
 
         # 5. Paste overlay onto background
-        background.paste(overlay, position, overlay)
+        with span("pillow paste"):
+            background.paste(overlay, position, overlay)
 
         # 6. Save to BytesIO buffer instead of file
         output_buffer = BytesIO()
-        background.save(
-            output_buffer, format="JPEG", quality=60, optimize=True, progressive=True
-        )
+        with span("pillow encode", format="JPEG"):
+            background.save(
+                output_buffer, format="JPEG", quality=60, optimize=True, progressive=True
+            )
         output_buffer.seek(0)  # Reset buffer position to beginning
 
         # 7. Generate unique filename
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         unique_id = str(uuid.uuid4())[:8]
         file_path = f"playlist/{timestamp}_{unique_id}.jpg"
-        supabase.storage.from_(bucket_name).upload(
-            path=file_path,
-            file=output_buffer.getvalue(),
-            file_options={"content-type": "image/jpeg", "cache-control": "3600"},
-        )
+        with guard("supabase", "storage_upload") as call:
+            supabase.storage.from_(bucket_name).upload(
+                path=file_path,
+                file=output_buffer.getvalue(),
+                file_options={"content-type": "image/jpeg", "cache-control": "3600"},
+            )
+            call.status(200, output_buffer.getbuffer().nbytes)
 
         # 9. Get public URL
         public_url = supabase.storage.from_(bucket_name).get_public_url(file_path)
 
-        print(f"Success! Image uploaded to Supabase: {public_url}")
+        log.info("playlist cover uploaded", url=public_url)
         return public_url
 
     except FileNotFoundError:
-        print("Error: One of the image files was not found.")
+        log.error("playlist cover image file missing")
         return {"success": False, "url": None, "path": None}
     except Exception as e:
-        print(f"An error occurred: {e}")
+        log.warning("playlist cover failed", error=e)
         return {"success": False, "url": None, "path": None}
 
 
@@ -436,6 +580,18 @@ def diagnose_supabase_storage(supabase_client, bucket_name="playlist"):
     print("\n=== END DIAGNOSTICS ===\n")
 
 
+def get_user_id_for_token(token: Optional[str]) -> Optional[str]:
+    """The id of the user a Supabase access token belongs to, as Supabase Auth says; None if it is not valid."""
+    if not token:
+        return None
+    try:
+        response = get_supabase_client().auth.get_user(token)
+    except Exception as e:
+        log.info("access token rejected", error=e)
+        return None
+    return str(response.user.id) if response and response.user else None
+
+
 def get_my_threads():
     supabase = get_supabase_client()
     token = session.get("access_token")
@@ -453,34 +609,79 @@ def get_my_threads():
     return response.data
 
 
-def is_new(user, recipient):
-    supabase = get_supabase_client()
-    try:
-        response = supabase.rpc(
-            "check_conversation_exists", {"u_id": user, "r_id": recipient}
-        ).execute()
+def participant_key(user_ids) -> str:
+    """The canonical key for a set of participants: their ids, sorted and comma-joined."""
+    return ",".join(sorted({str(user_id) for user_id in user_ids if user_id}))
+
 
-        # The raw data returned by the RPC call
-        raw_data = response.data
+def find_conversation(user_id, participant_ids, token) -> Optional[str]:
+    """
+    The id of user_id's private thread with exactly these participants (user_id
+    included), or None. Found ids are cached per user, so opening the same
+    chat again needs no round trip.
+    """
+    key = participant_key([user_id, *participant_ids])
 
-        # Determine if a conversation exists:
+    def load():
+        supabase = get_supabase_client()
+        supabase.postgrest.auth(token)
+        response = supabase.rpc("find_conversation", {"participant_ids": key.split(",")}).execute()
+        return response.data or None
 
-        if isinstance(raw_data, bool):
-            # Case 1: Supabase client returned the boolean directly
-            conversation_exists = raw_data
-        elif isinstance(raw_data, list) and raw_data:
-            # Case 2: Supabase client returned a list (of dictionaries)
-            # Safely access the value. Note: The key is the function name.
-            conversation_exists = raw_data[0]["check_conversation_exists"]
-        else:
-            # Fallback for unexpected empty or non-existent data
-            return True  # Assume it's new if data is unexpected
+    return CONVERSATIONS.get_or_load((user_id, key), load)
 
-        # If the conversation exists (True), then it is NOT new (False)
-        return not conversation_exists
 
+def create_conversation(user_id, participant_ids, name, thread_type, token) -> str:
+    """
+    Creates a thread for user_id and participant_ids and returns its id. For
+    a private thread that already exists (say, from a double submit) that
+    thread's id is returned instead, so there is only ever one.
+    """
+    ids = sorted({str(user_id), *map(str, participant_ids)})
+    supabase = get_supabase_client()
+    supabase.postgrest.auth(token)
+    response = supabase.rpc(
+        "create_new_chat",
+        {"participant_ids": ids, "thread_name": name, "thread_type": thread_type},
+    ).execute()
+    thread_id = response.data
+    CONTACTS.invalidate(*ids)
+    if thread_type == "private":
+        key = participant_key(ids)
+        for participant in ids:
+            CONVERSATIONS.set((participant, key), thread_id)
+    return thread_id
+
+
+def get_contacts(user_id, token) -> List[str]:
+    """Ids of everyone user_id shares a thread with, most recently active thread first."""
+    supabase = get_supabase_client()
+    supabase.postgrest.auth(token)
+    response = (
+        supabase.table("thread_participants")
+        .select("threads!inner(updated_at, thread_participants(user_id))")
+        .eq("user_id", user_id)
+        .execute()
+    )
+    threads = sorted(
+        (row["threads"] for row in response.data),
+        key=lambda thread: thread.get("updated_at") or "",
+        reverse=True,
+    )
+    contacts = {}
+    for thread in threads:
+        for participant in thread.get("thread_participants") or ():
+            if str(participant["user_id"]) != str(user_id):
+                contacts.setdefault(str(participant["user_id"]), None)
+    return list(contacts)
+
+
+def is_new(user, recipient):
+    """True if user has no private thread with recipient yet."""
+    try:
+        return find_conversation(user, [recipient], session.get("access_token")) is None
     except Exception as e:
-        print(f"Error calling RPC: {e}")
+        log.warning("find_conversation failed", error=e)
         # Return False, assuming a conversation might exist, or something went wrong
         return False
 
@@ -532,7 +733,7 @@ def get_latest_messages_for_modal(limit=5):
         return messages_resp.data
 
     except Exception as e:
-        print(f"Error fetching aggregate messages: {e}")
+        log.warning("latest messages failed", error=e)
         return []
 
 
@@ -560,43 +761,35 @@ def get_my_inbox():
     """).eq("user_id", session.get("user_id")).execute()
 
         # Extract the nested 'threads' object into a clean list
-        threads = [item["threads"] for item in response.data]
-        # Note: 'auth_users' would be your custom profiles table
-        return response.data
-    except Exception as e:
-        # CHECK YOUR TERMINAL FOR THIS OUTPUT
-        print("--- INBOX ERROR DEBUG ---")
-        print(f"Error Type: {type(e)}")
-        print(f"Error Message: {e}")
-        print("-------------------------")
-        return f"Could not load inbox. Error: {e}", 500
-
+        return [item["threads"] for item in response.data]
+    except Exception:
+        log.exception("inbox load failed")
+        raise
 
-def send_message(thread_id, sender_id, content, token, shared_data):
 
+def send_message(thread_id, sender_id, content, token, shared_data, client_id=None):
+    """
+    Stores a message and bumps its thread in one round trip (the
+    send_message RPC, see supabase/migrations), then pushes it to the
+    thread's participants. Returns the stored row; raises if it was not
+    stored. Sends repeated with the same client_id store the message once.
+    """
     supabase = get_supabase_client()
-    supabase.auth.set_session(token, "")
-
-    try:
-        # 1. Insert the message
-        # RLS will automatically verify if the user belongs to this thread
-        message_data = {
-            "thread_id": thread_id,
-            "sender_id": sender_id,
-            "content": content,
-            "shared_data": shared_data,  # Store the shared data as JSON
-        }
-        supabase.table("messages").insert(message_data).execute()
-        update_time = datetime.now().isoformat()
-        # 2. Update the thread's 'updated_at' timestamp
-        # This pushes the thread to the top of the inbox
-        supabase.table("threads").update({"updated_at": update_time}).eq(
-            "id", thread_id
-        ).execute()
-
-    except Exception as e:
-        print(f"Error sending message: {e}")
-        # In a real app, you'd want to flash an error message to the user here
-
-    # Redirect back to the chat room
-    return {"success": True, "message": "Message sent successfully"}
+    # The bearer token is all RLS needs; set_session would first look the
+    # user up, a round trip of its own
+    supabase.postgrest.auth(token)
+
+    response = supabase.rpc(
+        "send_message",
+        {
+            "p_thread_id": thread_id,
+            "p_sender_id": sender_id,
+            "p_content": content,
+            "p_shared_data": shared_data,
+            "p_client_id": client_id or str(uuid.uuid4()),
+        },
+    ).execute()
+    [result] = response.data
+    stored = result["message"]
+    message_sent(thread_id, sender_id, result["participants"], stored, stored.get("created_at"))
+    return stored
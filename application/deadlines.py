@@ -0,0 +1,100 @@
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from flask import g, has_app_context, jsonify, request
+from configfile import (
+    request_budget,
+    supabase_timeout,
+    google_books_timeout,
+    openlibrary_timeout,
+    gemini_timeout,
+    spotify_timeout,
+    default_timeout,
+)
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+# --- Per-upstream default timeouts (seconds) ---
+# Each outbound call uses the smaller of its upstream default and whatever is
+# left of the current request's budget.
+UPSTREAM_TIMEOUTS = {
+    "supabase": supabase_timeout,
+    "google_books": google_books_timeout,
+    "openlibrary": openlibrary_timeout,
+    "gemini": gemini_timeout,
+    "spotify": spotify_timeout,
+    "default": default_timeout,
+}
+
+# Anything shorter than this is not worth opening a socket for.
+MIN_TIMEOUT = 0.05
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the request budget is spent before an outbound call."""
+
+    def __init__(self, upstream: str):
+        self.upstream = upstream
+        super().__init__(
+            f"Request deadline exceeded: no time left to call {upstream}"
+        )
+
+
+def start_deadline(budget: Optional[float] = None):
+    """Attaches a deadline to the current app context (request or job)."""
+    g.deadline = time.monotonic() + (request_budget if budget is None else budget)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current budget, or None when no deadline is set."""
+    if not has_app_context():
+        return None
+    deadline = g.get("deadline")
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def timeout_for(upstream: str) -> float:
+    """
+    Returns the timeout to use for a call to `upstream`, derived from the
+    remaining request budget. Raises DeadlineExceeded once the budget is gone.
+    """
+    default = UPSTREAM_TIMEOUTS.get(upstream, UPSTREAM_TIMEOUTS["default"])
+    left = remaining()
+    if left is None:
+        return default
+    if left < MIN_TIMEOUT:
+        raise DeadlineExceeded(upstream)
+    return min(default, left)
+
+
+@contextmanager
+def deadline_scope(budget: float):
+    """
+    Runs a block under its own budget, e.g. a background job that has no
+    request deadline of its own. The previous deadline is restored afterwards.
+    """
+    previous = g.get("deadline")
+    start_deadline(budget)
+    try:
+        yield
+    finally:
+        g.deadline = previous
+
+
+def init_app(app):
+    """Registers the per-request deadline and the 504 handler on the app."""
+
+    @app.before_request
+    def _attach_deadline():
+        start_deadline()
+
+    @app.errorhandler(DeadlineExceeded)
+    def _deadline_exceeded(e):
+        log.warning("deadline exceeded", path=request.path, upstream=e.upstream)
+        if "Dart" in request.headers.get("User-Agent", ""):
+            return jsonify({"error": str(e), "upstream": e.upstream}), 504
+        return str(e), 504
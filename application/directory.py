@@ -0,0 +1,237 @@
+"""
+The user directory behind the new-chat typeahead.
+
+Each worker keeps every profile's display name in a sorted, lower-cased
+index and answers prefix searches from it with bisect, so a keystroke costs
+no query. A background thread fills the index once, then fetches only the
+profiles changed since (a higher directory_seq, see supabase/migrations)
+every DIRECTORY_REFRESH seconds. It rebuilds the index every
+DIRECTORY_REBUILD seconds, which drops deleted users and picks up changes
+that committed out of sequence order.
+
+    GET /directory?q=ali            -> {"users": [...], "next": "<cursor>"}
+    GET /directory?q=ali&cursor=<cursor>
+
+Contacts (the people the signed-in user shares a thread with, most recent
+first) lead the first page. Other matches follow in name order, and `next`
+resumes after the last of them. It is null on the last page.
+"""
+import base64
+import json
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, List, Optional, Tuple
+
+from configfile import directory_page_size, directory_rebuild, directory_refresh
+from application.cache import CONTACTS
+from application.database import get_contacts, get_supabase_client
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+SYNC_BATCH = 1000
+MAX_PAGE_SIZE = 50
+# How long a request waits for a new worker's first build
+READY_WAIT = 5.0
+
+_keys: List[Tuple[str, str]] = []  # sorted (lower-cased name, id)
+_profiles: Dict[str, Tuple[str, str]] = {}  # id -> (lower-cased name, display name)
+_seq = 0
+_lock = threading.Lock()
+_ready = threading.Event()
+_syncer = None
+_syncer_pid = None
+_syncer_lock = threading.Lock()
+
+
+def _fetch_changed(after: int) -> list:
+    """Profiles with a directory_seq above `after`, in sequence order."""
+    supabase = get_supabase_client()
+    rows = []
+    while True:
+        page = (
+            supabase.table("profiles")
+            .select("id, display_name, directory_seq")
+            .gt("directory_seq", after)
+            .order("directory_seq")
+            .limit(SYNC_BATCH)
+            .execute()
+            .data
+        )
+        rows.extend(page)
+        if len(page) < SYNC_BATCH:
+            return rows
+        after = page[-1]["directory_seq"]
+
+
+def _rebuild():
+    global _keys, _profiles, _seq
+    rows = _fetch_changed(0)
+    profiles = {
+        str(row["id"]): (row["display_name"].lower(), row["display_name"])
+        for row in rows
+        if row.get("display_name")
+    }
+    keys = sorted((name, user_id) for user_id, (name, _) in profiles.items())
+    with _lock:
+        _keys, _profiles = keys, profiles
+        _seq = max((row["directory_seq"] or 0 for row in rows), default=0)
+
+
+def _refresh():
+    global _seq
+    rows = _fetch_changed(_seq)
+    if not rows:
+        return
+    with _lock:
+        for row in rows:
+            user_id = str(row["id"])
+            old = _profiles.pop(user_id, None)
+            if old is not None:
+                index = bisect_left(_keys, (old[0], user_id))
+                if index < len(_keys) and _keys[index] == (old[0], user_id):
+                    del _keys[index]
+            if row.get("display_name"):
+                _profiles[user_id] = (row["display_name"].lower(), row["display_name"])
+                insort(_keys, (_profiles[user_id][0], user_id))
+        _seq = max(_seq, rows[-1]["directory_seq"] or 0)
+
+
+def _sync():
+    rebuilt_at = None
+    while True:
+        try:
+            if rebuilt_at is None or time.monotonic() - rebuilt_at >= directory_rebuild:
+                _rebuild()
+                rebuilt_at = time.monotonic()
+                _ready.set()
+            else:
+                _refresh()
+        except Exception as e:
+            log.warning("directory sync failed", error=e)
+        time.sleep(directory_refresh)
+
+
+def _ensure_syncer():
+    """Starts this worker's sync thread."""
+    global _syncer, _syncer_pid
+    with _syncer_lock:
+        if _syncer_pid != os.getpid() or not _syncer.is_alive():
+            if _syncer_pid != os.getpid():
+                _ready.clear()
+            _syncer = threading.Thread(target=_sync, name="directory-sync", daemon=True)
+            _syncer.start()
+            _syncer_pid = os.getpid()
+
+
+def _wait_ready():
+    _ensure_syncer()
+    if not _ready.wait(READY_WAIT):
+        log.warning("directory not loaded yet")
+
+
+def encode_cursor(key: Tuple[str, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, str]]:
+    if not cursor:
+        return None
+    try:
+        name, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(name), str(user_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def search(prefix: str, after: Optional[Tuple[str, str]] = None, limit: int = directory_page_size,
+           exclude=()) -> Tuple[List[dict], Optional[Tuple[str, str]]]:
+    """Up to `limit` users whose names start with `prefix`, after `after`; and the next cursor key."""
+    _wait_ready()
+    prefix = prefix.strip().lower()
+    found = []
+    with _lock:
+        start = bisect_left(_keys, (prefix, ""))
+        if after is not None:
+            start = max(start, bisect_right(_keys, after))
+        for key in _keys[start:]:
+            if not key[0].startswith(prefix):
+                break
+            if key[1] in exclude:
+                continue
+            if len(found) == limit:
+                return found, (found[-1]["name_key"], found[-1]["id"])
+            found.append({"id": key[1], "display_name": _profiles[key[1]][1], "name_key": key[0]})
+    return found, None
+
+
+def contacts(user_id: str, token: str) -> List[dict]:
+    """The user's contacts that are in the directory, most recent first."""
+    _wait_ready()
+    ids = CONTACTS.get_or_load(user_id, lambda: get_contacts(user_id, token))
+    with _lock:
+        return [
+            {"id": contact_id, "display_name": _profiles[contact_id][1], "contact": True}
+            for contact_id in ids
+            if contact_id in _profiles
+        ]
+
+
+def display_names(user_ids) -> Dict[str, str]:
+    """{id: display name} for those of `user_ids` in the directory."""
+    _wait_ready()
+    with _lock:
+        return {user_id: _profiles[user_id][1] for user_id in user_ids if user_id in _profiles}
+
+
+def page(user_id: str, token: str, prefix: str, cursor: Optional[str], limit: int) -> dict:
+    """One page of /directory results for `user_id`."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = decode_cursor(cursor)
+    known = contacts(user_id, token)
+    exclude = {contact["id"] for contact in known} | {str(user_id)}
+    folded = prefix.strip().lower()
+    users = []
+    if after is None:
+        users = [c for c in known if c["display_name"].lower().startswith(folded)][:limit]
+    if not folded:
+        # No query: only contacts, so the page opens with a handful of rows
+        return {"users": users, "next": None}
+    if len(users) == limit:
+        # Contacts filled the page; the next one starts the other matches
+        return {"users": users, "next": encode_cursor((folded, ""))}
+    found, next_key = search(prefix, after, limit - len(users), exclude)
+    users += [{"id": f["id"], "display_name": f["display_name"], "contact": False} for f in found]
+    return {"users": users, "next": encode_cursor(next_key) if next_key else None}
+
+
+## 🌐 Flask
+
+
+def init_app(app):
+    """Registers GET /directory for the signed-in user."""
+    from flask import jsonify, request, session
+
+    from application.admission import INTERACTIVE, priority
+
+    @app.route("/directory")
+    @priority(INTERACTIVE)
+    def directory():
+        user_id = session.get("user_id")
+        if not user_id:
+            return jsonify({"error": "Not signed in"}), 401
+        try:
+            limit = int(request.args.get("limit", directory_page_size))
+        except ValueError:
+            limit = directory_page_size
+        return jsonify(
+            page(
+                user_id,
+                session.get("access_token"),
+                request.args.get("q", ""),
+                request.args.get("cursor"),
+                limit,
+            )
+        )
@@ -0,0 +1,345 @@
+"""
+Live chat and inbox updates, pushed to browsers as server-sent events.
+
+send_message publishes, to the thread's participants:
+
+- "message": the new message row
+- "thread": the thread's new updated_at, to move it to the top of the inbox
+- "unread": one more unread message in the thread (everyone but the sender)
+
+GET /events streams the signed-in user's events over one long-lived
+connection:
+
+    const events = new EventSource("/events");
+    events.addEventListener("message", (e) => append(JSON.parse(e.data)));
+
+Every event has an id. A reconnecting EventSource sends the last one back as
+Last-Event-ID and is sent what it missed from a per-user buffer of the last
+EVENTS_REPLAY events. If it missed more than that, or this worker has no
+record of the gap, it gets a "resync" event and should reload once. Streams
+end after EVENTS_MAX_AGE seconds, and the browser reconnects on its own.
+
+Events reach every worker over the cache's Redis connection (REDIS_URL;
+"memory://" is the in-process stand-in). Pages only open /events when
+live() says so: the server must be able to hold a stream open without
+blocking other requests (see EVENTS_STREAMING), and Redis must be there
+to carry events between workers. Outside native async routes a worker holds
+at most EVENTS_MAX_STREAMS streams. Otherwise /events answers 204, which
+stops an EventSource, and the chat page polls /chat/<id>/messages while the
+inbox reloads now and then.
+"""
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Iterable, Iterator, List, Optional
+
+from configfile import (
+    events_heartbeat,
+    events_inbox_refresh,
+    events_max_age,
+    events_max_streams,
+    events_poll_interval,
+    events_replay,
+    events_streaming,
+)
+from application import cache
+from application.admission import ASYNC_ENVIRON_KEY
+from application.metrics import Counter, Gauge
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+CHANNEL = f"{cache.PREFIX}:events"
+# How long the browser waits before reconnecting, in milliseconds
+RETRY_MS = 3000
+MAX_USERS = 10000
+KEEPALIVE = ": keepalive\n\n"
+
+EVENTS_PUBLISHED = Counter(
+    "events_published_total",
+    "Live events published, by event name.",
+    ("event",),
+)
+EVENT_STREAMS = Gauge(
+    "event_streams_open",
+    "Server-sent event streams currently open on this worker.",
+)
+
+
+class _History:
+    """One user's recent events, and the oldest id from which it has them all."""
+
+    __slots__ = ("events", "complete_since")
+
+    def __init__(self, complete_since: int):
+        self.events = deque(maxlen=events_replay)
+        self.complete_since = complete_since
+
+    def append(self, event: dict):
+        if len(self.events) == self.events.maxlen:
+            self.complete_since = self.events[0]["id"]
+        self.events.append(event)
+
+
+class Subscription:
+    """One open stream's queue of events; fed from the subscriber thread."""
+
+    def __init__(self, user_id: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.user_id = user_id
+        self.overflowed = False
+        self._loop = loop
+        self._queue = asyncio.Queue(events_replay) if loop else queue.Queue(events_replay)
+
+    def deliver(self, event: dict):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._put, event)
+        else:
+            self._put(event)
+
+    def _put(self, event: dict):
+        try:
+            self._queue.put_nowait(event)
+        except (queue.Full, asyncio.QueueFull):
+            # A client this far behind is told to reload instead
+            self.overflowed = True
+
+    def get(self, timeout: float) -> Optional[dict]:
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout: float) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+_subscriptions = {}  # user id -> set of Subscription
+_histories = OrderedDict()  # user id -> _History
+# Events before this may be missing from any history created now
+_horizon = time.time_ns()
+# Streams open on this worker's threads, as opposed to its event loop
+_thread_streams = 0
+_lock = threading.Lock()
+
+
+def _deliver(raw):
+    """Records an event and hands it to the user's open streams on this worker."""
+    global _horizon
+    payload = json.loads(raw)
+    event = {"id": payload["id"], "event": payload["event"], "data": payload["data"]}
+    with _lock:
+        for user_id in payload["users"]:
+            history = _histories.get(user_id)
+            if history is None:
+                history = _histories[user_id] = _History(_horizon)
+            _histories.move_to_end(user_id)
+            history.append(event)
+            for subscription in _subscriptions.get(user_id, ()):
+                subscription.deliver(event)
+        while len(_histories) > MAX_USERS:
+            _, evicted = _histories.popitem(last=False)
+            if evicted.events:
+                _horizon = max(_horizon, evicted.events[-1]["id"])
+
+
+cache.subscribe(CHANNEL, _deliver)
+
+
+def publish(user_ids: Iterable[str], event: str, data) -> int:
+    """Sends `event` to every open stream of `user_ids`, on every worker; returns its id."""
+    users = sorted({str(user_id) for user_id in user_ids if user_id})
+    if not users:
+        return 0
+    event_id = time.time_ns()
+    raw = json.dumps(
+        {"id": event_id, "users": users, "event": event, "data": data},
+        separators=(",", ":"),
+        default=str,
+    )
+    EVENTS_PUBLISHED.inc(event)
+    if not cache.publish(CHANNEL, raw):
+        # No Redis (or no worker listening yet): this worker's streams only
+        _deliver(raw)
+    return event_id
+
+
+def message_sent(thread_id: str, sender_id: str, participants: List[str], message: dict, updated_at: str):
+    """The events for one new chat message."""
+    publish(participants, "message", message)
+    publish(participants, "thread", {"thread_id": thread_id, "updated_at": updated_at})
+    publish(
+        [user_id for user_id in participants if user_id != sender_id],
+        "unread",
+        {"thread_id": thread_id, "increment": 1},
+    )
+
+
+def replay(user_id: str, last_event_id: Optional[str]) -> Optional[List[dict]]:
+    """Events after `last_event_id`, or None if some of them are no longer known."""
+    if not last_event_id:
+        return []
+    try:
+        last = int(last_event_id)
+    except ValueError:
+        return None
+    with _lock:
+        history = _histories.get(user_id)
+        complete_since = history.complete_since if history else _horizon
+        if last < complete_since:
+            return None
+        return [event for event in (history.events if history else ()) if event["id"] > last]
+
+
+def subscribe(user_id: str, loop: Optional[asyncio.AbstractEventLoop] = None) -> Subscription:
+    # Connects to Redis, and so starts the subscriber thread, if not already
+    cache.connected()
+    subscription = Subscription(user_id, loop)
+    with _lock:
+        _subscriptions.setdefault(user_id, set()).add(subscription)
+    EVENT_STREAMS.inc()
+    return subscription
+
+
+def unsubscribe(subscription: Subscription):
+    with _lock:
+        subscriptions = _subscriptions.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del _subscriptions[subscription.user_id]
+    EVENT_STREAMS.dec()
+
+
+def format_event(event: dict) -> str:
+    data = json.dumps(event["data"], separators=(",", ":"), default=str)
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {data}\n\n"
+
+
+def _resync() -> str:
+    return format_event({"id": time.time_ns(), "event": "resync", "data": {}})
+
+
+def _opening(subscription: Subscription, last_event_id: Optional[str]):
+    """The retry hint, the missed events (or a resync) and the last id sent."""
+    missed = replay(subscription.user_id, last_event_id)
+    if missed is None:
+        return [f"retry: {RETRY_MS}\n\n", _resync()], time.time_ns()
+    last = missed[-1]["id"] if missed else int(last_event_id or 0)
+    return [f"retry: {RETRY_MS}\n\n", *map(format_event, missed)], last
+
+
+def stream(user_id: str, last_event_id: Optional[str] = None) -> Iterator[str]:
+    """A user's event stream, for a WSGI response body."""
+    subscription = subscribe(user_id)
+    try:
+        opening, last = _opening(subscription, last_event_id)
+        yield from opening
+        closes = time.monotonic() + events_max_age
+        while time.monotonic() < closes:
+            event = subscription.get(min(events_heartbeat, closes - time.monotonic()))
+            if subscription.overflowed:
+                yield _resync()
+                return
+            if event is None:
+                yield KEEPALIVE
+            elif event["id"] > last:
+                last = event["id"]
+                yield format_event(event)
+    finally:
+        unsubscribe(subscription)
+
+
+async def astream(user_id: str, last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+    """stream() for the ASGI app: waits on the event loop instead of a thread."""
+    subscription = subscribe(user_id, asyncio.get_running_loop())
+    try:
+        opening, last = _opening(subscription, last_event_id)
+        for chunk in opening:
+            yield chunk
+        closes = time.monotonic() + events_max_age
+        while time.monotonic() < closes:
+            event = await subscription.aget(min(events_heartbeat, closes - time.monotonic()))
+            if subscription.overflowed:
+                yield _resync()
+                return
+            if event is None:
+                yield KEEPALIVE
+            elif event["id"] > last:
+                last = event["id"]
+                yield format_event(event)
+    finally:
+        unsubscribe(subscription)
+
+
+## 🌐 Flask
+
+
+def live() -> bool:
+    """Whether pages should listen on /events for this request, rather than poll."""
+    from flask import has_request_context, request
+
+    if has_request_context() and request.environ.get(ASYNC_ENVIRON_KEY):
+        return cache.connected()
+    return events_streaming and _thread_streams < events_max_streams and cache.connected()
+
+
+def _claim_thread_stream() -> bool:
+    """Takes one of this worker's EVENTS_MAX_STREAMS; False when all are open."""
+    global _thread_streams
+    with _lock:
+        if _thread_streams >= events_max_streams:
+            return False
+        _thread_streams += 1
+        return True
+
+
+def _release_thread_stream():
+    global _thread_streams
+    with _lock:
+        _thread_streams -= 1
+
+
+def event_response(body):
+    """A text/event-stream response that proxies will not buffer."""
+    from flask import Response
+
+    response = Response(body, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def init_app(app):
+    """Registers GET /events for the signed-in user, and live() for templates."""
+    from flask import Response, request, session
+
+    from application.admission import INTERACTIVE, priority
+
+    app.jinja_env.globals.update(
+        live_events=live,
+        events_poll_interval=events_poll_interval,
+        events_inbox_refresh=events_inbox_refresh,
+    )
+
+    @app.route("/events")
+    @priority(INTERACTIVE)
+    def events():
+        user_id = session.get("user_id")
+        if not user_id:
+            return {"error": "Not signed in"}, 401
+        if not live() or not _claim_thread_stream():
+            # Tells an EventSource to stop reconnecting; the pages poll instead
+            return Response(status=204)
+        last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+        # A plain generator, not stream_with_context: the request (and its
+        # worker slot) is finished once the headers are sent
+        response = event_response(stream(user_id, last_event_id))
+        # Closed by the server when the stream ends, however it ends
+        response.call_on_close(_release_thread_stream)
+        return response
@@ -0,0 +1,321 @@
+"""
+Friends activity feed, fanned out on write.
+
+The library and top-five writes record activity for the people who follow
+the user:
+
+- "progress": pages read in a book
+- "completed" and "dnf": a book finished, or put down
+- "topfive": a new top five
+
+Each activity is stored once in the activity table (see supabase/migrations)
+and then pushed onto the Redis timeline of every follower. A timeline holds
+that follower's newest FEED_LENGTH activities, and one pipeline of LPUSH and
+LTRIM per follower keeps it capped. Reading a feed is then a single LRANGE.
+
+record stores the activity with the user's own access token, which the
+table's RLS policy requires, and a write never waits for the fan-out.
+record appends the activity (never the token) to a Redis list, and a
+delivery thread in each worker fans it out, the way the outbox drains sends
+(see outbox.py): one worker at a time under a lock, retried up to
+MAX_ATTEMPTS times. An activity that is never fanned out still reaches
+feeds that read the table.
+
+Accounts with more than FEED_FANOUT_LIMIT followers are not fanned out to.
+Their followers' feeds read their recent activity from the table when the
+feed is read (one `in` query covering all of them) and merge it in.
+Without Redis there are no timelines, and every feed is read that way.
+
+Following someone adds their activity from then on; a timeline is not
+backfilled.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from configfile import feed_fanout_limit, feed_length
+from application import cache, database
+from application.cache import FOLLOWS
+from application.metrics import Counter
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+FEED_PAGE = 50
+
+DELIVERY_KEY = f"{cache.PREFIX}:feed:deliveries"
+LOCK_KEY = f"{cache.PREFIX}:feed:lock"
+LOCK_TTL = 30
+MAX_ATTEMPTS = 3
+# Seconds between looks at an idle queue, and after a failed fan-out
+POLL_INTERVAL = 1.0
+RETRY_DELAY = 2.0
+
+ACTIVITY_RECORDED = Counter(
+    "feed_activity_total",
+    "Feed activities recorded, by kind and delivery: fanned_out, on_read or failed.",
+    ("kind", "delivery"),
+)
+
+_wake = threading.Event()
+_deliverer = None
+_deliverer_pid = None
+_deliverer_lock = threading.Lock()
+
+
+def _timeline_key(user_id: str) -> str:
+    return f"{cache.PREFIX}:feed:{user_id}"
+
+
+## 👥 Follows
+
+
+def get_followers(user_id: str) -> List[str]:
+    """Follower ids, up to one past FEED_FANOUT_LIMIT (enough to tell a large account)."""
+
+    def load():
+        response = (
+            database.get_supabase_client()
+            .table("follows")
+            .select("follower_id")
+            .eq("followee_id", user_id)
+            .limit(feed_fanout_limit + 1)
+            .execute()
+        )
+        return [str(row["follower_id"]) for row in response.data]
+
+    return FOLLOWS.get_or_load(("followers", user_id), load)
+
+
+def get_following(user_id: str) -> List[Dict]:
+    """Who user_id follows, as {"id", "follower_count"}."""
+
+    def load():
+        response = (
+            database.get_supabase_client()
+            .table("follows")
+            .select("followee_id, profiles!followee_id(follower_count)")
+            .eq("follower_id", user_id)
+            .execute()
+        )
+        return [
+            {
+                "id": str(row["followee_id"]),
+                "follower_count": (row.get("profiles") or {}).get("follower_count") or 0,
+            }
+            for row in response.data
+        ]
+
+    return FOLLOWS.get_or_load(("following", user_id), load)
+
+
+def follow(user_id: str, followee_id: str, token: str):
+    supabase = database.get_supabase_client()
+    supabase.postgrest.auth(token)
+    supabase.table("follows").upsert(
+        {"follower_id": user_id, "followee_id": followee_id},
+        on_conflict="follower_id,followee_id",
+    ).execute()
+    FOLLOWS.invalidate(("following", user_id), ("followers", followee_id))
+
+
+def unfollow(user_id: str, followee_id: str, token: str):
+    supabase = database.get_supabase_client()
+    supabase.postgrest.auth(token)
+    supabase.table("follows").delete().eq("follower_id", user_id).eq(
+        "followee_id", followee_id
+    ).execute()
+    FOLLOWS.invalidate(("following", user_id), ("followers", followee_id))
+
+
+## ✍️ Writing
+
+
+def request_token() -> Optional[str]:
+    """The access token of the request being served: the session's, or Flutter's bearer token."""
+    from flask import has_request_context, request, session
+
+    if not has_request_context():
+        return None
+    if session.get("access_token"):
+        return session["access_token"]
+    # Flutter has no Flask session; it sends its Supabase token instead
+    auth_header = request.headers.get("Authorization")
+    return auth_header.split(" ")[-1] if auth_header else None
+
+
+def record(
+    user_id: str,
+    kind: str,
+    data: dict,
+    book: Optional[dict] = None,
+    token: Optional[str] = None,
+):
+    """Stores an activity by user_id and queues its fan-out. Never raises.
+
+    book is the library row a book activity is about; its title, author and
+    cover are copied into the activity. token is the user's access token,
+    by default the one the request carries.
+    """
+    if book:
+        data = {
+            **data,
+            "title": book.get("title"),
+            "author": book.get("author"),
+            "cover_url": book.get("cover_url"),
+            "total_pages": book.get("total_pages"),
+        }
+    activity = {
+        "id": str(uuid.uuid4()),
+        "user_id": str(user_id),
+        "kind": kind,
+        "data": data,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    try:
+        supabase = database.get_supabase_client()
+        # The write is made as the user, for the activity table's RLS policy
+        token = token or request_token()
+        if token:
+            supabase.postgrest.auth(token)
+        supabase.table("activity").insert(activity).execute()
+    except Exception as e:
+        ACTIVITY_RECORDED.inc(kind, "failed")
+        log.warning("feed record failed", kind=kind, error=e)
+        return
+    try:
+        raw = json.dumps({"activity": activity, "attempts": 0}, separators=(",", ":"), default=str)
+        if not cache.command("rpush", DELIVERY_KEY, raw):
+            # No Redis, so no timelines: feeds read this from the table
+            ACTIVITY_RECORDED.inc(kind, "on_read")
+            return
+        _ensure_deliverer()
+        _wake.set()
+    except Exception as e:
+        log.warning("feed fan-out not queued", kind=kind, error=e)
+
+
+def _fan_out(activity: dict):
+    followers = get_followers(activity["user_id"])
+    if len(followers) > feed_fanout_limit:
+        # Too many to write to; their feeds read this from the table
+        ACTIVITY_RECORDED.inc(activity["kind"], "on_read")
+        return
+    raw = json.dumps(activity, separators=(",", ":"), default=str)
+    commands = []
+    for follower in followers:
+        commands.append(("lpush", _timeline_key(follower), raw))
+        commands.append(("ltrim", _timeline_key(follower), 0, feed_length - 1))
+    if commands:
+        cache.pipeline(commands)
+    ACTIVITY_RECORDED.inc(activity["kind"], "fanned_out")
+
+
+def deliver_once() -> bool:
+    """Fans out the oldest queued activity; False when there was none."""
+    raw = cache.command("lindex", DELIVERY_KEY, 0)
+    if raw is None:
+        return False
+    queued = json.loads(raw)
+    activity = queued["activity"]
+    try:
+        _fan_out(activity)
+    except Exception as e:
+        queued["attempts"] += 1
+        if queued["attempts"] >= MAX_ATTEMPTS:
+            ACTIVITY_RECORDED.inc(activity["kind"], "failed")
+            log.error("feed fan-out failed, activity left to the table", kind=activity["kind"], error=e)
+        else:
+            log.warning("feed fan-out failed, retrying", kind=activity["kind"], error=e)
+            cache.command("rpush", DELIVERY_KEY, json.dumps(queued, separators=(",", ":")))
+        cache.command("lrem", DELIVERY_KEY, 1, raw)
+        time.sleep(RETRY_DELAY)
+        return True
+    cache.command("lrem", DELIVERY_KEY, 1, raw)
+    return True
+
+
+def _run():
+    owner = str(os.getpid())
+    while True:
+        _wake.wait(POLL_INTERVAL)
+        _wake.clear()
+        if not cache.command("set", LOCK_KEY, owner, px=LOCK_TTL * 1000, nx=True):
+            continue
+        try:
+            while deliver_once():
+                # Still ours while the fan-out lasts
+                cache.command("set", LOCK_KEY, owner, px=LOCK_TTL * 1000)
+        except Exception:
+            log.exception("feed fan-out failed")
+        finally:
+            cache.command("delete", LOCK_KEY)
+
+
+def _ensure_deliverer():
+    """Starts this worker's fan-out thread; also picks up activity left by a dead worker."""
+    global _deliverer, _deliverer_pid
+    with _deliverer_lock:
+        if _deliverer_pid != os.getpid() or not _deliverer.is_alive():
+            _deliverer = threading.Thread(target=_run, name="feed-deliverer", daemon=True)
+            _deliverer.start()
+            _deliverer_pid = os.getpid()
+
+
+## 📰 Reading
+
+
+def _recent_activity(user_ids: List[str], limit: int) -> List[dict]:
+    response = (
+        database.get_supabase_client()
+        .table("activity")
+        .select("*")
+        .in_("user_id", user_ids)
+        .order("created_at", desc=True)
+        .limit(limit)
+        .execute()
+    )
+    return response.data
+
+
+def read(user_id: str, limit: int = FEED_PAGE) -> List[dict]:
+    """user_id's feed, newest first: their timeline plus the large accounts they follow."""
+    following = get_following(user_id)
+    if not following:
+        return []
+    pull = [f["id"] for f in following if f["follower_count"] > feed_fanout_limit]
+    items = []
+    raws = cache.command("lrange", _timeline_key(user_id), 0, limit - 1)
+    if raws is None:
+        # No Redis: the whole feed is read from the table
+        pull = [f["id"] for f in following]
+    else:
+        followed = {f["id"] for f in following}
+        # Skips what is left in the timeline from people since unfollowed
+        items = [item for item in map(json.loads, raws) if item["user_id"] in followed]
+    if pull:
+        items += _recent_activity(pull, limit)
+
+    seen = set()
+    feed = []
+    for item in sorted(items, key=lambda item: item.get("created_at") or "", reverse=True):
+        if item["id"] not in seen:
+            seen.add(item["id"])
+            feed.append(item)
+    return feed[:limit]
+
+
+## 🌐 Flask
+
+
+def init_app(app):
+    """Starts each worker's fan-out thread on its first request, so a backlog left by a restart is delivered."""
+
+    @app.before_request
+    def start_feed():
+        if _deliverer_pid != os.getpid() and cache.connected():
+            _ensure_deliverer()
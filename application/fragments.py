@@ -0,0 +1,110 @@
+"""
+Template fragment caching and the compiled-template cache.
+
+Shelf-heavy pages (profile.html, userprofile.html, completed.html) wrap each
+shelf in a cache block keyed on the shelf and the user's library version:
+
+    {% cache "tbr", library_version, user %}
+      ... one <li> per book ...
+    {% endcache %}
+
+The first render stores the block's HTML in the FRAGMENTS cache namespace
+under the template name and the key parts. Later renders with the same key
+skip the loop entirely. library_version() is a digest of the library rows,
+so any write yields a new version and therefore a new key. Nothing needs
+invalidating, and stale fragments simply expire. Every value the block
+reads besides the books (like `user` above) must be in the key too.
+
+Compiled templates are written to TEMPLATE_CACHE_DIR as Jinja bytecode, so
+a new worker loads them instead of compiling every template on its first
+request. Entries are keyed on the template source, so editing a template
+never serves stale bytecode.
+
+Large pages are streamed with stream_page() instead of render_template(), so
+the first bytes go out before the long shelves are rendered. Output is sent
+in chunks of about STREAM_CHUNK bytes, and `{{ stream_flush() }}` in a
+template sends whatever is buffered at that point (e.g. once the header and
+currently-reading section are done). A shelf from the fragment cache, or one
+rendered for it, arrives as a single string and is sent in slices.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from configfile import template_cache_dir
+from application.cache import FRAGMENTS
+
+STREAM_CHUNK = 16 * 1024
+# Written by stream_flush(); an HTML comment, so harmless when not streaming
+FLUSH = "<!--flush-->"
+
+
+def library_version(rows: List[Dict[str, Any]]) -> str:
+    """A short digest that changes whenever any of the library rows do."""
+    encoded = json.dumps(rows, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()[:16]
+
+
+class FragmentCacheExtension(Extension):
+    """Adds {% cache key, ... %}...{% endcache %} to templates."""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        call = self.call_method("_cached", [nodes.Const(parser.name), nodes.List(parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cached(self, template, parts, caller):
+        key = (template or "", *parts)
+        return Markup(FRAGMENTS.get_or_load(key, lambda: str(caller())))
+
+
+def buffered(chunks: Iterable[str], size: int = STREAM_CHUNK) -> Iterator[str]:
+    """Regroups template output into pieces of about `size` characters."""
+    pending, length = [], 0
+    for chunk in chunks:
+        if chunk == FLUSH:
+            if pending:
+                yield "".join(pending)
+                pending, length = [], 0
+            continue
+        pending.append(chunk)
+        length += len(chunk)
+        if length < size:
+            continue
+        text = "".join(pending)
+        for start in range(0, len(text) - size + 1, size):
+            yield text[start:start + size]
+        rest = text[len(text) - len(text) % size:]
+        pending, length = ([rest], len(rest)) if rest else ([], 0)
+    if pending:
+        yield "".join(pending)
+
+
+## 🌐 Flask
+
+
+def stream_page(template_name: str, **context):
+    """Like render_template, but the page is sent while it renders."""
+    from flask import Response, stream_template
+
+    return Response(buffered(stream_template(template_name, **context)), mimetype="text/html")
+
+
+def init_app(app):
+    """Adds the cache tag and, unless TEMPLATE_CACHE_DIR is empty, the bytecode cache."""
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.globals["stream_flush"] = lambda: Markup(FLUSH)
+    if template_cache_dir:
+        os.makedirs(template_cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(template_cache_dir)
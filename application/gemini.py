@@ -0,0 +1,256 @@
+import json
+import re
+import threading
+from typing import Any, Optional
+
+from configfile import gemini_key, gemini_url
+from application.deadlines import DeadlineExceeded, remaining, timeout_for
+from application.breakers import guard
+from application.integrations import get_requests
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+MODEL = "gemini-2.5-flash-lite"
+BASE_URL = f"{gemini_url}/models"
+STREAM_ENDPOINT = f"{BASE_URL}/{MODEL}:streamGenerateContent?alt=sse"
+
+# --- Pooled HTTP session ---
+# One keep-alive session per process instead of a fresh TLS handshake per call.
+# The key goes in a header so it never ends up in URLs or logs.
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                requests = get_requests()
+                session = requests.Session()
+                session.mount(
+                    "https://",
+                    requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=16),
+                )
+                session.headers.update(
+                    {"Content-Type": "application/json", "x-goog-api-key": gemini_key or ""}
+                )
+                _session = session
+    return _session
+
+
+# --- Incremental JSON extraction ---
+
+_CLOSERS = {"[": "]", "{": "}"}
+# Structural characters outside strings, and characters that matter inside them.
+# Both are single character classes, so matching never backtracks.
+_OPENER = re.compile(r"[\[{]")
+_STRUCTURAL = re.compile(r'[\[\]{}"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_decoder = json.JSONDecoder()
+_NOT_FOUND = object()
+
+
+class JsonScanner:
+    """
+    Finds the first complete JSON array or object in text that arrives in
+    chunks (e.g. a streamed model response).
+
+    Chunks are scanned once as they arrive, tracking bracket depth and string
+    state, so nothing is rescanned while the value is still incomplete. When
+    the brackets balance, the value is decoded in place with raw_decode; if
+    that fails (say, "[citation needed]" in prose) scanning resumes just after
+    the rejected opener.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._start = None
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self.done = False
+        self.value = None
+
+    def feed(self, chunk: str) -> bool:
+        """Adds a chunk of text. Returns True once a JSON value is complete."""
+        if self.done or not chunk:
+            return self.done
+        offset = self._size
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        self._scan(chunk, offset, 0)
+        return self.done
+
+    def _text(self) -> str:
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0]
+
+    def _scan(self, text: str, offset: int, i: int):
+        n = len(text)
+        while i < n:
+            if self._start is None:
+                match = _OPENER.search(text, i)
+                if match is None:
+                    return
+                i = match.start()
+                self._start = offset + i
+                self._stack = [_CLOSERS[text[i]]]
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                    i += 1
+                    continue
+                match = _STRING_SPECIAL.search(text, i)
+                if match is None:
+                    return
+                i = match.start()
+                if text[i] == "\\":
+                    self._escaped = True
+                else:
+                    self._in_string = False
+                i += 1
+                continue
+
+            match = _STRUCTURAL.search(text, i)
+            if match is None:
+                return
+            i = match.start()
+            ch = text[i]
+            i += 1
+            if ch == '"':
+                self._in_string = True
+            elif ch in _CLOSERS:
+                self._stack.append(_CLOSERS[ch])
+            elif ch != self._stack[-1]:
+                text, offset, i = self._restart()
+                n = len(text)
+            else:
+                self._stack.pop()
+                if self._stack:
+                    continue
+                value = self._decode()
+                if value is not _NOT_FOUND:
+                    self.value = value
+                    self.done = True
+                    return
+                text, offset, i = self._restart()
+                n = len(text)
+
+    def _decode(self):
+        try:
+            value, _ = _decoder.raw_decode(self._text(), self._start)
+        except ValueError:
+            return _NOT_FOUND
+        return value
+
+    def _restart(self):
+        """Abandons the current candidate and rescans from just after it."""
+        resume = self._start + 1
+        self._start = None
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        return self._text(), 0, resume
+
+
+def extract_json(text: str) -> Optional[Any]:
+    """Returns the first JSON array or object found in `text`, or None."""
+    scanner = JsonScanner()
+    scanner.feed(text)
+    return scanner.value
+
+
+# --- Generation ---
+
+
+def build_request_body(
+    prompt: str,
+    schema: Optional[dict] = None,
+    max_output_tokens: Optional[int] = None,
+    temperature: Optional[float] = None,
+) -> dict:
+    generation_config = {}
+    if schema is not None:
+        generation_config["responseMimeType"] = "application/json"
+        generation_config["responseSchema"] = schema
+    if max_output_tokens is not None:
+        generation_config["maxOutputTokens"] = max_output_tokens
+    if temperature is not None:
+        generation_config["temperature"] = temperature
+
+    body = {"contents": [{"parts": [{"text": prompt}]}]}
+    if generation_config:
+        body["generationConfig"] = generation_config
+    return body
+
+
+def generate_json(
+    prompt: str,
+    schema: Optional[dict] = None,
+    max_output_tokens: Optional[int] = None,
+    temperature: Optional[float] = None,
+    operation: str = "generate",
+) -> Optional[Any]:
+    """
+    Streams a Gemini response and returns the first JSON value in it, already
+    parsed, or None if the model returned no usable JSON.
+
+    With `schema` the request uses structured output (JSON mime type plus a
+    response schema), so the model emits bare JSON. The stream is closed as
+    soon as a complete value has arrived.
+    """
+    body = build_request_body(prompt, schema, max_output_tokens, temperature)
+
+    scanner = JsonScanner()
+    received = 0
+    with guard("gemini", operation) as call:
+        response = get_session().post(
+            STREAM_ENDPOINT, json=body, stream=True, timeout=timeout_for("gemini")
+        )
+        call.status(response.status_code)
+        with response:
+            if response.status_code != 200:
+                log.warning("gemini error", status=response.status_code, body=response.text[:500])
+                return None
+            # SSE has no charset parameter; without this iter_lines would yield bytes
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                received += len(line)
+                if scanner.feed(event_text(line)):
+                    break
+                left = remaining()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded("gemini")
+        call.status(response.status_code, received)
+
+    if not scanner.done:
+        log.warning("no JSON array or object in the gemini response", operation=operation)
+    return scanner.value
+
+
+def event_text(line):
+    """Returns the text parts of one server-sent event line, joined."""
+    if not line or not line.startswith("data:") or not line[5:].strip():
+        return ""
+    try:
+        event = json.loads(line[5:])
+    except ValueError:
+        # A truncated or keep-alive frame; the rest of the stream may be fine
+        log.warning("skipping unreadable gemini event", frame=line[:200])
+        return ""
+    if not isinstance(event, dict):
+        return ""
+    parts = []
+    for candidate in event.get("candidates", [])[:1]:
+        for part in candidate.get("content", {}).get("parts", []):
+            text = part.get("text")
+            if text:
+                parts.append(text)
+    return "".join(parts)
@@ -3,18 +3,24 @@ from datetime import datetime
 import json
 import io
 import uuid
+from typing import TYPE_CHECKING
 from flask import jsonify
-import requests
 from configfile import supabase_url, supabase_service
-from supabase import create_client, Client
+from application.integrations import get_requests, get_supabase
+from application.log import get_logger
 
-from configfile import google_books_key as bookkey
+if TYPE_CHECKING:
+    from supabase import Client
+
+from configfile import google_books_key as bookkey, google_books_url
+
+log = get_logger(__name__)
 
 SUPABASE_URL = supabase_url
 SUPABASE_KEY = supabase_service
 
 
-def get_supabase_admin_client() -> Client:
+def get_supabase_admin_client() -> "Client":
     """Initializes and returns the Supabase client."""
     # Ensure URL and Key are set before running
     if SUPABASE_URL == "YOUR_SUPABASE_URL" or SUPABASE_KEY == "YOUR_SUPABASE_ANON_KEY":
@@ -22,10 +28,20 @@ def get_supabase_admin_client() -> Client:
             "Please set SUPABASE_URL and SUPABASE_KEY with your actual credentials."
         )
 
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+    return instrument_supabase_client(
+        get_supabase().create_client(
+            SUPABASE_URL, SUPABASE_KEY, options=supabase_options()
+        )
+    )
 
 
-from application.database import send_message
+from application.database import (
+    instrument_supabase_client,
+    send_message,
+    supabase_options,
+)
+from application.deadlines import timeout_for
+from application.breakers import CircuitOpenError, guard
 
 
 def clean_isbn(val):
@@ -67,9 +83,7 @@ def gr_import_parser(file_content, user=None, token=None):
     process_imported_data(books, user, token)
     # upload_imported_data(books, user)  # Process the valid entries as needed
     notify_user(user, not_found_count)  # Notify the user about entries without ISBNs
-    print(
-        f"User {user} has {len(books)} valid entries and {len(not_found_count)} entries without ISBNs."
-    )
+    log.info("import parsed", user=user, valid=len(books), without_isbn=len(not_found_count))
 
     not_found_json = {}
     for idx, entry in enumerate(not_found_count):
@@ -92,8 +106,6 @@ def process_imported_data(data, user, token):
         "import_details": import_payload,
         "created_at": datetime.utcnow().isoformat(),
     }
-    print(user)
-    print(type(user))
     supabase = get_supabase_admin_client()
 
     response = supabase.table("import_details").insert(row).execute()
@@ -102,9 +114,7 @@ def process_imported_data(data, user, token):
         raise Exception(f"Supabase insert failed: {response}")
 
     inserted_row = response.data[0]
-    print(
-        f"[import] Inserted row id={inserted_row['id']} for user={user} ({len(data)} records)"
-    )
+    log.info("import details stored", id=inserted_row["id"], user=user, records=len(data))
 
     return inserted_row
 
@@ -113,7 +123,7 @@ def notify_user(user, data):
     # This function can be used to send a notification to the user after processing the import
     # For example, you could send an email, an in-app notification, etc.
     # For now, it just prints a message to the console.
-    print(f"User {user} has imported {len(data)} records.")
+    log.info("import notification", user=user, without_isbn=len(data))
 
 
 def upload_imported_data(data, user):
@@ -125,16 +135,18 @@ def upload_imported_data(data, user):
 
         # 1. URL encode the queries to handle spaces and special characters safely
 
-        url = f"https://www.googleapis.com/books/v1/volumes?q=intitle:{title_query}+inauthor:{author_query}&key={bookkey}"
+        url = f"{google_books_url}/volumes?q=intitle:{title_query}+inauthor:{author_query}&key={bookkey}"
 
         try:
-            response = requests.get(url)
+            with guard("google_books", "search", url) as call:
+                response = get_requests().get(url, timeout=timeout_for("google_books"))
+                call.status(response.status_code, len(response.content))
             response.raise_for_status()  # Check for HTTP errors
 
             # 2. Changed variable name to api_response to avoid overwriting 'data'
             api_response = response.json()
-        except requests.RequestException as e:
-            print(f"API request failed for {title_query}: {e}")
+        except (get_requests().RequestException, CircuitOpenError) as e:
+            log.warning("google books lookup failed", title=title_query, error=e)
             failed_uploads.append(book)
             continue
 
@@ -142,7 +154,7 @@ def upload_imported_data(data, user):
 
         # 3. Check if any books were actually found
         if not items:
-            print(f"No results found for: {title_query} by {author_query}")
+            log.debug("no google books match", title=title_query, author=author_query)
             failed_uploads.append(book)
             continue
 
@@ -181,5 +193,9 @@ def upload_imported_data(data, user):
                 "description": description,
             }
         )
-    print(f"Successfully uploaded {len(successful_uploads)} books for user {user}.")
-    print(f"Failed to upload {len(failed_uploads)} books for user {user}.")
+    log.info(
+        "import lookups finished",
+        user=user,
+        found=len(successful_uploads),
+        failed=len(failed_uploads),
+    )
@@ -1,9 +1,24 @@
 import time
 import urllib.parse
-import requests
 import re
 
 from application.gr_importer import get_supabase_admin_client
+from application.database import invalidate_library, normalize_isbn
+from application.covers import prefetch as prefetch_covers
+from application.jobs import QueueFull, enqueue
+from application.deadlines import DeadlineExceeded, deadline_scope, timeout_for
+from application.breakers import CircuitOpenError, guard
+from application.integrations import get_requests
+from application.tracing import trace
+from application.profiling import profiled
+from application.log import get_logger
+from configfile import google_books_url
+
+log = get_logger(__name__)
+
+# Budget for a whole background import; each Google Books lookup still gets
+# its own per-upstream timeout within it.
+IMPORT_BUDGET = 600
 
 
 def clean_query(text):
@@ -16,9 +31,117 @@ def clean_query(text):
     return text.strip()
 
 
-def background_upload_task(app_to_context, data, user, bookkey):
-    with app_to_context.app_context():
+def book_keys(isbns, title=None, author=None) -> set:
+    """
+    What identifies a book on a user's shelves: its normalized ISBNs, or
+    (without one) its title and author.
+    """
+    keys = {key for key in map(normalize_isbn, isbns) if key}
+    if not keys and title:
+        keys.add(f"{title}\x1f{author or ''}".lower())
+    return keys
+
+
+def imported_isbn(book):
+    """The ISBN of the edition a Goodreads row is for, if it has one."""
+    return next((isbn for isbn in (book.get("ISBN13"), book.get("ISBN")) if normalize_isbn(isbn)), None)
+
+
+def existing_books(supabase, user) -> dict:
+    """The user's library rows by book key, from one query."""
+    response = (
+        supabase.table("library")
+        .select("id, isbn, title, author, cover_url, total_pages, description")
+        .eq("user_id", user)
+        .execute()
+    )
+    existing = {}
+    for row in response.data:
+        for key in book_keys([row.get("isbn")], row.get("title"), row.get("author")):
+            existing.setdefault(key, row)
+    return existing
+
+
+# Library columns an import may fill in on a book the user already has
+FILLABLE = ("cover_url", "total_pages", "description")
+
+
+def write_library_difference(supabase, user, entries, existing) -> dict:
+    """
+    Writes only what `entries` change in the user's library: new books are
+    inserted, books already there get any of FILLABLE they were missing, and
+    the rest are skipped. `existing` (from existing_books) is updated with
+    the inserted books. Returns the counts.
+    """
+    incoming = {}
+    for entry in entries:
+        keys = book_keys([entry.get("isbn")], entry.get("title"), entry.get("author"))
+        if keys and not keys & incoming.keys():
+            incoming[min(keys)] = entry
+
+    new = incoming.keys() - existing.keys()
+    owned = incoming.keys() & existing.keys()
+
+    inserts = [
+        {**incoming[key], "isbn_normalized": normalize_isbn(incoming[key].get("isbn"))}
+        for key in new
+    ]
+    updates = []
+    for key in owned:
+        row, entry = existing[key], incoming[key]
+        filled = {column: entry.get(column) for column in FILLABLE
+                  if not row.get(column) and entry.get(column)}
+        if filled and row.get("id") is not None:
+            updates.append((row["id"], filled))
+
+    if inserts:
+        # The (user_id, isbn_normalized) index drops anything added meanwhile
+        supabase.table("library").upsert(
+            inserts, on_conflict="user_id,isbn_normalized", ignore_duplicates=True
+        ).execute()
+        for key in new:
+            existing[key] = incoming[key]
+    # One UPDATE per row, of just the gaps: an upsert is an INSERT first,
+    # and would need every NOT NULL column of the row
+    for row_id, filled in updates:
+        supabase.table("library").update(filled).eq("id", row_id).eq("user_id", user).execute()
+    if inserts or updates:
+        invalidate_library(user)
+    counts = {
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "skipped": len(entries) - len(inserts) - len(updates),
+    }
+    log.info("import library written", user=user, **counts)
+    return counts
+
+
+def background_upload_task(
+    app_to_context, data, user, bookkey, traceparent=None, profile_id=None
+):
+    # traceparent links this import's trace to the request that started it;
+    # profile_id is set when that request was profiled
+    with app_to_context.app_context(), deadline_scope(IMPORT_BUDGET), trace(
+        "import goodreads", traceparent
+    ), profiled(profile_id, "import"):
         supabase = get_supabase_admin_client()
+
+        # Books already on the user's shelves are not looked up again; they
+        # only go through the cache lookup when an import could fill a gap
+        existing = existing_books(supabase, user)
+        owned_complete = 0
+        wanted = []
+        for book in data:
+            keys = book_keys([imported_isbn(book)], book.get("Title"), book.get("Author"))
+            row = next((existing[key] for key in keys if key in existing), None)
+            if row is not None and all(row.get(column) for column in FILLABLE):
+                owned_complete += 1
+            else:
+                wanted.append(book)
+        log.info("import compared with library", user=user, books=len(data),
+                 already_owned=owned_complete)
+        data = wanted
+
         def sanitize(text):
             if not text: return ""
             # Remove characters that break PostgREST logic
@@ -45,6 +168,7 @@ def background_upload_task(app_to_context, data, user, bookkey):
         successful_uploads = []
         failed_uploads = []    
         successful_cache = []
+        cache_hits = []
         failed_cache = []
         
         for book in data:
@@ -52,8 +176,9 @@ def background_upload_task(app_to_context, data, user, bookkey):
             cached_data = cache_map.get(title)
             
             if cached_data:
-                print(cached_data)
+                log.debug("import cache hit", sample=50, title=title)
                 successful_cache.append(cached_data)
+                cache_hits.append((book, cached_data))
             else:
                 failed_cache.append(book)
 
@@ -62,45 +187,51 @@ def background_upload_task(app_to_context, data, user, bookkey):
             # We add 'user_id' to each dict and rename/filter keys if necessary
             library_entries = []
             
-            for item in successful_cache:
+            for book, item in cache_hits:
                 # Create a new dictionary to match your 'library' table schema
                 entry = {
                     "user_id": user,              # Inject the current user
                     "title": item.get("title"),
                     "author": item.get("authors"),
-                    "isbn": item.get("isbn"),
+                    # The imported edition's, so a re-import matches it
+                    "isbn": imported_isbn(book) or item.get("isbn"),
                     "cover_url": item.get("cover_url"),
                     "total_pages": item.get("pages"),
                     "description": item.get("description")
                 }
                 library_entries.append(entry)
 
-            # 2. Bulk insert into the library table
+            # 2. Write what is new to the library table
             try:
-                supabase.table("library").upsert(library_entries).execute()
-                print(f"Successfully moved {len(library_entries)} items from cache to library.")
+                write_library_difference(supabase, user, library_entries, existing)
             except Exception as e:
-                print(f"Error inserting into library: {e}")
+                log.warning("import library insert failed", user=user, error=e)
 
         for book in failed_cache:
+            keys = book_keys([imported_isbn(book)], book.get("Title"), book.get("Author"))
+            if keys & existing.keys():
+                # Owned, and not in cached_library to fill its gaps from
+                continue
             clean_title = clean_query(book.get("title", ""))
             clean_author = clean_query(book.get("authors", ""))
 
             safe_title = urllib.parse.quote(clean_title)
             safe_author = urllib.parse.quote(clean_author)
-            print(f"Querying Google Books API for: {clean_title} by {clean_author}")
+            log.debug("import lookup", sample=20, title=clean_title, author=clean_author)
             # 1. URL encode the queries to handle spaces and special characters safely
 
-            url = f"https://www.googleapis.com/books/v1/volumes?q=intitle:{safe_title}+inauthor:{safe_author}&key={bookkey}"
+            url = f"{google_books_url}/volumes?q=intitle:{safe_title}+inauthor:{safe_author}&key={bookkey}"
 
             try:
-                response = requests.get(url)
+                with guard("google_books", "search", url) as call:
+                    response = get_requests().get(url, timeout=timeout_for("google_books"))
+                    call.status(response.status_code, len(response.content))
                 response.raise_for_status()  # Check for HTTP errors
 
                 # 2. Changed variable name to api_response to avoid overwriting 'data'
                 api_response = response.json()
-            except requests.RequestException as e:
-                print(f"API request failed for {safe_title} by {safe_author}: {e}")
+            except (get_requests().RequestException, DeadlineExceeded, CircuitOpenError) as e:
+                log.warning("import lookup failed", title=clean_title, error=e)
                 failed_uploads.append(book)
                 continue
 
@@ -108,7 +239,7 @@ def background_upload_task(app_to_context, data, user, bookkey):
 
             # 3. Check if any books were actually found
             if not items:
-                print(f"No results found for: {safe_title} by {safe_author}")
+                log.debug("import lookup found nothing", title=clean_title, author=clean_author)
                 failed_uploads.append(book)
                 continue
 
@@ -142,17 +273,20 @@ def background_upload_task(app_to_context, data, user, bookkey):
                     "user_id": user,
                     "title": title,
                     "author": author,
-                    "isbn": isbn,
+                    "isbn": imported_isbn(book) or isbn,
                     "cover_url": cover_url,
                     "total_pages": pages,
                     "description": description,
                 }
             )
-        print(f"Successfully uploaded {len(successful_uploads)} books for user {user}.")
-        print(f"Failed to upload {len(failed_uploads)} books for user {user}.")
-        supabase = get_supabase_admin_client()
-        
-        response = supabase.table("library").upsert(successful_uploads).execute()
+        log.info(
+            "import lookups finished",
+            user=user,
+            found=len(successful_uploads),
+            failed=len(failed_uploads),
+        )
+
+        written = write_library_difference(supabase, user, successful_uploads, existing)
         # 1. After successful API uploads, upsert into 'cache_library'
         if successful_uploads:
             # We want to store the same clean structure in cache_library
@@ -172,7 +306,14 @@ def background_upload_task(app_to_context, data, user, bookkey):
             try:
                 # Upsert to cache_library to ensure these are available for future users
                 supabase.table("cached_library").upsert(cache_entries).execute()
-                print(f"Successfully cached {len(cache_entries)} new books.")
+                log.info("import results cached", books=len(cache_entries))
             except Exception as e:
-                print(f"Error updating cache_library: {e}")
-        print(f"Supabase insert response: {response}")
+                log.warning("import cache update failed", error=e)
+        log.info("import finished", user=user, **written)
+
+        # Render the new books' covers before the library page first asks for them
+        covers = [item.get("cover_url") for item in successful_cache + successful_uploads]
+        try:
+            enqueue("prefetch_covers", prefetch_covers, covers, upstreams=("covers",))
+        except QueueFull:
+            log.info("cover prefetch skipped, job queue full", user=user, covers=len(covers))
@@ -0,0 +1,62 @@
+"""
+Accessors for heavy third-party integrations.
+
+supabase, spotipy, redis, Pillow and requests together add several hundred
+milliseconds to startup, and most routes only need one or two of them.
+Importing them through these functions defers the cost to the first request
+that actually uses each one. In preload mode (see gunicorn.conf.py) the
+master calls preload() once so forked workers share the imported modules.
+"""
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_requests():
+    import requests
+
+    return requests
+
+
+@lru_cache(maxsize=None)
+def get_httpx():
+    import httpx
+
+    return httpx
+
+
+@lru_cache(maxsize=None)
+def get_supabase():
+    import supabase
+
+    return supabase
+
+
+@lru_cache(maxsize=None)
+def get_spotipy():
+    import spotipy
+
+    return spotipy
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    import redis
+
+    return redis
+
+
+@lru_cache(maxsize=None)
+def get_pil_image():
+    from PIL import Image
+
+    return Image
+
+
+def preload():
+    """Imports every integration up front (used before forking workers)."""
+    for accessor in (
+        get_requests, get_httpx, get_supabase, get_spotipy, get_redis, get_pil_image
+    ):
+        accessor()
+    # Modules that import the integrations at top level
+    import application.spotify_auth  # noqa: F401
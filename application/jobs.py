@@ -0,0 +1,155 @@
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional, Sequence
+
+from application import cache
+from application.breakers import BREAKERS, OPEN
+from application.tracing import current_traceparent, trace
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+# Jobs deferred while an upstream is unavailable. The queue is bounded so a
+# long outage cannot pile up unbounded work; finished jobs are kept (up to
+# MAX_FINISHED_JOBS) so clients can poll for the result.
+MAX_QUEUED_JOBS = 100
+MAX_FINISHED_JOBS = 500
+
+# With Redis, every job's state is also stored there (for JOB_TTL seconds),
+# so a client polling /api/jobs/<id> can reach any worker. Without it, jobs
+# are only known to the worker that queued them: polling then needs a
+# single worker or sticky routing.
+JOB_TTL = 24 * 60 * 60
+
+_queue = queue.Queue(maxsize=MAX_QUEUED_JOBS)
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    """Raised when the deferred-job queue is at capacity."""
+
+
+def enqueue(
+    name: str,
+    fn: Callable,
+    *args,
+    upstreams: Sequence[str] = (),
+    **kwargs,
+) -> str:
+    """
+    Queues fn(*args, **kwargs) to run in the background once none of
+    `upstreams` has an open circuit breaker. Returns the job id.
+    """
+    job_id = uuid.uuid4().hex
+    job = {
+        "id": job_id,
+        "name": name,
+        "status": "queued",
+        "created_at": datetime.utcnow().isoformat(),
+        "result": None,
+        "error": None,
+    }
+    with _jobs_lock:
+        _jobs[job_id] = job
+        _trim_finished()
+    _share(job)
+
+    try:
+        _queue.put_nowait(
+            (job_id, name, fn, args, kwargs, tuple(upstreams), current_traceparent())
+        )
+    except queue.Full:
+        with _jobs_lock:
+            _jobs.pop(job_id, None)
+        cache.command("delete", _shared_key(job_id))
+        raise QueueFull(f"Job queue is full ({MAX_QUEUED_JOBS} jobs waiting)")
+
+    _ensure_worker()
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job:
+            return dict(job)
+    # Queued by another worker
+    raw = cache.command("get", _shared_key(job_id))
+    return json.loads(raw) if raw else None
+
+
+def _shared_key(job_id: str) -> str:
+    return f"{cache.PREFIX}:job:{job_id}"
+
+
+def _share(job: dict):
+    """Stores the job's state in Redis for the other workers; a no-op without it."""
+    cache.command(
+        "set", _shared_key(job["id"]), json.dumps(job, default=str), px=JOB_TTL * 1000
+    )
+
+
+def _trim_finished():
+    finished = [
+        job_id
+        for job_id, job in _jobs.items()
+        if job["status"] in ("done", "failed")
+    ]
+    for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del _jobs[job_id]
+
+
+def _set(job_id: str, **fields):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        job = dict(job)
+    _share(job)
+
+
+def _wait_for(upstreams):
+    """Blocks until every upstream's breaker is closed or half-open."""
+    while True:
+        waits = [
+            BREAKERS[name].retry_after()
+            for name in upstreams
+            if name in BREAKERS and BREAKERS[name].state == OPEN
+        ]
+        if not waits:
+            return
+        time.sleep(max(1.0, max(waits)))
+
+
+def _run():
+    while True:
+        job_id, name, fn, args, kwargs, upstreams, traceparent = _queue.get()
+        try:
+            _wait_for(upstreams)
+            _set(job_id, status="running")
+            # Continues the trace of the request that queued the job
+            with trace(f"job {name}", traceparent):
+                result = fn(*args, **kwargs)
+            _set(job_id, status="done", result=result)
+        except Exception as e:
+            log.exception("job failed", job=job_id, name=name)
+            _set(job_id, status="failed", error=str(e))
+        finally:
+            _queue.task_done()
+
+
+def _ensure_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="job-worker", daemon=True)
+            _worker.start()
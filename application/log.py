@@ -0,0 +1,222 @@
+"""
+Structured, level-gated logging that writes off the request thread.
+
+    from application.log import get_logger, lazy
+
+    log = get_logger(__name__)
+    log.info("book added", user=user, status=response.status_code)
+    log.debug("search results", books=lazy(lambda: [b["id"] for b in books]))
+    log.debug("cached row", sample=100, row=item)   # about 1 in 100 written
+
+- Level-gated: a call below LOG_LEVEL returns before touching its fields,
+  and lazy(...) fields are only computed for records that are written.
+- Sampled: sample=N keeps one in N records per logger and message, for
+  per-item events in loops.
+- Non-blocking: records go onto a bounded in-memory queue and a listener
+  thread formats and writes them. When the queue is full records are
+  dropped (and the count reported) rather than stalling a request.
+
+Records are plain text lines by default; LOG_FORMAT=json writes one JSON
+object per line. Both carry the trace id of the request or job that logged
+them. Field values are cut to LOG_MAX_FIELD characters.
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+from configfile import log_format, log_level, log_max_field, log_queue_size
+
+ROOT = "cadence"
+
+_setup_lock = threading.Lock()
+_listener = None
+_listener_pid = None
+_queue = None
+_dropped = 0
+_samples = {}
+_samples_lock = threading.Lock()
+
+
+class lazy:
+    """A field value computed only if the record is actually written."""
+
+    __slots__ = ("fn",)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+
+def _shorten(value):
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) > log_max_field:
+        return f"{text[:log_max_field]}... ({len(text)} chars)"
+    return text
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, "fields", None) or {}
+        line = (
+            f"{datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')} "
+            f"{record.levelname} {record.name}: {record.getMessage()}"
+        )
+        if fields:
+            line += " " + " ".join(f"{key}={_shorten(value)}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            data[key] = value if isinstance(value, (int, float, bool, type(None))) else _shorten(value)
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Formatting happens on the listener thread, not here
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        _ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+class _StreamHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at the time, as print() does."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+    def emit(self, record):
+        global _dropped
+        if _dropped:
+            dropped, _dropped = _dropped, 0
+            self.stream.write(f"[log] queue full, dropped {dropped} records\n")
+        super().emit(record)
+
+
+def _ensure_listener():
+    """Starts the writer thread, again in each forked worker."""
+    global _listener, _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _setup_lock:
+        if _listener_pid == os.getpid():
+            return
+        handler = _StreamHandler()
+        handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+        _listener = logging.handlers.QueueListener(_queue, handler)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+
+def flush():
+    """Writes everything queued so far (at exit, and in scripts)."""
+    global _listener_pid
+    with _setup_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            try:
+                _listener.stop()
+            except queue.Full:
+                pass
+            _listener_pid = None
+
+
+def _configure():
+    global _queue
+    with _setup_lock:
+        if _queue is not None:
+            return
+        _queue = queue.Queue(maxsize=log_queue_size)
+        root = logging.getLogger(ROOT)
+        root.setLevel(getattr(logging, log_level, logging.INFO))
+        root.addHandler(_QueueHandler(_queue))
+        root.propagate = False
+        atexit.register(flush)
+
+
+def _sampled(key, every: int) -> bool:
+    with _samples_lock:
+        counter = _samples.get(key)
+        if counter is None:
+            counter = _samples[key] = itertools.count()
+        return next(counter) % every == 0
+
+
+class Logger:
+    """Thin wrapper over a stdlib logger taking structured fields as keywords."""
+
+    __slots__ = ("name", "_logger")
+
+    def __init__(self, name: str):
+        self.name = name
+        self._logger = logging.getLogger(name)
+
+    def enabled(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def log(self, level: int, msg: str, *, sample: int = None, exc_info=None, **fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        if sample and sample > 1 and not _sampled((self.name, msg), sample):
+            return
+        for key, value in fields.items():
+            if isinstance(value, lazy):
+                fields[key] = value.fn()
+        if sample and sample > 1:
+            fields["sampled"] = f"1/{sample}"
+        from application.tracing import current_trace_id
+
+        trace_id = current_trace_id()
+        if trace_id:
+            fields["trace_id"] = trace_id
+        self._logger.log(level, msg, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, msg, **fields):
+        self.log(logging.DEBUG, msg, **fields)
+
+    def info(self, msg, **fields):
+        self.log(logging.INFO, msg, **fields)
+
+    def warning(self, msg, **fields):
+        self.log(logging.WARNING, msg, **fields)
+
+    def error(self, msg, **fields):
+        self.log(logging.ERROR, msg, **fields)
+
+    def exception(self, msg, **fields):
+        self.log(logging.ERROR, msg, exc_info=True, **fields)
+
+
+def get_logger(name: str) -> Logger:
+    _configure()
+    if name == "__main__" or not name:
+        name = "main"
+    return Logger(name if name.startswith(ROOT) else f"{ROOT}.{name}")
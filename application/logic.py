@@ -1,18 +1,29 @@
-import requests
 import json
 from application.genny import generate_with_gemini
+from application.gemini import generate_json
+from application.deadlines import timeout_for
+from application.breakers import CircuitOpenError, guard
+from application.cache import BOOKS, RECOMMENDATIONS
+from application.metrics import record_retry
+from application.integrations import get_requests
+from configfile import openlibrary_url
 import re
 from collections import Counter
 import statistics
+from application.log import get_logger
 
+log = get_logger(__name__)
 
-def fetch_data_from_api(url):
+
+def fetch_data_from_api(url, upstream="default", operation="get"):
     try:
-        response = requests.get(url)
+        with guard(upstream, operation, url) as call:
+            response = get_requests().get(url, timeout=timeout_for(upstream))
+            call.status(response.status_code, len(response.content))
         response.raise_for_status()  # Raise an error for bad responses
         return response.json()
-    except requests.RequestException as e:
-        print(f"An error occurred: {e}")
+    except (get_requests().RequestException, CircuitOpenError) as e:
+        log.warning("upstream request failed", upstream=upstream, url=url, error=e)
         return None
 
 
@@ -25,6 +36,33 @@ def process_data(data):
     return f"Data is not a list, but of type {type(data)}."
 
 
+# Response schemas for Gemini structured output
+BOOK_RECOMMENDATION_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "title": {"type": "STRING"},
+            "reason": {"type": "STRING"},
+        },
+        "required": ["title", "reason"],
+    },
+}
+
+SONG_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "song_title": {"type": "STRING"},
+            "artist": {"type": "STRING"},
+            "spotify_id": {"type": "STRING"},
+        },
+        "required": ["song_title", "artist"],
+    },
+}
+
+
 def get_book_recommendations():
     data = [
         "The Knight and The Moth",
@@ -38,23 +76,201 @@ def get_book_recommendations():
         "For each recommendation, briefly explain why it is similar."
         "Please format the response as a JSON array of objects, each containing 'title' and 'reason' fields."
     )
-    books = generate_with_gemini(prompt=prompt)
+    books = generate_with_gemini(prompt=prompt, schema=BOOK_RECOMMENDATION_SCHEMA)
     return books
 
 
+# --- Recommendation cache ---
+# Song lists keyed by normalised title/author, shared by the single and batch
+# paths (and by every worker) so a book is only sent to Gemini once.
+
+
+def recommendation_key(book: dict) -> str:
+    title = (book.get("title") or "").strip().lower()
+    author = (book.get("author") or "").strip().lower()
+    return f"{title}|{author}"
+
+
+def get_cached_recommendations(book: dict):
+    return RECOMMENDATIONS.get(recommendation_key(book))
+
+
+def cache_recommendations(book: dict, songs: list):
+    RECOMMENDATIONS.set(recommendation_key(book), songs)
+
+
+def valid_songs(songs) -> bool:
+    return (
+        isinstance(songs, list)
+        and len(songs) > 0
+        and all(
+            isinstance(song, dict) and song.get("song_title") and song.get("artist")
+            for song in songs
+        )
+    )
+
+
 def get_playlist_recommendations(data: dict):
+    cached = get_cached_recommendations(data)
+    if cached is not None:
+        return data, cached
 
     prompt = f"Act as a music recommendation engine, based on the following book: {data}, please provide a list of 20 songs that would fit the mood and themes of the book, try to make it mix of known songs as well as ambient/non vocal. Provide this in a JSON array format with each entry containing 'song_title' and 'artist' and 'spotify_id'."
-    songs = generate_with_gemini(prompt=prompt)
-    songs = songs.strip()
-    songs = json.loads(songs)
+    songs = generate_with_gemini(prompt=prompt, schema=SONG_SCHEMA)
+    if not valid_songs(songs):
+        return data, []
+    cache_recommendations(data, songs)
     return data, songs
 
 
+# --- Batch recommendations ---
+# Rough token accounting (about 4 characters per token) used to decide how
+# many books fit in one call without the response being cut off.
+CHARS_PER_TOKEN = 4
+TOKENS_PER_SONG = 25
+BATCH_OUTPUT_TOKEN_BUDGET = 8192
+BATCH_PROMPT_TOKEN_BUDGET = 4096
+BATCH_RETRIES = 2
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _output_per_book(songs_per_book: int) -> int:
+    return songs_per_book * TOKENS_PER_SONG + 10
+
+
+def _call_output_budget(batch, songs_per_book, output_budget):
+    """max_output_tokens for one batch: twice its estimated output, within the round's budget."""
+    return min(output_budget, 2 * len(batch) * _output_per_book(songs_per_book))
+
+
+def _pack_batches(items, songs_per_book, output_budget, prompt_budget):
+    """
+    Greedily packs (key, book) pairs into batches whose estimated prompt and
+    output sizes stay under the budgets. A batch always holds at least one book.
+    """
+    output_per_book = _output_per_book(songs_per_book)
+    batches, current, prompt_tokens, output_tokens = [], [], 0, 0
+    for key, book in items:
+        book_tokens = _estimate_tokens(json.dumps(book)) + 5
+        if current and (
+            prompt_tokens + book_tokens > prompt_budget
+            or output_tokens + output_per_book > output_budget
+        ):
+            batches.append(current)
+            current, prompt_tokens, output_tokens = [], 0, 0
+        current.append((key, book))
+        prompt_tokens += book_tokens
+        output_tokens += output_per_book
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _batch_prompt(batch, songs_per_book):
+    lines = "\n".join(
+        f"{key}: {json.dumps({'title': book.get('title'), 'author': book.get('author')})}"
+        for key, book in batch
+    )
+    return (
+        "Act as a music recommendation engine. For each book below, provide a list of "
+        f"{songs_per_book} songs that would fit the mood and themes of the book, mixing "
+        "known songs with ambient/non vocal tracks.\n"
+        f"{lines}\n"
+        "Respond with a single JSON object whose keys are the book keys above "
+        "(e.g. \"b0\") and whose values are arrays of objects with 'song_title', "
+        "'artist' and 'spotify_id'."
+    )
+
+
+def _batch_schema(batch):
+    return {
+        "type": "OBJECT",
+        "properties": {key: SONG_SCHEMA for key, _ in batch},
+        "required": [key for key, _ in batch],
+    }
+
+
+def get_playlist_recommendations_batch(
+    books: list,
+    songs_per_book: int = 20,
+    output_token_budget: int = BATCH_OUTPUT_TOKEN_BUDGET,
+    prompt_token_budget: int = BATCH_PROMPT_TOKEN_BUDGET,
+    retries: int = BATCH_RETRIES,
+):
+    """
+    Generates playlists for many books with as few Gemini calls as possible.
+
+    Cached books are skipped. The rest are packed into structured prompts
+    keyed b0, b1, ... within the token budgets; each response is split back
+    into per-book song lists and cached. Books whose entry is missing or
+    malformed are retried (only those) up to `retries` more times.
+
+    Returns a list of (book, songs) in input order; songs is [] for books
+    that never produced a valid list.
+    """
+    results = {}
+    pending = []
+    cached = RECOMMENDATIONS.get_many(recommendation_key(book) for book in books)
+    for index, book in enumerate(books):
+        songs = cached.get(recommendation_key(book))
+        if songs is not None:
+            results[index] = songs
+        else:
+            pending.append((f"b{index}", book))
+
+    attempt = 0
+    while pending and attempt <= retries:
+        failed = []
+        # Each retry round packs half as much per call, so a batch whose
+        # response was cut off gets split up, and each call may only spend
+        # what its books need
+        round_budget = output_token_budget // (2**attempt)
+        for batch in _pack_batches(pending, songs_per_book, round_budget, prompt_token_budget):
+            try:
+                response = generate_json(
+                    _batch_prompt(batch, songs_per_book),
+                    schema=_batch_schema(batch),
+                    max_output_tokens=_call_output_budget(batch, songs_per_book, round_budget),
+                    operation="generate_batch",
+                )
+            except CircuitOpenError:
+                # Gemini is down: nothing else will succeed this round
+                return [(book, results.get(i, [])) for i, book in enumerate(books)]
+            except get_requests().RequestException as e:
+                log.warning("batch recommendation call failed", error=e)
+                response = None
+
+            if not isinstance(response, dict):
+                response = {}
+            for key, book in batch:
+                songs = response.get(key)
+                if valid_songs(songs):
+                    results[int(key[1:])] = songs
+                    cache_recommendations(book, songs)
+                else:
+                    failed.append((key, book))
+
+        if failed:
+            log.warning("batch recommendations failed to parse", failed=len(failed), of=len(pending))
+            if attempt < retries:
+                record_retry("gemini", "generate_batch", len(failed))
+        pending = failed
+        attempt += 1
+
+    return [(book, results.get(index, [])) for index, book in enumerate(books)]
+
+
 def get_book_details_from_openlibrary(olid: str):
+    return BOOKS.get_or_load(("openlibrary", olid), lambda: _fetch_openlibrary_details(olid))
+
 
-    url = f"https://openlibrary.org/{olid}.json"
-    data = fetch_data_from_api(url)
+def _fetch_openlibrary_details(olid: str):
+
+    url = f"{openlibrary_url}/{olid}.json"
+    data = fetch_data_from_api(url, upstream="openlibrary", operation="work")
     if not data:
         return None
 
@@ -67,14 +283,18 @@ def get_book_details_from_openlibrary(olid: str):
         author_key = author.get("author", {}).get("key")
         if author_key:
             author_data = fetch_data_from_api(
-                f"https://openlibrary.org{author_key}.json"
+                f"{openlibrary_url}{author_key}.json",
+                upstream="openlibrary",
+                operation="author",
             )
             if author_data:
                 author_names.append(author_data.get("name", "Unknown Author"))
 
     # gather page counts from editions (number_of_pages or parse pagination)
-    editions_url = f"https://openlibrary.org/{olid}/editions.json?limit=100"
-    editions = fetch_data_from_api(editions_url)
+    editions_url = f"{openlibrary_url}/{olid}/editions.json?limit=100"
+    editions = fetch_data_from_api(
+        editions_url, upstream="openlibrary", operation="editions"
+    )
     page_counts = []
     if editions and isinstance(editions, dict):
         for entry in editions.get("entries", []):
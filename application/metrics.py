@@ -0,0 +1,271 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Outbound calls are recorded per upstream, operation and calling route
+(latency, status, response size, retries); inbound requests per route
+(latency, status, in-flight). Everything is exposed on GET /metrics.
+
+Metrics live in the worker process that recorded them, like the circuit
+breakers; with several gunicorn workers each scrape sees one worker, so
+scrape them individually or run a single worker per container.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Optional, Tuple
+
+from application.roundtrips import count_call
+from application.tracing import add_span
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = super().render()
+        with self._lock:
+            items = list(self._values.items())
+        for values, total in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {total}")
+        return lines
+
+    def samples(self) -> list:
+        """(labels dict, value) for every series, e.g. for the benchmark harness."""
+        with self._lock:
+            items = list(self._values.items())
+        return [(dict(zip(self.labels, values)), total) for values, total in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = super().render()
+        with self._lock:
+            items = [(values, (list(s[0]), s[1], s[2])) for values, s in self._series.items()]
+        for values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labels, values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds",
+    "Outbound call latency.",
+    ("upstream", "operation", "route"),
+)
+UPSTREAM_REQUESTS = Counter(
+    "upstream_requests_total",
+    "Outbound calls by result: HTTP status, ok (succeeded, status not seen), error, circuit_open or deadline.",
+    ("upstream", "operation", "route", "status"),
+)
+UPSTREAM_RESPONSE_BYTES = Histogram(
+    "upstream_response_bytes",
+    "Outbound call response payload size.",
+    ("upstream", "operation"),
+    buckets=SIZE_BUCKETS,
+)
+UPSTREAM_RETRIES = Counter(
+    "upstream_retries_total",
+    "Outbound calls repeated after a failed or unusable response.",
+    ("upstream", "operation", "route"),
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Inbound request latency.",
+    ("route", "method", "status"),
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Inbound requests currently being handled.",
+    ("route",),
+)
+
+
+def current_route() -> str:
+    """Route rule of the request being handled, or "background" outside one."""
+    from flask import has_request_context, request
+
+    if not has_request_context():
+        return "background"
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def observe_upstream(
+    upstream: str,
+    operation: str,
+    status,
+    latency: Optional[float] = None,
+    size: Optional[int] = None,
+    target: Optional[str] = None,
+):
+    """
+    Records one outbound call. `target` identifies what was asked for (URL,
+    query) so the round-trip checker can spot repeated identical calls.
+    """
+    route = current_route()
+    UPSTREAM_REQUESTS.inc(upstream, operation, route, str(status))
+    if latency is not None:
+        UPSTREAM_LATENCY.observe(latency, upstream, operation, route)
+        # Every upstream call also becomes a span in the current trace
+        attrs = {"status": status} if size is None else {"status": status, "bytes": size}
+        add_span(f"{upstream} {operation}", time.monotonic() - latency, latency, **attrs)
+        count_call(upstream, operation, target)
+    if size is not None:
+        UPSTREAM_RESPONSE_BYTES.observe(size, upstream, operation)
+
+
+def record_retry(upstream: str, operation: str, count: int = 1):
+    UPSTREAM_RETRIES.inc(upstream, operation, current_route(), amount=count)
+
+
+## 🔌 httpx clients (Supabase)
+
+
+def instrument_httpx_client(client, upstream: str):
+    """
+    Adds event hooks to an httpx client that record every call. The
+    operation is "<METHOD> <table>" for PostgREST paths, "<METHOD> rpc/<fn>"
+    for RPCs and "<METHOD> <last path segment>" otherwise.
+    """
+
+    def on_request(request):
+        request.extensions["metrics_started"] = time.monotonic()
+
+    def on_response(response):
+        request = response.request
+        started = request.extensions.get("metrics_started")
+        size = response.headers.get("content-length")
+        observe_upstream(
+            upstream,
+            httpx_operation(request.method, request.url.path),
+            response.status_code,
+            time.monotonic() - started if started is not None else None,
+            int(size) if size and size.isdigit() else None,
+            f"{request.method} {request.url}",
+        )
+
+    hooks = client.event_hooks
+    client.event_hooks = {
+        "request": hooks.get("request", []) + [on_request],
+        "response": hooks.get("response", []) + [on_response],
+    }
+    return client
+
+
+def httpx_operation(method: str, path: str) -> str:
+    parts = [part for part in path.split("/") if part]
+    if len(parts) >= 3 and parts[0] == "rest":
+        resource = "/".join(parts[2:4]) if parts[2] == "rpc" else parts[2]
+    else:
+        resource = parts[-1] if parts else ""
+    return f"{method} {resource}"
+
+
+## 🌐 Flask
+
+
+def init_app(app):
+    """Per-route latency and in-flight tracking, plus the /metrics endpoint."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_request_metrics():
+        g.metrics_started = time.monotonic()
+        g.metrics_route = current_route()
+        HTTP_IN_FLIGHT.inc(g.metrics_route)
+
+    @app.after_request
+    def _record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_request_metrics(error=None):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return
+        route = g.pop("metrics_route", "unmatched")
+        status = g.pop("metrics_status", 500)
+        HTTP_IN_FLIGHT.dec(route)
+        HTTP_LATENCY.observe(time.monotonic() - started, route, request.method, str(status))
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render(), content_type=CONTENT_TYPE)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
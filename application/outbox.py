@@ -0,0 +1,125 @@
+"""
+Fire-and-forget message sends for the Flutter client.
+
+A send with `Prefer: respond-async` is appended to a Redis list and answered
+with 202 as soon as Redis has it, instead of once Supabase has stored it. A
+drainer thread in each worker sends queued messages in order through
+send_message. A lock lets one worker drain at a time. A message is removed
+from the list only after it is stored, and a retried send with the same
+client_id is stored once, so a worker dying mid-send loses nothing.
+
+Failed sends go to the back of the list and are retried, up to MAX_ATTEMPTS
+times. After that they move to OUTBOX_FAILED_KEY for inspection. Queued
+sends carry the sender's access token, so a backlog older than the token's
+lifetime (an hour) fails.
+
+The outbox needs the shared cache's Redis (REDIS_URL). Without it,
+queue_message returns False and the send happens inline as usual.
+"""
+import json
+import os
+import threading
+import time
+
+from application import cache
+from application.database import send_message
+from application.metrics import Counter
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+OUTBOX_KEY = f"{cache.PREFIX}:outbox:messages"
+OUTBOX_FAILED_KEY = f"{cache.PREFIX}:outbox:failed"
+LOCK_KEY = f"{cache.PREFIX}:outbox:lock"
+LOCK_TTL = 30
+MAX_ATTEMPTS = 5
+# Seconds between looks at an idle outbox, and after a failed send
+POLL_INTERVAL = 1.0
+RETRY_DELAY = 2.0
+
+OUTBOX_SENDS = Counter(
+    "outbox_sends_total",
+    "Queued message sends, by result: sent, retried or failed.",
+    ("result",),
+)
+
+_wake = threading.Event()
+_drainer = None
+_drainer_pid = None
+_drainer_lock = threading.Lock()
+
+
+def queue_message(**message) -> bool:
+    """Queues send_message(**message); False when there is no Redis to hold it."""
+    raw = json.dumps({"message": message, "attempts": 0}, separators=(",", ":"))
+    if not cache.command("rpush", OUTBOX_KEY, raw):
+        return False
+    _ensure_drainer()
+    _wake.set()
+    return True
+
+
+def drain_once() -> bool:
+    """Sends the oldest queued message; False when there was none."""
+    raw = cache.command("lindex", OUTBOX_KEY, 0)
+    if raw is None:
+        return False
+    queued = json.loads(raw)
+    message = queued["message"]
+    try:
+        send_message(**message)
+    except Exception as e:
+        queued["attempts"] += 1
+        if queued["attempts"] >= MAX_ATTEMPTS:
+            OUTBOX_SENDS.inc("failed")
+            log.error("queued message dropped", thread=message.get("thread_id"), error=e)
+            cache.command("rpush", OUTBOX_FAILED_KEY, json.dumps(queued))
+        else:
+            OUTBOX_SENDS.inc("retried")
+            log.warning("queued message send failed, retrying", thread=message.get("thread_id"), error=e)
+            cache.command("rpush", OUTBOX_KEY, json.dumps(queued))
+        cache.command("lrem", OUTBOX_KEY, 1, raw)
+        time.sleep(RETRY_DELAY)
+        return True
+    OUTBOX_SENDS.inc("sent")
+    cache.command("lrem", OUTBOX_KEY, 1, raw)
+    return True
+
+
+def _drain():
+    owner = str(os.getpid())
+    while True:
+        _wake.wait(POLL_INTERVAL)
+        _wake.clear()
+        if not cache.command("set", LOCK_KEY, owner, px=LOCK_TTL * 1000, nx=True):
+            continue
+        try:
+            while drain_once():
+                # Still ours while the drain lasts
+                cache.command("set", LOCK_KEY, owner, px=LOCK_TTL * 1000)
+        except Exception:
+            log.exception("outbox drain failed")
+        finally:
+            cache.command("delete", LOCK_KEY)
+
+
+def _ensure_drainer():
+    """Starts this worker's drainer thread; also picks up sends left by a dead worker."""
+    global _drainer, _drainer_pid
+    with _drainer_lock:
+        if _drainer_pid != os.getpid() or not _drainer.is_alive():
+            _drainer = threading.Thread(target=_drain, name="outbox-drainer", daemon=True)
+            _drainer.start()
+            _drainer_pid = os.getpid()
+
+
+## 🌐 Flask
+
+
+def init_app(app):
+    """Starts each worker's drainer on its first request, so a backlog left by a restart drains."""
+
+    @app.before_request
+    def start_outbox():
+        if _drainer_pid != os.getpid() and cache.connected():
+            _ensure_drainer()
@@ -0,0 +1,230 @@
+"""
+On-demand profiling of a single request.
+
+Disabled unless PROFILE_TOKEN is set to a secret of at least
+MIN_TOKEN_LENGTH characters. Then a request carrying
+`X-Profile-Token: <token>` (or `?_profile=<token>`) runs under cProfile plus
+a stack sampler. The session is not trusted for this, since anyone who knows
+the app's secret key can forge one. Two files are written to
+PROFILE_DIR/<trace id>/:
+
+- request.pstats     for `python -m pstats` or snakeviz
+- request.collapsed  "frame;frame;frame count" lines for flamegraph.pl or
+                     speedscope
+
+The response carries X-Profile-Location, the URL to list and download them.
+A Goodreads import started from a profiled request is profiled too; its
+files (import.*) appear in the same directory when the import finishes.
+
+When no profile is requested the only cost is one header and one query
+lookup per request. Under ASGI, async routes share the event loop thread,
+so their profile also includes whatever else ran on the loop meanwhile.
+"""
+import cProfile
+import hmac
+import os
+import re
+import shutil
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from configfile import profile_dir, profile_keep, profile_sample_interval, profile_token
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+HEADER = "X-Profile-Token"
+QUERY_FLAG = "_profile"
+LOCATION_HEADER = "X-Profile-Location"
+MIN_TOKEN_LENGTH = 16
+
+_SAFE_ID = re.compile(r"^[0-9A-Za-z_-]{1,64}$")
+_prune_lock = threading.Lock()
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples one thread's Python stack every `interval` seconds."""
+
+    def __init__(self, thread_id: int, interval: float = profile_sample_interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profile:
+    def __init__(self, profile_id: str, name: str):
+        self.profile_id = profile_id
+        self.name = name
+        self.profiler = None
+        self.sampler = None
+
+    def start(self):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            self.profiler = profiler
+        except ValueError:
+            # Another profiler is already active on this thread; sample only
+            pass
+        self.sampler = StackSampler(threading.get_ident()).start()
+        return self
+
+    def stop(self) -> Optional[str]:
+        """Stops profiling and writes the files; returns their directory."""
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        directory = profile_path(self.profile_id)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if self.profiler is not None:
+                self.profiler.dump_stats(os.path.join(directory, f"{self.name}.pstats"))
+            self.sampler.write(os.path.join(directory, f"{self.name}.collapsed"))
+        except OSError as e:
+            log.warning("could not write profile", profile=self.profile_id, error=e)
+            return None
+        prune()
+        return directory
+
+
+def profile_path(profile_id: str) -> str:
+    if not _SAFE_ID.match(profile_id or ""):
+        raise ValueError(f"invalid profile id {profile_id!r}")
+    return os.path.join(profile_dir, profile_id)
+
+
+def prune(keep: int = profile_keep):
+    """Removes all but the newest `keep` profile directories."""
+    with _prune_lock:
+        try:
+            entries = [entry for entry in os.scandir(profile_dir) if entry.is_dir()]
+        except OSError:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[keep:]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+@contextmanager
+def profiled(profile_id: Optional[str], name: str):
+    """Profiles the block into profile `profile_id`; a no-op when it is None."""
+    if not profile_id:
+        yield None
+        return
+    current = Profile(profile_id, name).start()
+    try:
+        yield current
+    finally:
+        current.stop()
+
+
+def current_profile_id() -> Optional[str]:
+    """Id of the active request's profile, to hand to work it starts."""
+    from flask import g, has_request_context
+
+    if not has_request_context():
+        return None
+    current = g.get("request_profile")
+    return current.profile_id if current is not None else None
+
+
+def _authorized(value: Optional[str]) -> bool:
+    if not value or not profile_token:
+        return False
+    return hmac.compare_digest(value.encode(), profile_token.encode())
+
+
+## 🌐 Flask
+
+
+def init_app(app):
+    """Profiles requests that carry the token, and serves the results to them."""
+    if not profile_token:
+        return
+    if len(profile_token) < MIN_TOKEN_LENGTH:
+        log.warning("PROFILE_TOKEN is too short, profiling disabled", minimum=MIN_TOKEN_LENGTH)
+        return
+
+    import secrets
+
+    from flask import abort, g, jsonify, request, send_from_directory, url_for
+
+    def _requested_by():
+        return request.headers.get(HEADER) or request.args.get(QUERY_FLAG)
+
+    @app.before_request
+    def _start_profile():
+        if request.endpoint == "profile_files" or not _authorized(_requested_by()):
+            return
+        current = g.get("request_trace")
+        profile_id = current.trace_id if current is not None else secrets.token_hex(16)
+        g.request_profile = Profile(profile_id, "request").start()
+
+    @app.after_request
+    def _finish_profile(response):
+        current = g.pop("request_profile", None)
+        if current is not None and current.stop() is not None:
+            response.headers[LOCATION_HEADER] = url_for(
+                "profile_files", profile_id=current.profile_id
+            )
+        return response
+
+    @app.teardown_request
+    def _abandon_profile(error=None):
+        # after_request is skipped when the view raised
+        current = g.pop("request_profile", None)
+        if current is not None:
+            current.stop()
+
+    @app.route("/debug/profiles/<profile_id>", endpoint="profile_files")
+    @app.route("/debug/profiles/<profile_id>/<filename>", endpoint="profile_files")
+    def profile_files(profile_id, filename=None):
+        if not _authorized(_requested_by()):
+            abort(404)
+        try:
+            directory = os.path.abspath(profile_path(profile_id))
+        except ValueError:
+            abort(404)
+        if filename is None:
+            if not os.path.isdir(directory):
+                abort(404)
+            return jsonify(
+                {
+                    "profile_id": profile_id,
+                    "files": sorted(os.listdir(directory)),
+                }
+            )
+        return send_from_directory(directory, filename, as_attachment=True)
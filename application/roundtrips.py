@@ -0,0 +1,154 @@
+"""
+Round-trip accounting per request, for development and CI.
+
+With ROUNDTRIP_CHECK=warn (or strict) every Supabase query and external
+HTTP call made while handling a request is counted; they all pass through
+metrics.observe_upstream. When the request ends:
+
+- identical calls made more than once are reported as repeats (usually an
+  N+1 loop or a lookup that should have been reused), and
+- a route that made more calls than the budget declared with
+  @round_trip_budget is reported; in strict mode the request fails with
+  RoundTripBudgetExceeded, so a test driving the route fails with it.
+
+report() aggregates per route. scripts/check_round_trips.py drives the main
+routes against a local Supabase stand-in and exits non-zero on a violation.
+"""
+import contextvars
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+from configfile import roundtrip_check
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+OFF, WARN, STRICT = "off", "warn", "strict"
+
+_SECRET_PARAMS = re.compile(r"([?&](?:key|apikey|access_token)=)[^&]+", re.IGNORECASE)
+
+_current_tally = contextvars.ContextVar("round_trip_tally", default=None)
+_report = {}
+_report_lock = threading.Lock()
+
+
+class RoundTripBudgetExceeded(Exception):
+    def __init__(self, route: str, count: int, budget: int, repeats: dict):
+        self.route = route
+        self.count = count
+        self.budget = budget
+        self.repeats = repeats
+        super().__init__(
+            f"{route} made {count} upstream round trips (budget {budget})"
+            + (f"; repeated: {repeats}" if repeats else "")
+        )
+
+
+class Tally:
+    __slots__ = ("count", "calls")
+
+    def __init__(self):
+        self.count = 0
+        self.calls = Counter()
+
+    def repeats(self) -> dict:
+        return {call: n for call, n in self.calls.items() if n > 1}
+
+
+def round_trip_budget(limit: int):
+    """Declares the most upstream round trips one request to the view may make."""
+
+    def decorator(view):
+        view.round_trip_budget = limit
+        return view
+
+    return decorator
+
+
+def enabled() -> bool:
+    return roundtrip_check in (WARN, STRICT)
+
+
+def count_call(upstream: str, operation: str, target: Optional[str] = None):
+    """Counts one outbound call against the current request, if one is tallied."""
+    tally = _current_tally.get()
+    if tally is None:
+        return
+    tally.count += 1
+    # Calls without a target (e.g. Gemini prompts) are counted, but only
+    # calls with the same target are treated as repeats
+    if target is not None:
+        tally.calls[f"{upstream} {operation} {_redact(target)}"] += 1
+
+
+def _redact(target: str) -> str:
+    # Reports end up in logs; keep API keys out of them
+    return _SECRET_PARAMS.sub(r"\1***", target)
+
+
+def report() -> dict:
+    """Per-route totals since startup (or the last reset)."""
+    with _report_lock:
+        return {
+            route: {**entry, "repeats": dict(entry["repeats"])}
+            for route, entry in _report.items()
+        }
+
+
+def reset():
+    with _report_lock:
+        _report.clear()
+
+
+def _record(route: str, tally: Tally, budget: Optional[int]) -> bool:
+    repeats = tally.repeats()
+    over = budget is not None and tally.count > budget
+    with _report_lock:
+        entry = _report.setdefault(
+            route,
+            {"requests": 0, "max": 0, "total": 0, "budget": budget, "violations": 0,
+             "repeats": Counter()},
+        )
+        entry["requests"] += 1
+        entry["total"] += tally.count
+        entry["max"] = max(entry["max"], tally.count)
+        entry["violations"] += over
+        entry["repeats"].update(repeats)
+    if repeats:
+        log.warning("repeated upstream calls", route=route, repeats=repeats)
+    if over:
+        log.warning("round-trip budget exceeded", route=route, count=tally.count, budget=budget)
+    return over
+
+
+## 🌐 Flask
+
+
+def init_app(app):
+    """Tallies round trips per request when ROUNDTRIP_CHECK is warn or strict."""
+    if not enabled():
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def _start_tally():
+        g.round_trip_token = _current_tally.set(Tally())
+
+    @app.after_request
+    def _check_tally(response):
+        token = g.pop("round_trip_token", None)
+        tally = _current_tally.get()
+        if token is None or tally is None:
+            return response
+        _current_tally.reset(token)
+
+        rule = request.url_rule
+        route = rule.rule if rule is not None else request.path
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, "round_trip_budget", None)
+        if _record(route, tally, budget) and roundtrip_check == STRICT:
+            raise RoundTripBudgetExceeded(route, tally.count, budget, tally.repeats())
+        return response
@@ -0,0 +1,51 @@
+from spotipy.cache_handler import CacheHandler
+
+from application.cache import TOKENS
+from application.database import get_supabase_client
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+# Kept out of suggestions.py because subclassing CacheHandler needs spotipy at
+# import time; suggestions.py imports this module on first use instead.
+
+
+class SupabaseCacheHandler(CacheHandler):
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    def get_cached_token(self):
+        try:
+            return TOKENS.get_or_load(self.user_id, self._select_token)
+        except Exception as e:
+            log.warning("spotify token fetch failed", user=self.user_id, error=e)
+            return None
+
+    def _select_token(self):
+        supabase = get_supabase_client()
+        # .maybe_single() is cleaner for fetching one row
+        res = (
+            supabase.table("spotify_tokens")
+            .select("access_token, refresh_token, expires_at, token_type, scope")
+            .eq("user_id", self.user_id)
+            .maybe_single()
+            .execute()
+        )
+        return res.data if res and res.data else None
+
+    def save_token_to_cache(self, token_info):
+        supabase = get_supabase_client()
+        try:
+            payload = {
+                "user_id": self.user_id,
+                "access_token": token_info.get("access_token"),
+                "refresh_token": token_info.get("refresh_token"),
+                "expires_at": token_info.get("expires_at"),
+                "token_type": token_info.get("token_type"),
+                "scope": token_info.get("scope"),
+            }
+            # Ensure your DB has a unique constraint on user_id for upsert to work
+            supabase.table("spotify_tokens").upsert(payload).execute()
+            TOKENS.set(self.user_id, payload)
+        except Exception as e:
+            log.warning("spotify token save failed", user=self.user_id, error=e)
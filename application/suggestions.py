@@ -1,14 +1,10 @@
-import os
-import time
-import spotipy
-import requests
 import base64
 from flask import session
-from spotipy.oauth2 import SpotifyOAuth, CacheHandler
 from configfile import (
     spotify_id as sid,
     spotify_secret as sid_sec,
     bot_id as BOT_USER_ID,
+    spotify_api_url,
 )
 
 from application.database import (
@@ -16,58 +12,31 @@ from application.database import (
     save_img_to_db,
     get_supabase_client,
 )
+from application.deadlines import DeadlineExceeded, timeout_for
+from application.breakers import CircuitOpenError, guard
+from application.integrations import get_requests, get_spotipy
+from application.log import get_logger
+
+log = get_logger(__name__)
 
 # Configuration
 REDIRECT_URI = "https://cadence-reading-app.onrender.com/api_callback"
 REDIRECT_URI2 = "http://127.0.0.1:3000/api_callback"
 SCOPE = "user-read-recently-played, user-top-read, user-read-currently-playing, playlist-modify-public, ugc-image-upload"
 
-# --- SUPABASE CACHE HANDLER ---
-
-
-class SupabaseCacheHandler(CacheHandler):
-    def __init__(self, user_id):
-        self.user_id = user_id
-
-    def get_cached_token(self):
-        supabase = get_supabase_client()
-        try:
-            # .maybe_single() is cleaner for fetching one row
-            res = (
-                supabase.table("spotify_tokens")
-                .select("access_token, refresh_token, expires_at, token_type, scope")
-                .eq("user_id", self.user_id)
-                .maybe_single()
-                .execute()
-            )
-            return res.data if res.data else None
-        except Exception as e:
-            print(f"Error fetching token for {self.user_id}: {e}")
-            return None
+# --- CORE AUTH LOGIC ---
 
-    def save_token_to_cache(self, token_info):
-        supabase = get_supabase_client()
-        try:
-            payload = {
-                "user_id": self.user_id,
-                "access_token": token_info.get("access_token"),
-                "refresh_token": token_info.get("refresh_token"),
-                "expires_at": token_info.get("expires_at"),
-                "token_type": token_info.get("token_type"),
-                "scope": token_info.get("scope"),
-            }
-            # Ensure your DB has a unique constraint on user_id for upsert to work
-            supabase.table("spotify_tokens").upsert(payload).execute()
-        except Exception as e:
-            print(f"Error saving token for {self.user_id}: {e}")
 
+def get_cache_handler(user_id):
+    """Token cache handler for `user_id` (spotipy is imported on first use)."""
+    from application.spotify_auth import SupabaseCacheHandler
 
-# --- CORE AUTH LOGIC ---
+    return SupabaseCacheHandler(user_id)
 
 
 def get_spotify_oauth(handler=None):
     """Factory for SpotifyOAuth to ensure consistent config."""
-    return SpotifyOAuth(
+    return get_spotipy().SpotifyOAuth(
         client_id=sid,
         client_secret=sid_sec,
         redirect_uri=REDIRECT_URI,
@@ -75,30 +44,46 @@ def get_spotify_oauth(handler=None):
         cache_handler=handler,
         cache_path=None,  # Disables local .cache file creation
         show_dialog=True,
+        requests_timeout=timeout_for("spotify"),
     )
 
 
-def get_spotify_client():
-    handler = SupabaseCacheHandler(BOT_USER_ID)
+def get_bot_access_token():
+    """Returns a valid (refreshed if needed) access token for the bot account."""
+    handler = get_cache_handler(BOT_USER_ID)
     sp_oauth = get_spotify_oauth(handler=handler)
 
     cached_token = handler.get_cached_token()
 
     if not cached_token:
-        print(f"CRITICAL: No token found in Supabase for {BOT_USER_ID}")
+        log.error("no spotify token stored for the bot account", bot=BOT_USER_ID)
         return None
 
     # validate_token returns the valid token or a newly refreshed one
-    token_info = sp_oauth.validate_token(cached_token)
+    try:
+        with guard("spotify", "validate_token", "token"):
+            token_info = sp_oauth.validate_token(cached_token)
+    except CircuitOpenError as e:
+        log.warning("skipping spotify", error=e)
+        return None
 
     if not token_info:
-        print(
-            "DEBUG: Token validation failed. Token might be revoked or refresh failed."
-        )
+        log.warning("spotify token validation failed; revoked or refresh failed")
+        return None
+
+    return token_info["access_token"]
+
+
+def get_spotify_client():
+    access_token = get_bot_access_token()
+    if not access_token:
         return None
 
     # Ensure the access token is passed correctly
-    return spotipy.Spotify(auth=token_info["access_token"])
+    sp = get_spotipy().Spotify(auth=access_token, requests_timeout=timeout_for("spotify"))
+    # spotipy has no constructor argument for the API base URL
+    sp.prefix = f"{spotify_api_url}/"
+    return sp
 
 
 def verify_token(platform):
@@ -121,16 +106,16 @@ def app_callback(request):
 
         # 2. Use the BOT_USER_ID handler specifically
         # This ensures the token is saved in the row the bot actually looks at
-        handler = SupabaseCacheHandler(BOT_USER_ID)
+        handler = get_cache_handler(BOT_USER_ID)
         handler.save_token_to_cache(token_info)
 
-        print(f"SUCCESS: Token saved for bot account {BOT_USER_ID}")
+        log.info("spotify token saved for the bot account", bot=BOT_USER_ID)
 
         # Optional: Sync session just for visual feedback in your UI
         session["bot_user_id"] = BOT_USER_ID
 
     except Exception as e:
-        print(f"Callback error: {e}")
+        log.warning("spotify callback failed", error=e)
 
     return session
 
@@ -138,16 +123,33 @@ def app_callback(request):
 # --- HELPER FUNCTIONS ---
 
 
+def within_deadline(sp):
+    """
+    Sets sp's timeout to what is left of the request budget, so each call
+    gets the remainder rather than the budget fixed when the client was
+    built. Raises DeadlineExceeded once it is spent.
+    """
+    sp.requests_timeout = timeout_for("spotify")
+    return sp
+
+
 def spotify_search(sp, songs):
     """Search for tracks. Accepts 'sp' client to avoid redundant DB hits."""
     if not sp:
         return []
 
     results = []
-    for song in songs:
+    for searched, song in enumerate(songs):
+        try:
+            within_deadline(sp)
+        except DeadlineExceeded:
+            log.warning("spotify search stopped at the deadline", found=len(results),
+                        skipped=len(songs) - searched)
+            break
         try:
             query = f"track:{song['song_title']} artist:{song['artist']}"
-            search_result = sp.search(q=query, type="track", limit=1)
+            with guard("spotify", "search", query):
+                search_result = sp.search(q=query, type="track", limit=1)
             items = search_result.get("tracks", {}).get("items", [])
 
             if items:
@@ -159,7 +161,7 @@ def spotify_search(sp, songs):
                     }
                 )
         except Exception as e:
-            print(f"Search error for {song.get('song_title')}: {e}")
+            log.warning("spotify search failed", song=song.get("song_title"), error=e)
     return results
 
 
@@ -171,16 +173,18 @@ def create_playlist(book, songs, cover_url):
     try:
         # NEW FOR 2026: Always get 'me' first to ensure the token is active
         # and you are hitting the /me endpoint
-        me = sp.current_user()
+        with guard("spotify", "current_user", "me"):
+            me = within_deadline(sp).current_user()
 
         # FIX: Create as PRIVATE. New accounts often fail 403 on Public playlists
         # until the app is moved out of "Development Mode".
-        playlist = sp.user_playlist_create(
-            user=me["id"],
-            name=f"cadence - {book['title']}",
-            public=False,  # <--- CRITICAL CHANGE
-            description=f"Playlist for {book['title']}",
-        )
+        with guard("spotify", "create_playlist"):
+            playlist = within_deadline(sp).user_playlist_create(
+                user=me["id"],
+                name=f"cadence - {book['title']}",
+                public=False,  # <--- CRITICAL CHANGE
+                description=f"Playlist for {book['title']}",
+            )
 
         playlist_id = playlist["id"]
         found_tracks = spotify_search(sp, songs)
@@ -188,11 +192,12 @@ def create_playlist(book, songs, cover_url):
 
         if track_uris:
             # Ensure you use playlist_add_items (uses the /items endpoint)
-            sp.playlist_add_items(playlist_id=playlist_id, items=track_uris[:100])
+            with guard("spotify", "add_items"):
+                within_deadline(sp).playlist_add_items(playlist_id=playlist_id, items=track_uris[:100])
 
         return {"playlist_id": playlist_id}
     except Exception as e:
-        print(f"2026 API Error: {e}")
+        log.warning("spotify playlist creation failed", error=e)
         return None
 
 
@@ -201,18 +206,19 @@ def upload_playlist_cover(sp, playlist_id, cover_url):
     try:
         # 1. Get the actual image URL from your DB tool
         final_img_url = save_img_to_db(cover_url)
-        resp = requests.get(final_img_url)
+        resp = get_requests().get(final_img_url, timeout=timeout_for("supabase"))
 
         if resp.status_code == 200:
             # Spotify limit is ~256KB. If your images are huge, this will fail.
             if len(resp.content) > 250000:
-                print("Warning: Image too large for Spotify cover.")
+                log.warning("cover too large for spotify", bytes=len(resp.content))
                 return
 
             b64_img = base64.b64encode(resp.content).decode("utf-8")
-            sp.playlist_upload_cover_image(playlist_id, b64_img)
+            with guard("spotify", "upload_cover"):
+                within_deadline(sp).playlist_upload_cover_image(playlist_id, b64_img)
     except Exception as e:
-        print(f"Cover upload error: {e}")
+        log.warning("spotify cover upload failed", error=e)
 
 
 def get_profile_data():
@@ -220,23 +226,33 @@ def get_profile_data():
 
     sp = get_spotify_client()
 
-    print(f"DEBUG: get_profile_data - Spotify client: {sp}")
-
     if not sp:
 
         return None
 
     try:
 
-        return sp.current_user()
+        with guard("spotify", "current_user", "me"):
+            return sp.current_user()
 
     except Exception as e:
 
-        print(f"Error fetching profile data: {e}")
+        log.warning("spotify profile fetch failed", error=e)
 
         return None
 
 
+def profile_image(data):
+    """Picks the profile picture out of a Spotify user object, if it has one."""
+    images = data.get("images") or []
+    # Return profile image if available
+    if len(images) > 1:
+        return images[1]["url"]
+    elif images:
+        return images[0]["url"]
+    return None
+
+
 def get_profile(user_id=None):
     """
     Get user's Spotify profile picture.
@@ -254,19 +270,13 @@ def get_profile(user_id=None):
         return None
 
     try:
-        data = sp.current_user()
+        with guard("spotify", "current_user", "me"):
+            data = sp.current_user()
         session["bot_user_id"] = data["id"]
-        print("Fetched user profile:", data["id"])
-
-        # Return profile image if available
-        if data.get("images") and len(data["images"]) > 1:
-            return data["images"][1]["url"]
-        elif data.get("images") and len(data["images"]) > 0:
-            return data["images"][0]["url"]
-
-        return None
+        log.debug("spotify profile fetched", id=data["id"])
+        return profile_image(data)
     except Exception as e:
-        print(f"Error fetching profile for user {user_id}: {e}")
+        log.warning("spotify profile fetch failed", user=user_id, error=e)
         return None
 
 
@@ -281,7 +291,7 @@ def clear_session(user_id=None):
         session object
     """
     if user_id:
-        handler = SupabaseCacheHandler(user_id)
+        handler = get_cache_handler(user_id)
         token_key = handler.get_token_key(user_id)
         session.pop(token_key, None)
         if session.get("user") == user_id:
@@ -0,0 +1,247 @@
+"""
+Per-request span tracing with a slow-request log.
+
+Every request (and every background job) gets a trace: a root span with a
+child span for each PostgREST query, outbound HTTP call, Pillow step and
+template render, carrying its start offset from the root and its duration.
+Traces slower than the threshold are written as one JSON line to a rotating
+log file.
+
+Ids follow W3C Trace Context: an incoming `traceparent` header is
+continued, and background work started from a request is handed
+current_traceparent() so it joins the same trace.
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import secrets
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+from configfile import slow_job_ms, slow_request_log, slow_request_ms
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+# Spans kept per trace; a long import would otherwise grow without bound
+MAX_SPANS = 2000
+SLOW_LOG_MAX_BYTES = 10 * 1024 * 1024
+SLOW_LOG_BACKUPS = 5
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_slow_log = None
+
+
+class Trace:
+    def __init__(self, name: str, traceparent: Optional[str] = None):
+        parsed = parse_traceparent(traceparent)
+        self.trace_id = parsed[0] if parsed else secrets.token_hex(16)
+        self.parent_id = parsed[1] if parsed else None
+        self.span_count = 0
+        self.dropped = 0
+        self.root = Span(name, self)
+
+
+class Span:
+    __slots__ = ("name", "trace", "span_id", "started", "duration", "attrs", "children")
+
+    def __init__(self, name: str, trace: Trace, started: Optional[float] = None, attrs=None):
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.started = time.monotonic() if started is None else started
+        self.duration = None
+        self.attrs = attrs or {}
+        self.children = []
+        trace.span_count += 1
+
+    def child(self, name: str, started: Optional[float] = None, attrs=None) -> Optional["Span"]:
+        if self.trace.span_count >= MAX_SPANS:
+            self.trace.dropped += 1
+            return None
+        span = Span(name, self.trace, started, attrs)
+        self.children.append(span)
+        return span
+
+    def to_dict(self, origin: float) -> dict:
+        data = {
+            "name": self.name,
+            "start_ms": round((self.started - origin) * 1000, 2),
+            "duration_ms": round((self.duration or 0) * 1000, 2),
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+def parse_traceparent(header: Optional[str]):
+    """Returns (trace_id, parent_span_id) from a W3C traceparent, or None."""
+    match = _TRACEPARENT.match((header or "").strip().lower())
+    if not match or set(match.group(1)) == {"0"} or set(match.group(2)) == {"0"}:
+        return None
+    return match.group(1), match.group(2)
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent header value for the active span, to hand to background work."""
+    span = _current_span.get()
+    if span is None:
+        return None
+    return f"00-{span.trace.trace_id}-{span.span_id}-01"
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace.trace_id if span is not None else None
+
+
+def start_trace(name: str, traceparent: Optional[str] = None):
+    """Starts a trace and makes its root span current. Returns (trace, token)."""
+    current = Trace(name, traceparent)
+    return current, _current_span.set(current.root)
+
+
+def finish_trace(current: Trace, token, threshold_ms: float = None, **attrs):
+    """Closes the root span and logs the trace if it exceeded the threshold."""
+    root = current.root
+    root.duration = time.monotonic() - root.started
+    root.attrs.update(attrs)
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Finished from a different context than it was started in
+        _current_span.set(None)
+    threshold_ms = slow_request_ms if threshold_ms is None else threshold_ms
+    if root.duration * 1000 >= threshold_ms:
+        write_slow_trace(current)
+
+
+@contextmanager
+def trace(name: str, traceparent: Optional[str] = None, threshold_ms: float = None):
+    """Runs the block as the root span of a new trace (background jobs)."""
+    current, token = start_trace(name, traceparent)
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        attrs = {"error": error} if error else {}
+        threshold_ms = slow_job_ms if threshold_ms is None else threshold_ms
+        finish_trace(current, token, threshold_ms, **attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Times the block as a child of the current span; a no-op outside a trace."""
+    parent = _current_span.get()
+    child = parent.child(name, attrs=attrs) if parent is not None else None
+    if child is None:
+        yield None
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.duration = time.monotonic() - child.started
+        _current_span.reset(token)
+
+
+def add_span(name: str, started: float, duration: float, **attrs):
+    """Records an already finished operation as a child of the current span."""
+    parent = _current_span.get()
+    if parent is not None:
+        child = parent.child(name, started=started, attrs=attrs)
+        if child is not None:
+            child.duration = duration
+
+
+## 🐢 Slow-request log
+
+
+def get_slow_log() -> logging.Logger:
+    global _slow_log
+    if _slow_log is None:
+        logger = logging.getLogger("cadence.slow_requests")
+        logger.propagate = False
+        directory = os.path.dirname(slow_request_log)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(
+            slow_request_log, maxBytes=SLOW_LOG_MAX_BYTES, backupCount=SLOW_LOG_BACKUPS
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        _slow_log = logger
+    return _slow_log
+
+
+def write_slow_trace(current: Trace):
+    root = current.root
+    record = {
+        "trace_id": current.trace_id,
+        "parent_id": current.parent_id,
+        "name": root.name,
+        "duration_ms": round(root.duration * 1000, 2),
+        "spans": root.to_dict(root.started),
+    }
+    if current.dropped:
+        record["dropped_spans"] = current.dropped
+    try:
+        get_slow_log().info(json.dumps(record, default=str))
+    except OSError as e:
+        log.warning("could not write slow-request log", error=e)
+
+
+## 🌐 Flask
+
+
+def init_app(app):
+    """Traces every request and every template render."""
+    from flask import before_render_template, g, request, template_rendered
+
+    @app.before_request
+    def _start_request_trace():
+        g.request_trace, g.request_trace_token = start_trace(
+            f"{request.method} {request.path}", request.headers.get("traceparent")
+        )
+
+    @app.after_request
+    def _record_trace_status(response):
+        current = g.get("request_trace")
+        if current is not None:
+            current.root.attrs["status"] = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_request_trace(error=None):
+        current = g.pop("request_trace", None)
+        if current is None:
+            return
+        rule = request.url_rule
+        attrs = {"route": rule.rule if rule is not None else None}
+        if error is not None:
+            attrs["error"] = repr(error)
+        finish_trace(current, g.pop("request_trace_token"), **attrs)
+
+    def _render_started(sender, template, context, **extra):
+        g.setdefault("render_starts", []).append(time.monotonic())
+
+    def _render_finished(sender, template, context, **extra):
+        starts = g.get("render_starts")
+        if starts:
+            started = starts.pop()
+            add_span(f"render {template.name}", started, time.monotonic() - started)
+
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_finished, app, weak=False)
@@ -0,0 +1,7 @@
+from main import app as flask_app
+from services.asgi.app import AsgiApp
+import services.asgi.routes  # registers the async handlers
+
+# ASGI entry point: uvicorn asgi:app
+# main:app remains the WSGI entry point for gunicorn.
+app = AsgiApp(flask_app)
@@ -0,0 +1,569 @@
+"""
+Benchmark harness: runs the app against local stand-ins for every upstream
+and writes comparable JSON results.
+
+    python bench/run.py [--scenarios profile,htmx_search,...] [--iterations 30]
+                        [--concurrency 1] [--latency 0.02] [--error-rate 0]
+                        [--import-rows 200] [--output results.json]
+                        [--compare previous.json]
+
+--latency and --error-rate take one value for all upstreams or per-upstream
+values, e.g. `--latency 0.02,gemini=0.4` (names: supabase, google_books,
+openlibrary, gemini, spotify). --cache picks the shared cache tier: "memory"
+(the default, an in-process Redis stand-in), "off", or a redis:// URL.
+
+Scenarios (see SCENARIOS):
+  profile           GET /profile as a signed-in user
+  htmx_search       GET /htmx/search for a query already in cached_library
+  htmx_search_miss  GET /htmx/search for a new query (Google Books, then a cache write)
+  testgen           POST /testgen for a new book (Gemini, then Spotify)
+  chat_room         GET /chat/<thread> with --messages messages
+  goodreads_import  parse a Goodreads CSV of --import-rows rows and run the import task
+  cover             GET /covers/<key> across the library's covers (rendered once, then from disk)
+  render_profile    render profile.html for an unchanged library (shelves from the fragment cache)
+  render_changed    render profile.html after a library write (every shelf re-rendered)
+  template_compile  load profile.html into a fresh template cache (from the bytecode cache)
+  open_chat         POST /create_thread for a chat that already exists (opens it)
+  new_chat          GET /new_chat (contacts only; --users other profiles exist)
+  directory_search  GET /directory for a name prefix, as the typeahead does
+  top_fives         GET /api/topfive for 20 users, as a friends list would
+  friends_feed      GET /friends (the timeline with Redis, the activity table with --cache off)
+  send_message      POST /send_message, answered once the message is stored
+  send_message_async  the same with `Prefer: respond-async`, answered once it is queued
+
+The render scenarios time template rendering alone; run them with
+`--library-size 2000` to see what a large library costs.
+
+Each scenario reports latency percentiles, throughput, failures and the
+upstream calls it made per iteration (from the app's own metrics), plus the
+run's settings and git commit, so results from different commits can be
+diffed with --compare.
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.standins import (  # noqa: E402
+    Gemini,
+    GoogleBooks,
+    OpenLibrary,
+    PostgREST,
+    Spotify,
+    fake_jwt,
+)
+
+UPSTREAMS = ("supabase", "google_books", "openlibrary", "gemini", "spotify")
+USER_ID = "00000000-0000-0000-0000-000000000001"
+FRIEND_ID = "00000000-0000-0000-0000-000000000002"
+BOT_ID = "00000000-0000-0000-0000-0000000000b0"
+THREAD_ID = "10000000-0000-0000-0000-000000000001"
+DISPLAY_NAME = "reader1"
+
+
+def per_upstream(text: str) -> dict:
+    """'0.02,gemini=0.4' -> {upstream: value} for every upstream."""
+    values = dict.fromkeys(UPSTREAMS, 0.0)
+    for part in filter(None, (text or "").split(",")):
+        name, _, value = part.rpartition("=")
+        if name and name not in values:
+            raise SystemExit(f"unknown upstream {name!r}; expected one of {', '.join(UPSTREAMS)}")
+        for key in [name] if name else UPSTREAMS:
+            values[key] = float(value)
+    return values
+
+
+def start_standins(latency: dict, error_rate: dict, seed: int):
+    def settings(name):
+        return {"latency": latency[name], "error_rate": error_rate[name], "seed": seed}
+
+    return {
+        "supabase": PostgREST(**settings("supabase")).start(),
+        "google_books": GoogleBooks(**settings("google_books")).start(),
+        "openlibrary": OpenLibrary(**settings("openlibrary")).start(),
+        "gemini": Gemini(**settings("gemini")).start(),
+        "spotify": Spotify(**settings("spotify")).start(),
+    }
+
+
+def configure_env(standins, cache: str):
+    """Points the app at the stand-ins; must run before the app is imported."""
+    if cache == "off":
+        os.environ["CACHE_ENABLED"] = "0"
+    else:
+        os.environ["REDIS_URL"] = "memory://" if cache == "memory" else cache
+    os.environ.update({
+        "supabase_url": standins["supabase"].url,
+        "supabase_key": "bench-anon-key",
+        "supabase_service": "bench-service-key",
+        "GOOGLE_BOOKS_URL": standins["google_books"].url,
+        "GOOGLE_BOOKS": "bench-key",
+        "OPENLIBRARY_URL": standins["openlibrary"].url,
+        "GEMINI_URL": standins["gemini"].url,
+        "GEMINI_API_KEY": "bench-key",
+        "SPOTIFY_API_URL": f"{standins['spotify'].url}/v1",
+        "sid": "bench-client-id",
+        "sid_sec": "bench-client-secret",
+        "bot_id": BOT_ID,
+        # Keep the slow-request log of a benchmark out of the real one
+        "SLOW_REQUEST_LOG": os.path.join(os.getcwd(), "slow_requests.log"),
+    })
+
+
+def seed(db: PostgREST, messages: int, library_size: int, covers_url: str = "", users: int = 0):
+    from application.suggestions import SCOPE
+
+    db.insert("profiles", [
+        {"id": USER_ID, "display_name": DISPLAY_NAME, "avatar_url": None,
+         "role": "reader", "badges": [], "directory_seq": 1},
+        {"id": FRIEND_ID, "display_name": "reader2", "avatar_url": None,
+         "role": "reader", "badges": [], "directory_seq": 2},
+        *({"id": f"20000000-0000-0000-0000-{i:012d}", "display_name": f"Member {i}",
+           "avatar_url": None, "role": "reader", "badges": [], "directory_seq": 3 + i}
+          for i in range(users)),
+    ])
+    db.insert("library", [
+        {"user_id": USER_ID, "title": f"Seeded Book {i}", "author": "Seed Author",
+         "isbn": f"97800000{i:05d}", "status": ("tbr", "reading", "completed")[i % 3],
+         "cover_url": f"{covers_url}/covers/97800000{i:05d}.jpg" if covers_url else "",
+         "total_pages": 300, "current_page": i % 300,
+         "description": "Seeded."}
+        for i in range(library_size)
+    ])
+    db.insert("cached_library", [
+        {"title": "Dune", "authors": "Frank Herbert", "isbn": "9780441013593",
+         "cover_url": "", "pages": 612, "description": "Seeded."},
+        {"title": "Dune Messiah", "authors": "Frank Herbert", "isbn": "9780593098233",
+         "cover_url": "", "pages": 336, "description": "Seeded."},
+    ], on_conflict="isbn")
+    db.insert("threads", [
+        {"id": THREAD_ID, "name": "bench", "type": "private", "display_name": "reader2",
+         "participant_key": ",".join(sorted((USER_ID, FRIEND_ID))),
+         "updated_at": "2026-01-01T00:00:00+00:00"}
+    ])
+    db.insert("thread_participants", [
+        {"thread_id": THREAD_ID, "user_id": USER_ID},
+        {"thread_id": THREAD_ID, "user_id": FRIEND_ID},
+    ])
+    db.insert("messages", [
+        {"thread_id": THREAD_ID, "sender_id": (USER_ID, FRIEND_ID)[i % 2],
+         "content": f"Message {i}", "created_at": f"2026-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}+00:00"}
+        for i in range(messages)
+    ])
+    db.insert("follows", {"follower_id": USER_ID, "followee_id": FRIEND_ID})
+    db.insert("activity", [
+        {"id": f"30000000-0000-0000-0000-{i:012d}", "user_id": FRIEND_ID, "kind": "progress",
+         "data": {"book_id": i, "title": f"Seeded Book {i}", "pages_read": i},
+         "created_at": f"2026-01-01T00:00:{i % 60:02d}+00:00"}
+        for i in range(50)
+    ])
+    db.insert("topfive", [
+        {"username": f"Member {i}", "items": [{"title": f"Seeded Book {j}"} for j in range(5)]}
+        for i in range(min(users, 20))
+    ])
+    db.insert("spotify_tokens", {
+        "user_id": BOT_ID, "access_token": "bench-access-token",
+        "refresh_token": "bench-refresh-token", "expires_at": int(time.time()) + 86400,
+        # Spotify returns scopes space-separated; spotipy rejects a cached
+        # token whose scopes don't cover SCOPE
+        "token_type": "Bearer", "scope": " ".join(part.strip() for part in SCOPE.split(",")),
+    })
+
+
+def register_functions(db: PostgREST):
+    """The RPCs from supabase/migrations that the scenarios call."""
+
+    @db.function("send_message")
+    def send_message(db, p_thread_id, p_sender_id, p_content, p_shared_data=None,
+                     p_client_id=None):
+        stored = next((row for row in db.rows("messages")
+                       if p_client_id and row.get("client_id") == p_client_id), None)
+        if stored is None:
+            [stored] = db.insert("messages", {
+                "thread_id": p_thread_id, "sender_id": p_sender_id, "content": p_content,
+                "shared_data": p_shared_data, "client_id": p_client_id,
+            })
+            db.insert("threads", {"id": p_thread_id, "updated_at": stored["created_at"]})
+        participants = [row["user_id"] for row in db.rows("thread_participants")
+                        if row["thread_id"] == p_thread_id]
+        return [{"message": stored, "participants": participants}]
+
+    def private_thread(db, key):
+        return next((row["id"] for row in db.rows("threads")
+                     if row.get("type") == "private" and row.get("participant_key") == key), None)
+
+    @db.function("find_conversation")
+    def find_conversation(db, participant_ids):
+        return private_thread(db, ",".join(sorted(set(participant_ids))))
+
+    @db.function("create_new_chat")
+    def create_new_chat(db, participant_ids, thread_name, thread_type):
+        key = ",".join(sorted(set(participant_ids)))
+        existing = private_thread(db, key) if thread_type == "private" else None
+        if existing:
+            return existing
+        [thread] = db.insert("threads", {"display_name": thread_name, "type": thread_type,
+                                         "participant_key": key})
+        db.insert("thread_participants", [{"thread_id": thread["id"], "user_id": user_id}
+                                          for user_id in sorted(set(participant_ids))])
+        return thread["id"]
+
+
+def goodreads_csv(rows: int, cached: int = 0) -> str:
+    """A Goodreads export with `rows` books, the first `cached` already in cached_library."""
+    out = io.StringIO()
+    writer = csv.DictWriter(out, ["Book Id", "Title", "Author", "ISBN", "ISBN13",
+                                  "Exclusive Shelf", "Number of Pages"])
+    writer.writeheader()
+    for i in range(rows):
+        title = "Dune" if i < cached else f"Imported Book {i}"
+        writer.writerow({
+            "Book Id": i, "Title": title, "Author": f"Author {i % 17}",
+            "ISBN": f'="{i:010d}"', "ISBN13": f'="978{i:010d}"',
+            "Exclusive Shelf": "read", "Number of Pages": 250,
+        })
+    return out.getvalue()
+
+
+## 🏃 Scenarios
+
+
+def signed_in_client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = USER_ID
+        session["user"] = USER_ID
+        session["access_token"] = fake_jwt(USER_ID, ttl=86400)
+        session["display_name"] = DISPLAY_NAME
+        session["bot_user_id"] = BOT_ID
+    return client
+
+
+def http_scenario(method, path, body=None, headers=None):
+    """
+    A scenario that makes one request and returns an error string or None.
+    `path` and `body` may use {i} (the iteration) and {run} (unique per run).
+    """
+
+    def run(client, i, options):
+        kwargs = {}
+        if body is not None:
+            kwargs["json"] = {k: v.format(i=i, run=options.run_id) if isinstance(v, str) else v
+                              for k, v in body.items()}
+        response = client.open(path.format(i=i, run=options.run_id, thread=THREAD_ID),
+                               method=method, headers=headers, **kwargs)
+        response.close()
+        return f"HTTP {response.status_code}" if response.status_code >= 400 else None
+
+    return run
+
+
+def goodreads_import(client, i, options):
+    from flask import current_app
+
+    from application.gr_importer import gr_import_parser
+    from application.gr_threaded import background_upload_task
+    from configfile import google_books_key
+
+    # What /api/goodreadsimport does, with the background thread run inline so
+    # the whole import is timed
+    content = goodreads_csv(options.import_rows, cached=options.import_rows // 4)
+    with client.application.test_request_context():
+        _, books = gr_import_parser(content, USER_ID, fake_jwt(USER_ID))
+        background_upload_task(current_app._get_current_object(), books, USER_ID,
+                               google_books_key)
+
+
+def cover(client, i, options):
+    from application.covers import cover_key
+
+    # Cycles through the seeded library's covers: the first pass fetches and
+    # renders each one, later passes are served from the disk cache
+    url = f"{options.covers_url}/covers/97800000{i % options.library_size:05d}.jpg"
+    response = client.get(f"/covers/{cover_key(url, client.application.secret_key)}?size=m",
+                          headers={"Accept": "image/webp,*/*"})
+    response.close()
+    return f"HTTP {response.status_code}" if response.status_code >= 400 else None
+
+
+def render_scenario(changed: bool):
+    """
+    Renders profile.html from the seeded library, without the request around
+    it. With `changed`, one row differs per iteration, as after a write.
+    """
+
+    def run(client, i, options):
+        from application.database import get_library
+        from services.flask.routes import render_profile
+
+        rows = options.__dict__.setdefault("library_rows", get_library(USER_ID))
+        if changed:
+            rows = [dict(rows[0], pages_read=i), *rows[1:]]
+        with client.application.test_request_context("/profile"):
+            from flask import session
+
+            session["user_id"] = USER_ID
+            response = render_profile({"display_name": DISPLAY_NAME}, rows, [])
+            response.get_data()
+            response.close()
+
+    return run
+
+
+def open_chat(client, i, options):
+    # "Message this person" for someone the user already has a chat with
+    response = client.post("/create_thread", data={"user_ids": FRIEND_ID, "user_names": "reader2"})
+    response.close()
+    if response.status_code != 302 or THREAD_ID not in response.headers["Location"]:
+        return f"HTTP {response.status_code} {response.headers.get('Location')}"
+
+
+def template_compile(client, i, options):
+    # What a new worker does on its first request for the page
+    env = client.application.jinja_env
+    env.cache.clear()
+    env.get_template("profile.html")
+
+
+SCENARIOS = {
+    "profile": http_scenario("GET", "/profile"),
+    "htmx_search": http_scenario("GET", "/htmx/search?search=dune"),
+    "htmx_search_miss": http_scenario("GET", "/htmx/search?search=novel-{run}-{i}"),
+    "testgen": http_scenario("POST", "/testgen", {
+        "title": "Bench Book {run} {i}", "author": "Bench Author",
+        "cover": "", "botuser_id": BOT_ID,
+    }),
+    "chat_room": http_scenario("GET", "/chat/{thread}"),
+    "goodreads_import": goodreads_import,
+    "cover": cover,
+    "render_profile": render_scenario(changed=False),
+    "render_changed": render_scenario(changed=True),
+    "template_compile": template_compile,
+    "open_chat": open_chat,
+    "new_chat": http_scenario("GET", "/new_chat"),
+    "directory_search": http_scenario("GET", "/directory?q=member {i}"),
+    "friends_feed": http_scenario("GET", "/friends"),
+    "top_fives": http_scenario(
+        "GET", "/api/topfive?users=" + ",".join(f"Member {n}" for n in range(20))
+    ),
+    "send_message": http_scenario("POST", "/send_message", {
+        "thread_id": THREAD_ID, "message": "Bench message {run} {i}",
+    }),
+    "send_message_async": http_scenario("POST", "/send_message", {
+        "thread_id": THREAD_ID, "message": "Bench message {run} {i}",
+    }, headers={"Prefer": "respond-async"}),
+}
+DEFAULT_SCENARIOS = ("profile", "htmx_search", "htmx_search_miss", "testgen", "chat_room",
+                     "goodreads_import", "cover")
+
+
+def upstream_calls() -> dict:
+    """Outbound calls so far per upstream, from the app's metrics."""
+    from application.metrics import UPSTREAM_REQUESTS
+
+    totals = {}
+    for labels, value in UPSTREAM_REQUESTS.samples():
+        totals[labels["upstream"]] = totals.get(labels["upstream"], 0) + value
+    return totals
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_scenario(app, name, options):
+    fn = SCENARIOS[name]
+    iterations = options.import_iterations if name == "goodreads_import" else options.iterations
+    concurrency = 1 if name == "goodreads_import" else options.concurrency
+    local = threading.local()
+    timings, failures = [], []
+
+    def one(i):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = signed_in_client(app)
+        started = time.perf_counter()
+        try:
+            error = fn(client, i, options)
+        except Exception as e:
+            error = repr(e)
+        timings.append(time.perf_counter() - started)
+        if error:
+            failures.append(error)
+
+    for i in range(options.warmup):
+        one(-1 - i)
+    timings.clear()
+    failures.clear()
+
+    before = upstream_calls()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(iterations)))
+    elapsed = time.perf_counter() - started
+    after = upstream_calls()
+
+    ordered = sorted(timings)
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 2)  # noqa: E731
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "failures": len(failures),
+        "failure_samples": sorted(set(failures))[:3],
+        "mean_ms": ms(statistics.fmean(ordered)) if ordered else None,
+        "p50_ms": ms(percentile(ordered, 0.50)),
+        "p95_ms": ms(percentile(ordered, 0.95)),
+        "p99_ms": ms(percentile(ordered, 0.99)),
+        "max_ms": ms(ordered[-1]) if ordered else None,
+        "throughput_per_s": round(iterations / elapsed, 2) if elapsed else None,
+        "upstream_calls_per_iteration": {
+            upstream: round((after.get(upstream, 0) - before.get(upstream, 0)) / iterations, 2)
+            for upstream in sorted(after)
+            if after.get(upstream, 0) != before.get(upstream, 0)
+        },
+    }
+
+
+## 📊 Results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+            text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, current: dict):
+    """Prints p50/p95/throughput changes per scenario against a previous run."""
+    print(f"\n{'scenario':<18} {'p50 ms':>22} {'p95 ms':>22} {'per s':>20}", file=sys.stderr)
+    for name, now in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        cells = []
+        for key in ("p50_ms", "p95_ms", "throughput_per_s"):
+            old, new = before.get(key), now.get(key)
+            change = f"{(new - old) / old:+.0%}" if old and new is not None else "n/a"
+            cells.append(f"{old} -> {new} ({change})")
+        print(f"{name:<18} {cells[0]:>22} {cells[1]:>22} {cells[2]:>20}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default=",".join(DEFAULT_SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--import-iterations", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--latency", default="0.02",
+                        help="seconds per upstream call, e.g. 0.02 or 0.02,gemini=0.4")
+    parser.add_argument("--error-rate", default="0")
+    parser.add_argument("--import-rows", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--library-size", type=int, default=100)
+    parser.add_argument("--users", type=int, default=1000,
+                        help="other profiles in the user directory")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cache", default="memory",
+                        help='"memory" (in-process Redis stand-in), "off", or a redis:// URL')
+    parser.add_argument("--output", help="write the JSON results here as well as to stdout")
+    parser.add_argument("--compare", help="a previous results file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own output")
+    options = parser.parse_args()
+    options.run_id = str(int(time.time()))
+
+    names = [name.strip() for name in options.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"unknown scenario(s) {unknown}; expected some of {sorted(SCENARIOS)}")
+
+    latency = per_upstream(options.latency)
+    error_rate = per_upstream(options.error_rate)
+    standins = start_standins(latency, error_rate, options.seed)
+
+    # The import writes data.json and the slow-request log goes to the cwd
+    workdir = tempfile.mkdtemp(prefix="cadence-bench-")
+    os.chdir(workdir)
+    configure_env(standins, options.cache)
+    options.covers_url = standins["google_books"].url
+    # The app resolves cadenceoverlay.png and friends relative to the cwd
+    for asset in ("cadenceoverlay.png",):
+        if os.path.exists(os.path.join(ROOT, asset)):
+            os.symlink(os.path.join(ROOT, asset), os.path.join(workdir, asset))
+
+    quiet = io.StringIO()
+    with contextlib.ExitStack() as stack:
+        if not options.verbose:
+            stack.enter_context(contextlib.redirect_stdout(quiet))
+        from main import app
+
+        seed(standins["supabase"], options.messages, options.library_size,
+             standins["google_books"].url, options.users)
+        register_functions(standins["supabase"])
+        app.testing = False
+        scenarios = {}
+        for name in names:
+            scenarios[name] = run_scenario(app, name, options)
+            print(f"{name}: p50 {scenarios[name]['p50_ms']}ms", file=sys.stderr)
+
+        from application.log import flush
+
+        flush()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "latency_s": latency,
+            "error_rate": error_rate,
+            "iterations": options.iterations,
+            "concurrency": options.concurrency,
+            "import_rows": options.import_rows,
+            "messages": options.messages,
+            "library_size": options.library_size,
+            "users": options.users,
+            "cache": options.cache if options.cache in ("memory", "off") else "redis",
+        },
+        "scenarios": scenarios,
+        "standin_requests": {name: standin.requests for name, standin in standins.items()},
+    }
+    for standin in standins.values():
+        standin.stop()
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if options.output:
+        with open(os.path.join(ROOT, options.output) if not os.path.isabs(options.output)
+                  else options.output, "w") as f:
+            f.write(text + "\n")
+    if options.compare:
+        with open(options.compare if os.path.isabs(options.compare)
+                  else os.path.join(ROOT, options.compare)) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
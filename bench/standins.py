@@ -0,0 +1,772 @@
+"""
+Local stand-ins for the app's upstreams, for benchmarks.
+
+Each stand-in is a small threaded HTTP server on 127.0.0.1 with injectable
+`latency` (seconds, plus optional random `jitter`) and `error_rate` (the
+fraction of requests answered with a 503), so a run measures the app rather
+than the network and failure handling can be exercised deterministically
+(`seed`).
+
+- PostgREST: a PostgREST/Supabase-compatible fake backed by SQLite. Covers
+  what the app uses: select with embedded resources, eq/neq/gt/lt/in/ilike/
+  is/or filters, order, limit, single-object responses, insert/upsert/
+  update/delete, RPC functions registered from Python, the auth user
+  endpoint and storage uploads.
+- GoogleBooks, OpenLibrary, Spotify: deterministic canned responses.
+- Gemini: streams JSON generated from the request's responseSchema as
+  server-sent events, `chunks` events `chunk_delay` seconds apart.
+"""
+import base64
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Reply:
+    __slots__ = ("status", "body", "headers", "chunks")
+
+    def __init__(self, status=200, body=None, headers=None, chunks=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.chunks = chunks
+
+
+def json_reply(data, status=200, headers=None):
+    body = json.dumps(data).encode()
+    return Reply(status, body, {"Content-Type": "application/json", **(headers or {})})
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Without this small responses wait on delayed ACKs (~40ms each)
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        request = Request(
+            self.command,
+            urllib.parse.unquote(parsed.path),
+            urllib.parse.parse_qsl(parsed.query, keep_blank_values=True),
+            self.headers,
+            body,
+        )
+        reply = self.server.standin.handle(request)
+        self.send_response(reply.status)
+        for name, value in reply.headers.items():
+            self.send_header(name, value)
+        if reply.chunks is not None:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk, delay in reply.chunks:
+                if delay:
+                    time.sleep(delay)
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        body = reply.body or b""
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class StandIn:
+    """Base class: serves `route(request)` with injected latency and errors."""
+
+    name = "standin"
+
+    def __init__(self, latency=0.0, error_rate=0.0, jitter=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def handle(self, request: Request) -> Reply:
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            fail = self.error_rate and self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return json_reply({"message": f"{self.name} stand-in: injected error"}, 503)
+        try:
+            return self.route(request)
+        except Exception as e:
+            return json_reply({"message": f"{self.name} stand-in: {e!r}"}, 500)
+
+    def route(self, request: Request) -> Reply:
+        raise NotImplementedError
+
+
+def _digits(text: str, n: int) -> str:
+    return str(int(hashlib.sha1(text.encode()).hexdigest(), 16))[:n]
+
+
+def fake_jwt(user_id: str, ttl: int = 3600) -> str:
+    """An unsigned JWT with `user_id` as subject; the stand-ins don't verify it."""
+
+    def part(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    claims = {"sub": user_id, "exp": int(time.time()) + ttl, "role": "authenticated"}
+    return f"{part({'alg': 'HS256', 'typ': 'JWT'})}.{part(claims)}.c2ln"
+
+
+def _jwt_subject(token: str):
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get("sub")
+    except (IndexError, ValueError):
+        return None
+
+
+## 🗄️ PostgREST
+
+
+def _split_top(text: str, sep: str = ","):
+    """Splits on `sep` outside parentheses and double quotes."""
+    parts, depth, quoted, current = [], 0, False, []
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == sep and depth == 0 and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    parts.append("".join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _parse_select(text: str):
+    """Parses a select string into [(alias, column)] and [(alias, relation, hint, inner, items)]."""
+    columns, embeds = [], []
+    for item in _split_top(re.sub(r"\s+", " ", text or "*")):
+        alias = None
+        head = item.split("(", 1)[0]
+        if ":" in head and "::" not in head:
+            alias, item = item.split(":", 1)
+            alias = alias.strip()
+            item = item.strip()
+        if "(" in item:
+            name, inner_select = item.split("(", 1)
+            inner_select = inner_select.rsplit(")", 1)[0]
+            name, _, hint = name.strip().partition("!")
+            inner = hint == "inner"
+            if inner:
+                hint = ""
+            embeds.append((alias or name, name, hint or None, inner, _parse_select(inner_select)))
+        else:
+            columns.append((alias or item, item))
+    return columns, embeds
+
+
+def _cast(value):
+    return str(value).lower() if isinstance(value, bool) else str(value)
+
+
+def _like(pattern: str, value) -> re.Pattern:
+    pattern = pattern.replace("*", "%")
+    regex = "".join(".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in pattern)
+    return re.compile(f"^{regex}$", re.DOTALL)
+
+
+def _in_values(text: str):
+    return [v.strip().strip('"') for v in _split_top(text.strip()[1:-1])]
+
+
+def _compare(op: str, value, operand: str) -> bool:
+    if op == "is":
+        return {"null": value is None, "true": value is True, "false": value is False}.get(
+            operand.lower(), False
+        )
+    if value is None:
+        return False
+    if op == "eq":
+        return _cast(value) == operand
+    if op == "neq":
+        return _cast(value) != operand
+    if op == "in":
+        return _cast(value) in _in_values(operand)
+    if op == "like":
+        return bool(_like(operand, value).match(str(value)))
+    if op == "ilike":
+        return bool(_like(operand.lower(), value).match(str(value).lower()))
+    if op in ("gt", "gte", "lt", "lte"):
+        try:
+            left, right = float(value), float(operand)
+        except (TypeError, ValueError):
+            left, right = str(value), operand
+        return {"gt": left > right, "gte": left >= right, "lt": left < right,
+                "lte": left <= right}[op]
+    raise ValueError(f"unsupported operator {op}")
+
+
+def _condition(column: str, expression: str):
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    op, _, operand = expression.partition(".")
+    return lambda row: _compare(op, row.get(column), operand) != negate
+
+
+def _group(text: str, combine):
+    """or=(a.eq.1,b.ilike.*x*) and and=(...), including nested and(...)/or(...)."""
+    conditions = []
+    for part in _split_top(text.strip()[1:-1]):
+        if part.startswith("and("):
+            conditions.append(_group(part[3:], all))
+        elif part.startswith("or("):
+            conditions.append(_group(part[2:], any))
+        else:
+            column, _, expression = part.partition(".")
+            conditions.append(_condition(column, expression))
+    return lambda row: combine(check(row) for check in conditions)
+
+
+def _singular(table: str) -> str:
+    return table[:-1] if table.endswith("s") else table
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class PostgREST(StandIn):
+    """
+    PostgREST and the bits of Supabase around it, backed by SQLite.
+
+    Rows are stored as JSON documents per table and filtered in Python, so
+    any table accepts any columns. Every row gets an `id` (an integer unless
+    one is supplied) and a `created_at`. Embedded resources are resolved by
+    naming convention: `profiles!sender_id(...)` and `thread:thread_id(...)`
+    follow the named column, `threads(...)` follows `thread_id`, and when the
+    parent has no such column the embed is a one-to-many on `<parent>_id`.
+    """
+
+    name = "postgrest"
+
+    def __init__(self, path=":memory:", primary_keys=None, **kwargs):
+        super().__init__(**kwargs)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            " tbl TEXT NOT NULL, id TEXT NOT NULL, seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " data TEXT NOT NULL, UNIQUE (tbl, id))"
+        )
+        self.db_lock = threading.Lock()
+        # Conflict target for upserts without on_conflict, per table
+        self.primary_keys = {"spotify_tokens": "user_id", "topfive": "user_id",
+                             "tokens": "user_id", **(primary_keys or {})}
+        self.functions = {}
+        self.storage = {}
+        self.users = {}
+
+    # --- Data access (also used to seed and inspect) ---
+
+    def rows(self, table: str):
+        with self.db_lock:
+            cursor = self.db.execute(
+                "SELECT data FROM rows WHERE tbl = ? ORDER BY seq", (table,)
+            )
+            return [json.loads(data) for (data,) in cursor]
+
+    def insert(self, table: str, rows, on_conflict=None, merge=True):
+        """
+        Inserts rows, or updates them on an `on_conflict` match (skips them
+        when not `merge`, as ignore-duplicates does). Returns the stored rows.
+        """
+        if isinstance(rows, dict):
+            rows = [rows]
+        key = on_conflict or self.primary_keys.get(table, "id")
+        keys = key.split(",")
+        stored = []
+        with self.db_lock:
+            existing = None
+            if key != "id":
+                existing = {
+                    tuple(_cast(doc.get(k)) for k in keys): (row_id, doc)
+                    for row_id, doc in (
+                        (row_id, json.loads(data))
+                        for row_id, data in self.db.execute(
+                            "SELECT id, data FROM rows WHERE tbl = ?", (table,)
+                        )
+                    )
+                }
+            for row in rows:
+                row = dict(row)
+                match = None
+                if key == "id" and row.get("id") is not None:
+                    found = self.db.execute(
+                        "SELECT id, data FROM rows WHERE tbl = ? AND id = ?",
+                        (table, _cast(row["id"])),
+                    ).fetchone()
+                    match = (found[0], json.loads(found[1])) if found else None
+                elif existing is not None and all(row.get(k) is not None for k in keys):
+                    match = existing.get(tuple(_cast(row.get(k)) for k in keys))
+                if match is not None:
+                    if not merge:
+                        continue
+                    row_id, doc = match
+                    doc = {**doc, **row}
+                    self.db.execute(
+                        "UPDATE rows SET data = ? WHERE tbl = ? AND id = ?",
+                        (json.dumps(doc), table, row_id),
+                    )
+                else:
+                    row.setdefault("created_at", _now())
+                    if row.get("id") is None:
+                        seq = self.db.execute(
+                            "SELECT COALESCE(MAX(seq), 0) + 1 FROM rows"
+                        ).fetchone()[0]
+                        row["id"] = seq
+                    doc = row
+                    self.db.execute(
+                        "INSERT INTO rows (tbl, id, data) VALUES (?, ?, ?)",
+                        (table, _cast(doc["id"]), json.dumps(doc)),
+                    )
+                    if existing is not None:
+                        existing[tuple(_cast(doc.get(k)) for k in keys)] = (_cast(doc["id"]), doc)
+                stored.append(doc)
+            self.db.commit()
+        return stored
+
+    def _write(self, table: str, docs):
+        with self.db_lock:
+            for doc in docs:
+                self.db.execute(
+                    "UPDATE rows SET data = ? WHERE tbl = ? AND id = ?",
+                    (json.dumps(doc), table, _cast(doc["id"])),
+                )
+            self.db.commit()
+
+    def _delete(self, table: str, docs):
+        with self.db_lock:
+            for doc in docs:
+                self.db.execute(
+                    "DELETE FROM rows WHERE tbl = ? AND id = ?", (table, _cast(doc["id"]))
+                )
+            self.db.commit()
+
+    def function(self, name: str):
+        """Registers `fn(postgrest, **args)` as the RPC endpoint `name`."""
+
+        def decorator(fn):
+            self.functions[name] = fn
+            return fn
+
+        return decorator
+
+    # --- HTTP ---
+
+    def route(self, request: Request) -> Reply:
+        path = request.path
+        if path.startswith("/rest/v1/rpc/"):
+            return self._rpc(request, path[len("/rest/v1/rpc/"):])
+        if path.startswith("/rest/v1/"):
+            return self._table(request, path[len("/rest/v1/"):])
+        if path.startswith("/auth/v1/user"):
+            token = (request.headers.get("Authorization") or "").removeprefix("Bearer ")
+            user_id = _jwt_subject(token)
+            if not user_id:
+                return json_reply({"msg": "invalid JWT"}, 401)
+            return json_reply(self.users.get(user_id) or {
+                "id": user_id, "aud": "authenticated", "role": "authenticated",
+                "email": f"{user_id}@example.com", "app_metadata": {}, "user_metadata": {},
+                "created_at": "2026-01-01T00:00:00Z",
+            })
+        if path.startswith("/storage/v1/object/"):
+            return self._storage(request, path[len("/storage/v1/object/"):])
+        return json_reply({"message": f"no route for {path}"}, 404)
+
+    def _storage(self, request: Request, key: str):
+        key = key.removeprefix("public/")
+        if request.method in ("POST", "PUT"):
+            self.storage[key] = request.body
+            return json_reply({"Key": key, "Id": str(uuid.uuid4())})
+        if key in self.storage:
+            return Reply(200, self.storage[key], {"Content-Type": "image/jpeg"})
+        return json_reply({"message": "Object not found"}, 404)
+
+    def _rpc(self, request: Request, name: str):
+        fn = self.functions.get(name)
+        if fn is None:
+            return json_reply(
+                {"code": "PGRST202", "message": f"Could not find the function {name}"}, 404
+            )
+        args = request.json() if request.method == "POST" else dict(request.query)
+        return json_reply(fn(self, **(args or {})))
+
+    def _filter(self, query, rows):
+        for key, value in query:
+            if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            if key == "or":
+                check = _group(value, any)
+            elif key == "and":
+                check = _group(value, all)
+            elif "." in key:
+                # Filters on embedded resources are not supported; they are
+                # ignored rather than guessed at
+                continue
+            else:
+                check = _condition(key, value)
+            rows = [row for row in rows if check(row)]
+        return rows
+
+    def _embed(self, table: str, rows, embeds):
+        for alias, name, hint, inner, (columns, nested) in embeds:
+            if hint:
+                fk, target = hint, name
+            elif name.endswith("_id"):
+                fk, target = name, name[:-3] + "s"
+            else:
+                fk, target = _singular(name) + "_id", name
+            related = self.rows(target)
+            if rows and fk in rows[0]:
+                by_id = {_cast(row.get("id")): row for row in related}
+                for row in rows:
+                    match = by_id.get(_cast(row.get(fk)))
+                    row[alias] = (
+                        self._project(target, [match], columns, nested)[0] if match else None
+                    )
+            else:
+                back = _singular(table) + "_id"
+                for row in rows:
+                    children = [r for r in related if _cast(r.get(back)) == _cast(row.get("id"))]
+                    row[alias] = self._project(target, children, columns, nested)
+            if inner:
+                rows = [row for row in rows if row.get(alias)]
+        return rows
+
+    def _project(self, table: str, rows, columns, embeds):
+        rows = [dict(row) for row in rows]
+        if embeds:
+            rows = self._embed(table, rows, embeds)
+        if columns == [("*", "*")] or not columns:
+            return rows
+        keep_all = any(column == "*" for _, column in columns)
+        embedded = [alias for alias, *_ in embeds]
+        result = []
+        for row in rows:
+            out = dict(row) if keep_all else {}
+            for alias, column in columns:
+                if column != "*":
+                    out[alias] = row.get(column)
+            for alias in embedded:
+                out[alias] = row.get(alias)
+            result.append(out)
+        return result
+
+    def _select(self, table: str, query, rows=None):
+        params = dict(query)
+        rows = self._filter(query, self.rows(table) if rows is None else rows)
+        columns, embeds = _parse_select(params.get("select", "*"))
+        rows = self._project(table, rows, columns, embeds)
+        for term in reversed((params.get("order") or "").split(",")):
+            if not term:
+                continue
+            column, *modifiers = term.split(".")
+            desc = "desc" in modifiers
+            rows.sort(
+                key=lambda row: (row.get(column) is None, _sortable(row.get(column))),
+                reverse=desc,
+            )
+        offset = int(params.get("offset") or 0)
+        if params.get("limit"):
+            rows = rows[offset: offset + int(params["limit"])]
+        elif offset:
+            rows = rows[offset:]
+        return rows
+
+    def _table(self, request: Request, table: str):
+        prefer = request.headers.get("Prefer") or ""
+        single = "vnd.pgrst.object" in (request.headers.get("Accept") or "")
+        params = dict(request.query)
+
+        if request.method in ("GET", "HEAD"):
+            rows = self._select(table, request.query)
+        elif request.method == "POST":
+            body = request.json()
+            upsert = "resolution=" in prefer
+            rows = self.insert(
+                table,
+                body,
+                on_conflict=params.get("on_conflict") if upsert else "id",
+                merge="ignore-duplicates" not in prefer,
+            )
+        elif request.method == "PATCH":
+            changes = request.json() or {}
+            rows = [{**row, **changes} for row in self._filter(request.query, self.rows(table))]
+            self._write(table, rows)
+        elif request.method == "DELETE":
+            rows = self._filter(request.query, self.rows(table))
+            self._delete(table, rows)
+        else:
+            return json_reply({"message": "method not allowed"}, 405)
+
+        if request.method != "GET" and "select" in params:
+            rows = self._select(table, [("select", params["select"])], rows)
+        headers = {}
+        if "count=" in prefer:
+            headers["Content-Range"] = f"0-{max(len(rows) - 1, 0)}/{len(rows)}"
+        if request.method != "GET" and "return=representation" not in prefer:
+            return Reply(201 if request.method == "POST" else 204, b"", headers)
+        if single:
+            if len(rows) != 1:
+                return json_reply(
+                    {"code": "PGRST116", "details": f"The result contains {len(rows)} rows",
+                     "hint": None, "message": "JSON object requested, multiple (or no) rows returned"},
+                    406,
+                )
+            return json_reply(rows[0], headers=headers)
+        return json_reply(rows, 201 if request.method == "POST" else 200, headers)
+
+
+def _sortable(value):
+    if isinstance(value, (int, float)):
+        return (0, value, "")
+    return (1, 0, str(value))
+
+
+## 📚 Google Books and OpenLibrary
+
+
+class GoogleBooks(StandIn):
+    """Deterministic volumes for any query; also serves cover images under /covers/."""
+
+    name = "google_books"
+
+    def __init__(self, results=10, cover_size=(600, 900), **kwargs):
+        super().__init__(**kwargs)
+        self.results = results
+        self.cover_size = cover_size
+        self._cover = None
+
+    def volume(self, query: str, index: int) -> dict:
+        isbn = "978" + _digits(f"{query}:{index}", 10).rjust(10, "0")
+        title = query.split("+inauthor:")[0].removeprefix("intitle:").strip() or "Untitled"
+        return {
+            "kind": "books#volume",
+            "id": _digits(isbn, 12),
+            "volumeInfo": {
+                "title": title if index == 0 else f"{title} ({index + 1})",
+                "authors": [f"Author {_digits(title, 3)}"],
+                "pageCount": 100 + int(_digits(isbn, 3)),
+                "description": f"A stand-in description for {title}. " * 8,
+                "imageLinks": {"thumbnail": f"{self.url}/covers/{isbn}.jpg"},
+                "industryIdentifiers": [
+                    {"type": "ISBN_13", "identifier": isbn},
+                    {"type": "ISBN_10", "identifier": isbn[3:]},
+                ],
+            },
+        }
+
+    def cover(self) -> bytes:
+        if self._cover is None:
+            from io import BytesIO
+
+            from PIL import Image
+
+            buffer = BytesIO()
+            Image.new("RGB", self.cover_size, (70, 90, 140)).save(buffer, format="JPEG")
+            self._cover = buffer.getvalue()
+        return self._cover
+
+    def route(self, request: Request) -> Reply:
+        if request.path.startswith("/covers/"):
+            return Reply(200, self.cover(), {"Content-Type": "image/jpeg"})
+        if request.path.rstrip("/").endswith("/volumes"):
+            query = dict(request.query).get("q", "")
+            items = [self.volume(query, i) for i in range(self.results)]
+            return json_reply({"kind": "books#volumes", "totalItems": len(items), "items": items})
+        return json_reply({"error": {"code": 404, "message": "Not Found"}}, 404)
+
+
+class OpenLibrary(StandIn):
+    name = "openlibrary"
+
+    def __init__(self, editions=20, **kwargs):
+        super().__init__(**kwargs)
+        self.editions = editions
+
+    def route(self, request: Request) -> Reply:
+        path = request.path
+        if path.endswith("/editions.json"):
+            key = path.removesuffix("/editions.json")
+            return json_reply({
+                "size": self.editions,
+                "entries": [
+                    {"key": f"/books/OL{i}M", "number_of_pages": 200 + int(_digits(key, 2)) + i % 3}
+                    for i in range(self.editions)
+                ],
+            })
+        if path.startswith("/authors/"):
+            key = path.removesuffix(".json")
+            return json_reply({"key": key, "name": f"Author {_digits(key, 3)}"})
+        if path.startswith("/works/"):
+            key = path.removesuffix(".json")
+            return json_reply({
+                "key": key,
+                "title": f"Work {_digits(key, 4)}",
+                "authors": [{"author": {"key": f"/authors/OL{_digits(key, 4)}A"}}],
+            })
+        return json_reply({"error": "notfound", "key": path}, 404)
+
+
+## ✨ Gemini
+
+
+class Gemini(StandIn):
+    """
+    streamGenerateContent with alt=sse. The response is JSON built from the
+    request's responseSchema (or a list of songs without one), split across
+    `chunks` events.
+    """
+
+    name = "gemini"
+
+    def __init__(self, array_length=20, chunks=8, chunk_delay=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.array_length = array_length
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+
+    def generate(self, schema, key="item", index=0):
+        kind = (schema or {}).get("type", "STRING").upper()
+        if kind == "ARRAY":
+            return [self.generate(schema.get("items"), key, i) for i in range(self.array_length)]
+        if kind == "OBJECT":
+            return {
+                name: self.generate(prop, name, index)
+                for name, prop in (schema.get("properties") or {}).items()
+            }
+        if kind in ("INTEGER", "NUMBER"):
+            return index
+        if kind == "BOOLEAN":
+            return index % 2 == 0
+        if key.endswith("_id"):
+            return _digits(f"{key}{index}", 12)
+        return f"{key.replace('_', ' ').title()} {index + 1}"
+
+    def route(self, request: Request) -> Reply:
+        if ":streamGenerateContent" not in request.path and ":generateContent" not in request.path:
+            return json_reply({"error": {"code": 404, "message": "Not Found"}}, 404)
+        config = (request.json() or {}).get("generationConfig") or {}
+        schema = config.get("responseSchema") or {
+            "type": "ARRAY",
+            "items": {"type": "OBJECT", "properties": {
+                "song_title": {"type": "STRING"}, "artist": {"type": "STRING"},
+                "spotify_id": {"type": "STRING"}}},
+        }
+        text = json.dumps(self.generate(schema))
+        if ":generateContent" in request.path:
+            return json_reply({"candidates": [{"content": {"parts": [{"text": text}]}}]})
+        size = -(-len(text) // self.chunks)
+        events = []
+        for start in range(0, len(text), size):
+            event = {"candidates": [{"content": {"parts": [{"text": text[start:start + size]}],
+                                                 "role": "model"}}]}
+            events.append((f"data: {json.dumps(event)}\r\n\r\n".encode(), self.chunk_delay))
+        return Reply(200, headers={"Content-Type": "text/event-stream"}, chunks=events)
+
+
+## 🎵 Spotify
+
+
+class Spotify(StandIn):
+    name = "spotify"
+
+    def __init__(self, user_id="standin-bot", **kwargs):
+        super().__init__(**kwargs)
+        self.user_id = user_id
+        self.playlists = {}
+
+    def route(self, request: Request) -> Reply:
+        path = request.path.removeprefix("/v1").rstrip("/")
+        if path == "/me":
+            return json_reply({
+                "id": self.user_id,
+                "display_name": "Stand-in Bot",
+                "images": [{"url": "https://example.com/avatar.jpg", "height": 300, "width": 300}],
+            })
+        if path == "/search":
+            query = dict(request.query).get("q", "")
+            return json_reply({"tracks": {"items": [
+                {"id": _digits(query, 22), "name": query, "uri": f"spotify:track:{_digits(query, 22)}"}
+            ], "total": 1}})
+        if path.endswith("/playlists") and request.method == "POST":
+            playlist_id = uuid.uuid4().hex[:22]
+            self.playlists[playlist_id] = []
+            return json_reply({"id": playlist_id, **(request.json() or {})}, 201)
+        match = re.match(r"^/playlists/([^/]+)/(tracks|items|images)$", path)
+        if match:
+            playlist_id, part = match.groups()
+            if part == "images":
+                return Reply(202)
+            if request.method == "POST":
+                body = request.json() or []
+                # spotipy posts a bare list of URIs; the API also takes {"uris": [...]}
+                uris = body.get("uris") or [] if isinstance(body, dict) else body
+                self.playlists.setdefault(playlist_id, []).extend(uris)
+            return json_reply({"snapshot_id": uuid.uuid4().hex}, 201)
+        return json_reply({"error": {"status": 404, "message": "Service not found"}}, 404)
@@ -1,7 +1,13 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+# Only pay for python-dotenv when there is a .env file to read (local dev);
+# on Render the variables are already in the environment.
+if os.path.exists(os.path.join(os.getcwd(), ".env")) or os.path.exists(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+):
+    from dotenv import load_dotenv
+
+    load_dotenv()
 
 # Access the keys using os.environ.get()
 gemini_key = os.environ.get("GEMINI_API_KEY")
@@ -12,3 +18,102 @@ supabase_key = os.environ.get("supabase_key")
 supabase_service = os.environ.get("supabase_service")
 bot_id = os.environ.get("bot_id")
 google_books_key = os.environ.get("GOOGLE_BOOKS")
+
+# Logging: level, "text" or "json" lines, and the longest field value written
+log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
+log_format = os.environ.get("LOG_FORMAT", "text").lower()
+log_max_field = int(os.environ.get("LOG_MAX_FIELD", 2000))
+log_queue_size = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+# Upstream base URLs (the benchmark harness points these at local stand-ins)
+google_books_url = os.environ.get("GOOGLE_BOOKS_URL", "https://www.googleapis.com/books/v1")
+openlibrary_url = os.environ.get("OPENLIBRARY_URL", "https://openlibrary.org")
+gemini_url = os.environ.get("GEMINI_URL", "https://generativelanguage.googleapis.com/v1beta")
+spotify_api_url = os.environ.get("SPOTIFY_API_URL", "https://api.spotify.com/v1")
+
+# Shared cache: Redis as L2 behind each worker's in-process LRU. Unset keeps
+# the cache in-process, where one worker's invalidations never reach the
+# others: set it whenever gunicorn runs more than one worker. "memory://" is
+# the stand-in used by the benchmark.
+redis_url = os.environ.get("REDIS_URL")
+redis_timeout = float(os.environ.get("REDIS_TIMEOUT", 0.25))
+redis_backoff = float(os.environ.get("REDIS_BACKOFF", 5))
+cache_lock_wait = float(os.environ.get("CACHE_LOCK_WAIT", 1))
+cache_enabled = os.environ.get("CACHE_ENABLED", "1") != "0"
+
+# Admission control: request slots per worker (for threads, and for async
+# routes on the ASGI event loop, which cost far less each), the share of
+# them each priority may fill, how long a request waits for a slot before a
+# 429, and the Retry-After sent when the worker or a route is busy
+admission_slots = int(os.environ.get("ADMISSION_SLOTS", 16))
+admission_async_slots = int(os.environ.get("ADMISSION_ASYNC_SLOTS", 512))
+admission_shares = os.environ.get("ADMISSION_SHARES", "interactive=1,normal=0.8,expensive=0.5")
+admission_queue_timeout = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 2))
+admission_retry_after = float(os.environ.get("ADMISSION_RETRY_AFTER", 5))
+# Per-route concurrency caps and per-user quotas ("<count>/<period>[,burst=<n>]")
+testgen_concurrency = int(os.environ.get("TESTGEN_CONCURRENCY", 4))
+testgen_quota = os.environ.get("TESTGEN_QUOTA", "30/hour,burst=5")
+import_concurrency = int(os.environ.get("IMPORT_CONCURRENCY", 2))
+import_quota = os.environ.get("IMPORT_QUOTA", "5/hour,burst=2")
+
+# Cover image proxy: where resized covers are kept, and the most disk they use
+cover_cache_dir = os.environ.get("COVER_CACHE_DIR", "cache/covers")
+cover_cache_max_mb = float(os.environ.get("COVER_CACHE_MAX_MB", 200))
+
+# Static assets: where fingerprinted, precompressed copies are built at startup
+asset_build_dir = os.environ.get("ASSET_BUILD_DIR", "cache/assets")
+assets_fingerprint = os.environ.get("ASSETS_FINGERPRINT", "1") != "0"
+
+# Live chat and inbox events: per-user replay buffer for reconnects, seconds
+# between keepalives, and how long one stream stays open before reconnecting
+events_replay = int(os.environ.get("EVENTS_REPLAY", 100))
+events_heartbeat = float(os.environ.get("EVENTS_HEARTBEAT", 15))
+events_max_age = float(os.environ.get("EVENTS_MAX_AGE", 300))
+# Whether this server can hold an /events stream open without blocking other
+# requests: gunicorn.conf.py sets 0 for all but async workers, and native
+# async routes under ASGI always can. EVENTS_MAX_STREAMS caps the streams a
+# worker holds outside those routes (gunicorn.conf.py sets a quarter of the
+# threads). Without live events (or without Redis to carry them between
+# workers), chat pages poll every EVENTS_POLL_INTERVAL seconds and the inbox
+# reloads every EVENTS_INBOX_REFRESH seconds.
+events_streaming = os.environ.get("EVENTS_STREAMING", "1") != "0"
+events_max_streams = int(os.environ.get("EVENTS_MAX_STREAMS", 100))
+events_poll_interval = float(os.environ.get("EVENTS_POLL_INTERVAL", 5))
+events_inbox_refresh = float(os.environ.get("EVENTS_INBOX_REFRESH", 30))
+
+# User directory for /directory: seconds between fetching changed profiles,
+# seconds between full rebuilds (which drop deleted users), and page size
+directory_refresh = float(os.environ.get("DIRECTORY_REFRESH", 30))
+directory_rebuild = float(os.environ.get("DIRECTORY_REBUILD", 3600))
+directory_page_size = int(os.environ.get("DIRECTORY_PAGE_SIZE", 20))
+
+# Friends activity feed: activities kept per follower's timeline, and the
+# follower count above which an account's activity is read, not fanned out
+feed_length = int(os.environ.get("FEED_LENGTH", 200))
+feed_fanout_limit = int(os.environ.get("FEED_FANOUT_LIMIT", 5000))
+
+# Compiled Jinja templates, shared by workers and restarts ("" to disable)
+template_cache_dir = os.environ.get("TEMPLATE_CACHE_DIR", "cache/templates")
+
+# Request budget and per-upstream timeouts, in seconds
+request_budget = float(os.environ.get("REQUEST_BUDGET", 25))
+supabase_timeout = float(os.environ.get("SUPABASE_TIMEOUT", 8))
+google_books_timeout = float(os.environ.get("GOOGLE_BOOKS_TIMEOUT", 5))
+openlibrary_timeout = float(os.environ.get("OPENLIBRARY_TIMEOUT", 5))
+gemini_timeout = float(os.environ.get("GEMINI_TIMEOUT", 20))
+spotify_timeout = float(os.environ.get("SPOTIFY_TIMEOUT", 5))
+default_timeout = float(os.environ.get("DEFAULT_TIMEOUT", 10))
+
+# Traces slower than these (milliseconds) go to the slow-request log
+slow_request_ms = float(os.environ.get("SLOW_REQUEST_MS", 1000))
+slow_job_ms = float(os.environ.get("SLOW_JOB_MS", 30000))
+slow_request_log = os.environ.get("SLOW_REQUEST_LOG", "logs/slow_requests.log")
+
+# Per-request upstream round-trip checks (off, warn or strict); dev and CI only
+roundtrip_check = os.environ.get("ROUNDTRIP_CHECK", "off").lower()
+
+# On-demand request profiling; disabled unless PROFILE_TOKEN is set (16+ characters)
+profile_token = os.environ.get("PROFILE_TOKEN")
+profile_dir = os.environ.get("PROFILE_DIR", "logs/profiles")
+profile_keep = int(os.environ.get("PROFILE_KEEP", 50))
+profile_sample_interval = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.005))
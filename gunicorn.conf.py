@@ -0,0 +1,26 @@
+import os
+
+# Preload mode: set PRELOAD_APP=1 to import the app and every heavy
+# integration once in the master, so forked workers share those modules
+# instead of each paying the import cost on their first requests.
+preload_app = os.environ.get("PRELOAD_APP", "0") == "1"
+
+# Worker class, and threads per worker (more than one means gthread). An
+# /events stream holds its request for minutes. Only async workers run other
+# requests meanwhile, so only they stream live chat events by default; a
+# sync or gthread worker would give up a thread per open tab, so pages poll.
+# With EVENTS_STREAMING=1 on gthread, a worker holds at most a quarter of
+# its threads in streams and pages poll past that.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+threads = int(os.environ.get("GUNICORN_THREADS", 1))
+async_worker = worker_class.split(".")[0] in ("gevent", "eventlet", "uvicorn")
+os.environ.setdefault("EVENTS_STREAMING", "1" if async_worker else "0")
+if not async_worker:
+    os.environ.setdefault("EVENTS_MAX_STREAMS", str(max(1, threads // 4)))
+
+
+def on_starting(server):
+    if server.cfg.preload_app:
+        from application.integrations import preload
+
+        preload()
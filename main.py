@@ -1,6 +1,19 @@
 from services.flask.routes import app
 from services.flask.htmxroutes import htmx_bp
 from services.flask.apiroutes import api_bp
+from application.deadlines import init_app as init_deadlines
+from application.metrics import init_app as init_metrics
+from application.tracing import init_app as init_tracing
+from application.roundtrips import init_app as init_round_trips
+from application.profiling import init_app as init_profiling
+from application.admission import init_app as init_admission
+from application.covers import init_app as init_covers
+from application.assets import init_app as init_assets
+from application.fragments import init_app as init_fragments
+from application.events import init_app as init_events
+from application.outbox import init_app as init_outbox
+from application.feed import init_app as init_feed
+from application.directory import init_app as init_directory
 import configfile
 
 
@@ -21,6 +34,21 @@ initialize_library()
 """
 app.register_blueprint(htmx_bp, url_prefix="/htmx")
 app.register_blueprint(api_bp, url_prefix="/api")
+init_metrics(app)
+init_tracing(app)
+init_round_trips(app)
+init_profiling(app)
+# After metrics and tracing, so time spent queued shows in both, and before
+# the deadline, so it is not taken from the request's budget
+init_admission(app)
+init_deadlines(app)
+init_covers(app)
+init_assets(app)
+init_fragments(app)
+init_events(app)
+init_outbox(app)
+init_feed(app)
+init_directory(app)
 
 
 if __name__ == "__main__":
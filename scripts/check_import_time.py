@@ -0,0 +1,71 @@
+"""
+Fails when importing the Flask app gets slower or starts pulling in heavy
+integrations eagerly.
+
+    python scripts/check_import_time.py [--budget-ms 400]
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter (several
+times, keeping the fastest run) and exits non-zero if the cumulative import
+time of main exceeds the budget or if any module in LAZY_MODULES was imported.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# These must only ever be imported through application.integrations
+LAZY_MODULES = ("supabase", "spotipy", "PIL", "requests", "httpx", "dotenv")
+
+DEFAULT_BUDGET_MS = 400
+
+
+def measure():
+    """Returns (cumulative microseconds for main, set of top-level modules)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    if result.returncode != 0:
+        sys.exit(f"Importing main failed:\n{result.stderr}")
+
+    total = None
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        modules.add(name.split(".")[0])
+        if name == "main":
+            total = int(cumulative)
+    return total, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    best = min(total for total, _ in runs)
+    eager = sorted(set(LAZY_MODULES) & set().union(*(mods for _, mods in runs)))
+
+    print(f"import main: {best / 1000:.0f}ms (budget {args.budget_ms:.0f}ms)")
+    failed = False
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if best / 1000 > args.budget_ms:
+        print("FAIL: import time over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
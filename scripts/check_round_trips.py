@@ -0,0 +1,101 @@
+"""
+Fails when a route makes more upstream round trips than its declared
+budget, and lists repeated identical calls.
+
+    python scripts/check_round_trips.py
+
+Runs the app with ROUNDTRIP_CHECK=warn against the local Supabase stand-in
+from loadtest_asgi.py, requests each route in ROUTES as a signed-in user and
+prints the per-route report. Exits non-zero if any route returned a 5xx,
+went over its @round_trip_budget or repeated an identical call.
+"""
+import contextlib
+import io
+import os
+import sys
+
+os.environ["ROUNDTRIP_CHECK"] = "warn"
+# Lets spotipy build its OAuth helper; no token is stored, so no Spotify calls
+os.environ.setdefault("sid", "check-client-id")
+os.environ.setdefault("sid_sec", "check-client-secret")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest_asgi import CANNED, USER_ID, fake_jwt, start_supabase_standin  # noqa: E402
+
+ROUTES = [
+    "/profile",
+    "/profile/reader1",
+    "/inbox",
+    "/chat/t1",
+    "/api/getmessages",
+    "/htmx/search?search=dune",
+    "/completed/reader1",
+    "/reader1/tbr",
+    "/api/getuserbook?user_id=reader1",
+    "/new_chat",
+]
+
+RESPONSES = {
+    **CANNED,
+    "cached_library": [
+        {"title": "Dune", "authors": "Frank Herbert", "isbn": "9780441013593",
+         "cover_url": "", "pages": 612, "description": ""}
+    ],
+    "threads": {"id": "t1", "display_name": "Chat"},
+    "thread_participants": [
+        {"thread_id": "t1", "threads": {"id": "t1", "name": "Chat", "type": "direct",
+                                        "updated_at": "2026-01-01T00:00:00Z",
+                                        "display_name": "Chat"}}
+    ],
+}
+
+
+def main():
+    standin = start_supabase_standin(0, RESPONSES)
+    os.environ["supabase_url"] = f"http://127.0.0.1:{standin.server_port}"
+    os.environ["supabase_key"] = "anon-key"
+
+    from main import app
+    from application.log import flush as log_flush
+    from application.roundtrips import report
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = USER_ID
+        session["access_token"] = fake_jwt()
+        session["display_name"] = "reader1"
+
+    # The app's own prints and error logs are not part of the report
+    output = io.StringIO()
+    errors = []
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        for path in ROUTES:
+            status = client.get(path).status_code
+            if status >= 500:
+                errors.append(path)
+                print(
+                    f"{path} returned {status}; counts cover the calls made before the error",
+                    file=sys.__stdout__,
+                )
+        log_flush()
+
+    failed = bool(errors)
+    for route, entry in sorted(report().items()):
+        over = entry["violations"] > 0
+        failed |= over or bool(entry["repeats"])
+        budget = entry["budget"] if entry["budget"] is not None else "-"
+        status = "OVER BUDGET" if over else ("REPEATS" if entry["repeats"] else "ok")
+        print(f"{route:<36} max {entry['max']:>3}  budget {budget:>3}  {status}")
+        for call, count in entry["repeats"].items():
+            print(f"    {count}x {call}")
+
+    standin.shutdown()
+    if failed:
+        sys.exit("Round-trip check failed")
+
+
+if __name__ == "__main__":
+    main()
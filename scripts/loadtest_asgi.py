@@ -0,0 +1,197 @@
+"""
+Load-test comparison of the sync (gunicorn WSGI) and async (uvicorn ASGI)
+serving modes.
+
+    python scripts/loadtest_asgi.py [--concurrency 200] [--duration 10] [--latency 0.1]
+
+Starts a stand-in for Supabase (PostgREST + the auth user endpoint) that
+answers every query after `--latency` seconds, then runs the app in each
+mode against it with one worker process and drives /profile (four Supabase
+round trips, three of them independent) at the given concurrency. Prints a
+JSON summary per mode: requests/s, latency percentiles and error count.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+
+CANNED = {
+    "profiles": {"display_name": "Load Test", "avatar_url": None, "role": "reader", "badges": []},
+    "library": [
+        {"id": i, "title": f"Book {i}", "author": "Author", "status": "tbr", "cover_url": ""}
+        for i in range(50)
+    ],
+    "thread_participants": [{"thread_id": "t1"}],
+    "messages": [],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def fake_jwt():
+    def part(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    claims = {"sub": USER_ID, "exp": int(time.time()) + 3600, "role": "authenticated"}
+    return f"{part({'alg': 'HS256', 'typ': 'JWT'})}.{part(claims)}.c2ln"
+
+
+def start_supabase_standin(latency, canned=None):
+    canned = CANNED if canned is None else canned
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            time.sleep(latency)
+            path = self.path.split("?")[0]
+            if path.startswith("/auth/v1/user"):
+                body = {"id": USER_ID, "aud": "authenticated", "app_metadata": {},
+                        "user_metadata": {}, "created_at": "2026-01-01T00:00:00Z"}
+            else:
+                body = canned.get(path.rsplit("/", 1)[-1], [])
+                # .single() asks for one object; plain selects get a list
+                single = "vnd.pgrst.object" in self.headers.get("Accept", "")
+                if single and isinstance(body, list):
+                    body = body[0] if body else {}
+                elif not single and isinstance(body, dict):
+                    body = [body]
+            payload = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer.daemon_threads = True
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), Handler)
+    server.request_queue_size = 1024
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def session_cookie():
+    from main import app
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({"user_id": USER_ID, "access_token": fake_jwt()})
+
+
+def start_server(mode, port, env):
+    if mode == "sync":
+        cmd = [sys.executable, "-m", "gunicorn", "main:app", "-w", "1",
+               "-b", f"127.0.0.1:{port}", "--timeout", "120"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--workers", "1",
+               "--port", str(port), "--log-level", "warning", "--backlog", "2048"]
+    process = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+async def drive(url, cookie, concurrency, duration):
+    import httpx
+
+    latencies, errors = [], 0
+    stop_at = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=120, cookies={"session": cookie}) as client:
+
+        async def user():
+            nonlocal errors
+            while time.monotonic() < stop_at:
+                started = time.monotonic()
+                try:
+                    response = await client.get(url)
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.monotonic() - started)
+
+        began = time.monotonic()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.monotonic() - began
+
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and ASGI serving modes")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--path", default="/profile")
+    parser.add_argument("--modes", default="sync,async")
+    args = parser.parse_args()
+
+    standin = start_supabase_standin(args.latency)
+    env = {
+        **os.environ,
+        "supabase_url": f"http://127.0.0.1:{standin.server_port}",
+        "supabase_key": "anon-key",
+    }
+    cookie = session_cookie()
+
+    results = {}
+    for mode in args.modes.split(","):
+        port = free_port()
+        process = start_server(mode, port, env)
+        try:
+            results[mode] = asyncio.run(
+                drive(f"http://127.0.0.1:{port}{args.path}", cookie, args.concurrency, args.duration)
+            )
+        finally:
+            process.terminate()
+            process.wait()
+        print(json.dumps({"mode": mode, "path": args.path, "concurrency": args.concurrency,
+                          "upstream_latency_s": args.latency, **results[mode]}))
+
+    standin.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+ASGI serving mode.
+
+Routes registered with @route below run as native coroutines on the event
+loop, so a handler waiting on Supabase, Google Books, Gemini or Spotify holds
+no thread. They still run inside a normal Flask request context (session,
+g, url_for, render_template, before/after-request hooks and error handlers
+all work). Every other path is handed to the Flask WSGI app through asgiref,
+in a thread pool, exactly as under gunicorn.
+
+    uvicorn asgi:app --workers 2
+"""
+import asyncio
+import sys
+from urllib.parse import unquote
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import Map, Rule
+
+from application.admission import ASYNC_ENVIRON_KEY
+from application.async_database import close_async_clients
+
+ASYNC_ROUTES = Map()
+_handlers = {}
+
+
+def route(rule, methods=("GET",)):
+    """Registers an async handler; the Flask app must have a sync route for the same path."""
+
+    def decorator(fn):
+        ASYNC_ROUTES.add(Rule(rule, endpoint=fn.__name__, methods=list(methods)))
+        _handlers[fn.__name__] = fn
+        return fn
+
+    return decorator
+
+
+def build_environ(scope, body: bytes) -> dict:
+    """Minimal WSGI environ for an ASGI http scope (enough for Flask/Werkzeug)."""
+    from io import BytesIO
+
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": unquote(scope["path"]).encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("ascii"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "REMOTE_ADDR": client[0],
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        "CONTENT_LENGTH": str(len(body)),
+        # Lets admission control know not to block the event loop
+        ASYNC_ENVIRON_KEY: True,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin1").upper().replace("-", "_")
+        value = raw_value.decode("latin1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+            continue
+        if name == "CONTENT_LENGTH":
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+class AsgiApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            return await self.wsgi(scope, receive, send)
+
+        adapter = ASYNC_ROUTES.bind(
+            "", script_name=scope.get("root_path") or None
+        )
+        try:
+            endpoint, view_args = adapter.match(scope["path"], method=scope["method"])
+        except (NotFound, MethodNotAllowed):
+            return await self.wsgi(scope, receive, send)
+
+        body = await read_body(receive)
+        response = await self.dispatch(
+            _handlers[endpoint], view_args, build_environ(scope, body)
+        )
+        await send_response(response, send, receive)
+
+    async def dispatch(self, handler, view_args, environ):
+        """Mirrors Flask's full_dispatch_request, awaiting the view."""
+        app = self.flask_app
+        ctx = app.request_context(environ)
+        ctx.push()
+        error = None
+        try:
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await handler(**view_args)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            response = app.make_response(rv)
+            response = app.process_response(response)
+        except Exception as e:
+            error = e
+            response = app.make_response(app.handle_exception(e))
+        finally:
+            ctx.pop(error)
+        return response
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await close_async_clients()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def send_response(response, send, receive=None):
+    headers = [
+        (name.lower().encode("latin1"), value.encode("latin1"))
+        for name, value in response.headers.items()
+    ]
+    await send(
+        {"type": "http.response.start", "status": response.status_code, "headers": headers}
+    )
+    try:
+        body = response.response
+        if hasattr(body, "__aiter__"):
+            await send_stream(body, send, receive)
+        else:
+            for chunk in response.iter_encoded():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        response.close()
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def send_stream(body, send, receive=None):
+    """
+    Sends a long-lived async body (an event stream) as it yields, until it
+    ends or the client goes away; checked whenever the body yields.
+    """
+
+    async def disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    gone = asyncio.ensure_future(disconnect()) if receive is not None else None
+    try:
+        async for chunk in body:
+            if gone is not None and gone.done():
+                break
+            chunk = chunk.encode() if isinstance(chunk, str) else chunk
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        if gone is not None:
+            gone.cancel()
+        await body.aclose()
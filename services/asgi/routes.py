@@ -0,0 +1,181 @@
+"""
+Async variants of the upstream-bound routes. Each mirrors the sync view of
+the same path in services/flask and differs only in awaiting its I/O, with
+independent calls run concurrently via asyncio.gather.
+"""
+import asyncio
+
+from flask import Response, jsonify, redirect, render_template, request, session, url_for
+
+from configfile import supabase_key, supabase_url
+from application import async_database as db
+from application import async_upstreams as upstreams
+from application.admission import EXPENSIVE, admit
+from application.breakers import CircuitOpenError, is_available
+from application.deadlines import DeadlineExceeded
+from application.events import astream, event_response, live
+from application.integrations import get_httpx
+from services.asgi.app import route
+from services.flask.htmxroutes import cached_rows_to_volumes, recent_search, remember_search
+from services.flask.routes import (
+    PROFILE_COLUMNS,
+    TESTGEN_QUOTA,
+    TESTGEN_SLOTS,
+    queue_playlist,
+    queue_testgen,
+    render_profile,
+)
+from application.log import get_logger
+
+log = get_logger(__name__)
+
+# Fire-and-forget tasks, referenced until done so they are not collected
+_background_tasks = set()
+
+
+@route("/htmx/search")
+async def htmx_search():
+    query = request.args.get("search")
+
+    # 1. Check DB first
+    cached_books = await db.check_book_db(query)
+
+    if cached_books:
+        books = cached_rows_to_volumes(cached_books)
+    elif query:
+        # 2. Fetch from Google Books if not in cache
+        try:
+            books = await upstreams.search_google_books(query)
+            remember_search(query.lower(), books)
+            # Cache the results in one round trip, off the response path
+            task = asyncio.ensure_future(_save_to_cache(books))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        except (get_httpx().HTTPError, CircuitOpenError, DeadlineExceeded) as e:
+            log.warning("google books unavailable, serving recent results", query=query, error=e)
+            books = recent_search(query.lower())
+    else:
+        books = []
+
+    if "Dart" in request.headers.get("User-Agent", ""):
+        return {"books": books}
+    return render_template("htmx_search.html", books=books)
+
+
+async def _save_to_cache(books):
+    try:
+        await db.save_books_to_cache(books)
+    except Exception as e:
+        log.warning("search result caching failed", error=e)
+
+
+@route("/profile")
+async def profile():
+    user_id = session.get("user_id")
+
+    if not user_id:
+        return render_template(
+            "profile.html",
+            recs=[],
+            supabase_url=supabase_url,
+            supabase_key=supabase_key,
+        )
+
+    # Profile row, library and latest messages are independent
+    profile_data, library_data, messages = await asyncio.gather(
+        db.get_profile_row(user_id, PROFILE_COLUMNS),
+        db.get_library(user_id),
+        db.get_latest_messages_for_modal(user_id, session.get("access_token")),
+    )
+    return render_profile(profile_data, library_data, messages)
+
+
+@route("/inbox")
+async def inbox():
+    token = session.get("access_token")
+    if not token:
+        return redirect(url_for("login"))
+
+    try:
+        threads = await db.get_my_inbox(session.get("user_id"), token)
+    except Exception as e:
+        log.warning("inbox load failed", error=e)
+        return f"Could not load inbox. Error: {e}", 500
+    return render_template("inbox.html", threads=threads)
+
+
+@route("/events")
+async def events():
+    user_id = session.get("user_id")
+    if not user_id:
+        return {"error": "Not signed in"}, 401
+    if not live():
+        return Response(status=204)
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    return event_response(astream(user_id, last_event_id))
+
+
+@route("/chat/<thread_id>")
+async def chat_room(thread_id):
+    token = session.get("access_token")
+    if not token:
+        return redirect(url_for("login"))
+
+    try:
+        # Thread metadata and its messages are fetched together
+        thread_data, messages = await asyncio.gather(
+            db.get_thread(thread_id, token),
+            db.get_thread_messages(thread_id, token),
+        )
+    except Exception as e:
+        log.warning("chat load failed", thread=thread_id, error=e)
+        return "You do not have permission to view this chat.", 403
+
+    if not thread_data:
+        return "Thread not found or access denied", 404
+    return render_template("chat.html", thread=thread_data, messages=messages)
+
+
+@route("/testgen", methods=["POST"])
+@admit(EXPENSIVE, concurrency=TESTGEN_SLOTS, quota=TESTGEN_QUOTA, overflow=queue_testgen)
+async def testgen():
+    data_json = request.json
+    image = data_json.get("cover")
+    user_id = data_json.get("botuser_id") or session.get("bot_user_id")
+    if not user_id:
+        return jsonify({"error": "User not authenticated"}), 401
+
+    book = {"author": data_json.get("author"), "title": data_json.get("title")}
+
+    if not is_available("gemini", "spotify"):
+        return queue_playlist(book, image)
+
+    try:
+        data, books = await upstreams.get_playlist_recommendations(book)
+    except CircuitOpenError:
+        return queue_playlist(book, image)
+
+    if not books:
+        return jsonify({"error": "Could not generate song recommendations"}), 502
+
+    playlist = await upstreams.create_playlist(data, books, image)
+    log.info("playlist created", user=user_id, playlist=playlist)
+    return jsonify(playlist)
+
+
+@route("/api/getmessages")
+async def get_messages_route():
+    if "Dart" in request.headers.get("User-Agent", ""):
+        user = request.args.get("user")
+        auth_header = request.headers.get("Authorization")
+        token = auth_header.split(" ")[1] if auth_header else None
+        session["display_name"] = user  # Store in session for consistency
+        session["access_token"] = token  # Store in session for consistency
+    else:
+        user = session.get("display_name")
+        token = session.get("access_token")
+
+    if not token:
+        return jsonify({"error": "No token provided"}), 401
+
+    return jsonify(await db.get_latest_messages_for_modal(user, token))
@@ -11,17 +11,31 @@ from flask import (
 import threading
 from application.gr_threaded import background_upload_task
 from application.gr_importer import gr_import_parser
-from configfile import google_books_key as bookkey
+from application.breakers import breaker_states
+from application.jobs import QueueFull, enqueue, get_job
+from application.tracing import current_traceparent
+from application.profiling import current_profile_id
+from application.roundtrips import round_trip_budget
+from application.admission import EXPENSIVE, INTERACTIVE, Slots, busy, charge, parse_quota, priority
+from application.log import get_logger, lazy
+from application import feed
+from application.events import live
+from services.flask.routes import TESTGEN_QUOTA
+from configfile import google_books_key as bookkey, import_concurrency, import_quota
 from application.logic import (
     fetch_data_from_api,
     process_data,
     get_book_details_from_openlibrary,
+    get_playlist_recommendations_batch,
 )
 from application.database import (
     amend_top_five,
     add_book_to_library,
+    get_library,
     get_latest_messages_for_modal,
     get_supabase_client,
+    get_top_five_for_users,
+    get_user_id_for_token,
     remove_from_library,
     send_message,
     update_currentbook,
@@ -34,6 +48,12 @@ import ast
 api_bp = Blueprint(
     "api", __name__, template_folder="../../templates", static_folder="../../static"
 )
+log = get_logger(__name__)
+
+# Imports run in background threads; cap how many run at once per worker, and
+# how often one user may start one
+IMPORT_SLOTS = Slots("Goodreads import", import_concurrency)
+IMPORT_QUOTA = parse_quota("Goodreads import", import_quota)
 
 
 @api_bp.route("/hellothere")
@@ -41,6 +61,94 @@ def hellothere():
     return {"message": fetch_data_from_api("https://app.iamchrsg.dpdns.org/tester")}
 
 
+@api_bp.route("/status/upstreams")
+def upstream_status():
+    return jsonify(breaker_states())
+
+
+@api_bp.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+def pregenerate_playlists(books):
+    results = get_playlist_recommendations_batch(books)
+    generated = sum(1 for _, songs in results if songs)
+    return {"generated": generated, "failed": len(results) - generated}
+
+
+# The most books one pregenerate request may ask for, and the longest title
+# or author accepted
+PREGENERATE_MAX_BOOKS = 50
+PREGENERATE_MAX_FIELD = 300
+
+
+def _pregenerate_books(books):
+    """Title and author of each book, or None if any item is malformed."""
+    if not isinstance(books, list):
+        return None
+    cleaned = []
+    for book in books:
+        if not isinstance(book, dict):
+            return None
+        title, author = book.get("title"), book.get("author") or ""
+        if not isinstance(title, str) or not title.strip() or not isinstance(author, str):
+            return None
+        if len(title) > PREGENERATE_MAX_FIELD or len(author) > PREGENERATE_MAX_FIELD:
+            return None
+        cleaned.append({"title": title.strip(), "author": author.strip()})
+    return cleaned
+
+
+@api_bp.route("/recommendations/pregenerate", methods=["POST"])
+@priority(EXPENSIVE)
+def pregenerate_recommendations():
+    """
+    Warms the recommendation cache for a list of books, or for the signed-in
+    user's TBR shelf, with batched Gemini calls in the background. Charged
+    to the user's /testgen quota.
+    """
+    if "Dart" in request.headers.get("User-Agent", ""):
+        auth_header = request.headers.get("Authorization")
+        user_id = get_user_id_for_token(auth_header.split(" ")[-1] if auth_header else None)
+    else:
+        user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"error": "User not authenticated"}), 401
+
+    data = request.get_json(silent=True) or {}
+    if "books" in data:
+        books = _pregenerate_books(data["books"])
+        if books is None:
+            return jsonify({"error": "'books' must be a list of {title, author}"}), 400
+    else:
+        books = [
+            {"title": book.get("title"), "author": book.get("author")}
+            for book in get_library(user_id)
+            if book.get("status") not in ("reading", "completed", "dnf")
+        ][:PREGENERATE_MAX_BOOKS]
+    if len(books) > PREGENERATE_MAX_BOOKS:
+        return jsonify({"error": f"At most {PREGENERATE_MAX_BOOKS} books per request"}), 400
+
+    if not books:
+        return jsonify({"status": "success", "generated": 0, "failed": 0})
+
+    key = charge(TESTGEN_QUOTA, f"user:{user_id}")
+    try:
+        job_id = enqueue(
+            "pregenerate_playlists", pregenerate_playlists, books, upstreams=("gemini",)
+        )
+    except QueueFull as e:
+        if key is not None:
+            TESTGEN_QUOTA.refund(key)
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify({"status": "queued", "job_id": job_id, "books": len(books)}), 202
+
+
 @api_bp.route("/data")
 def get_data():
     data = fetch_data_from_api("https://app.iamchrsg.dpdns.org/tester")
@@ -49,6 +157,7 @@ def get_data():
 
 
 @api_bp.route("/addtolibrary", methods=["POST"])
+@priority(INTERACTIVE)
 def add_to_library():
     try:
         # 1. Get the 'data' string from the form and parse it as JSON
@@ -77,13 +186,14 @@ def add_to_library():
         return Response(status=204, headers={"HX-Refresh": "true"})
     except Exception as e:
         # Log the actual error to your console for debugging
-        print(f"Error in add_to_library: {e}")
+        log.exception("add_to_library failed")
         return Response("Internal Server Error", status=500)
 
 
 @api_bp.route("/removefromshelf", methods=["POST"])
+@priority(INTERACTIVE)
 def remove_from_shelf():
-    print(request.form)
+    log.debug("removefromshelf", form=lazy(lambda: request.form.to_dict()))
     bookid = request.form["bookid"]
     user = session.get("user_id")
     remove_from_library(user, bookid)
@@ -93,8 +203,9 @@ def remove_from_shelf():
 
 
 @api_bp.route("/dnf", methods=["POST"])
+@priority(INTERACTIVE)
 def dnf():
-    print(request.form)
+    log.debug("dnf", form=lazy(lambda: request.form.to_dict()))
     bookid = request.form["bookid"]
     dnfreason = request.form.get("notes", "No reason provided")
     if "Dart" in request.headers.get("User-Agent", ""):
@@ -113,8 +224,9 @@ def dnf():
 
 
 @api_bp.route("/currentbook", methods=["POST"])
+@priority(INTERACTIVE)
 def update_current_book():
-    print(request.form)
+    log.debug("currentbook", form=lazy(lambda: request.form.to_dict()))
     bookid = request.form["bookid"]
 
     # Here you would add logic to remove the book from the user's shelf in the database
@@ -158,11 +270,57 @@ def add_top_five():
     amend_top_five(
         user,
         books,  # This 'books' variable now holds the data from currentRecsList
+        session.get("user_id"),
     )
 
     return {"data": "success"}
 
 
+@api_bp.route("/topfive")
+@round_trip_budget(1)
+def top_fives():
+    """Several users' top fives, e.g. for a friends list: ?users=reader1,reader2"""
+    usernames = [name for name in request.args.get("users", "").split(",") if name]
+    if not usernames:
+        return jsonify({"error": "No users provided"}), 400
+    if len(usernames) > 100:
+        return jsonify({"error": "At most 100 users"}), 400
+    return jsonify(get_top_five_for_users(usernames))
+
+
+@api_bp.route("/follow", methods=["POST"])
+def follow_user():
+    user_id = session.get("user_id")
+    followee_id = (request.get_json(silent=True) or {}).get("user_id")
+    if not user_id:
+        return jsonify({"error": "Not signed in"}), 401
+    if not followee_id or followee_id == user_id:
+        return jsonify({"error": "Invalid user_id"}), 400
+    feed.follow(user_id, followee_id, session.get("access_token"))
+    return Response(status=204)
+
+
+@api_bp.route("/unfollow", methods=["POST"])
+def unfollow_user():
+    user_id = session.get("user_id")
+    followee_id = (request.get_json(silent=True) or {}).get("user_id")
+    if not user_id:
+        return jsonify({"error": "Not signed in"}), 401
+    if not followee_id:
+        return jsonify({"error": "Invalid user_id"}), 400
+    feed.unfollow(user_id, followee_id, session.get("access_token"))
+    return Response(status=204)
+
+
+@api_bp.route("/feed")
+def activity_feed():
+    """The signed-in user's friends activity, newest first."""
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"error": "Not signed in"}), 401
+    return jsonify(feed.read(user_id))
+
+
 @api_bp.route("/submit_reply", methods=["POST"])
 def sendmsg():
     if "Dart" in request.headers.get("User-Agent", ""):
@@ -171,17 +329,37 @@ def sendmsg():
         user = request_data.get("user")
         recipient = request_data.get("recipient")
         message = request_data.get("message")
+        # Flutter has no Flask session; it sends its Supabase token instead
+        auth_header = request.headers.get("Authorization")
+        token = auth_header.split(" ")[1] if auth_header else None
     else:
         request_data = request.get_json()
         thread = request_data.get("thread")
         user = request_data.get("user")
         recipient = request_data.get("recipient")
         message = request_data.get("message")
-    send_message(thread, user, recipient, message)
-    return Response(status=204, headers={"HX-Refresh": "true"})
+        token = session.get("access_token")
+    if not token:
+        return jsonify({"error": "No token provided"}), 401
+    try:
+        send_message(thread, user, message, token, None)
+    except Exception as e:
+        log.warning("reply send failed", thread=thread, error=e)
+        return jsonify({"error": "Could not send message"}), 502
+    # Pages listening on /events get the message from there; the rest reload
+    return Response(status=204, headers=None if live() else {"HX-Refresh": "true"})
+
+
+def run_import(*args):
+    """Runs background_upload_task, then frees the import's slot."""
+    try:
+        background_upload_task(*args)
+    finally:
+        IMPORT_SLOTS.release()
 
 
 @api_bp.route("/goodreadsimport", methods=["POST"])
+@priority(EXPENSIVE)
 def goodreads_import():
     # 1. Identify the user
     token = None
@@ -189,7 +367,7 @@ def goodreads_import():
         user = request.form.get("user")
         auth_header = request.headers.get("Authorization")
         token = auth_header.split(" ")[1] if auth_header else None
-        print(f"Flutter import: User {user} is uploading a file.")
+        log.info("flutter import started", user=user)
         goodreads_id = request.form.get("bookid")
     else:
         user = session.get("display_name")
@@ -205,19 +383,32 @@ def goodreads_import():
         return {"error": "No selected file"}, 400
 
     if uploaded_file:
-        file_content = uploaded_file.read().decode("utf-8")
-
-        # Parse CSV content into a list/dict *before* threading
-        # so the file stream data isn't lost when the request context closes.
-        not_found_json, books = gr_import_parser(file_content, user, token)
-        print(f"Importing for user {user}: Received {len(file_content)} bytes")
+        key = charge(IMPORT_QUOTA, f"user:{user}" if user else None)
+        # The slot is held until the background import finishes
+        if not IMPORT_SLOTS.acquire():
+            if key is not None:
+                IMPORT_QUOTA.refund(key)
+            raise busy(IMPORT_SLOTS)
+        try:
+            file_content = uploaded_file.read().decode("utf-8")
+
+            # Parse CSV content into a list/dict *before* threading
+            # so the file stream data isn't lost when the request context closes.
+            not_found_json, books = gr_import_parser(file_content, user, token)
+        except Exception:
+            IMPORT_SLOTS.release()
+            raise
+        log.info("import parsed", user=user, bytes=len(file_content), books=len(books))
 
         # 3. Spin up the Background Thread safely
         # We fetch the exact application instance object to pass down
         app_ctx = current_app._get_current_object()
 
         threading.Thread(
-            target=background_upload_task, args=(app_ctx, books, user, bookkey)
+            target=run_import,
+            args=(
+                app_ctx, books, user, bookkey, current_traceparent(), current_profile_id()
+            ),
         ).start()
 
         # 4. Immediate HTTP response back to Flutter / Browser
@@ -235,6 +426,8 @@ def goodreads_import():
 
 
 @api_bp.route("/getmessages", methods=["GET"])
+@round_trip_budget(3)
+@priority(INTERACTIVE)
 def get_messages_route():
     # 1. Determine the user and the token
     if "Dart" in request.headers.get("User-Agent", ""):
@@ -291,5 +484,5 @@ def get_messages_route():
         return messages_resp.data
 
     except Exception as e:
-        print(f"Error fetching aggregate messages: {e}")
+        log.warning("latest messages failed", error=e)
         return []
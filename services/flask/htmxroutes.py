@@ -1,17 +1,35 @@
 from flask import Blueprint, render_template, request, session
-import requests
 from application.database import (
     amend_top_five,
     update_book_progress,
     complete_currentbook,
     check_book_db,
-    save_book_to_cache
+    save_books_to_cache,
 )
-from configfile import google_books_key as bookkey
+from application.deadlines import DeadlineExceeded, timeout_for
+from application.breakers import CircuitOpenError, guard
+from application.cache import DAY, SEARCH
+from application.integrations import get_requests
+from application.roundtrips import round_trip_budget
+from application.admission import INTERACTIVE, priority
+from application.log import get_logger, lazy
+from configfile import google_books_key as bookkey, google_books_url
 
 htmx_bp = Blueprint(
     "htmx", __name__, template_folder="../../templates", static_folder="../../static"
 )
+log = get_logger(__name__)
+
+# Google Books results by query, served when Google Books is unavailable
+RECENT_SEARCH_TTL = DAY
+
+
+def remember_search(query, books):
+    SEARCH.set(("google", query), books, ttl=RECENT_SEARCH_TTL)
+
+
+def recent_search(query):
+    return SEARCH.get(("google", query), [])
 
 
 @htmx_bp.route("/hellothere")
@@ -29,7 +47,7 @@ def hellothere():
 
 @htmx_bp.route("/posttest", methods=["POST"])
 def htmxposting():
-    print(request.form["message"])
+    log.debug("posttest", message=request.form["message"])
     return """
     <div id="post-success" style="background: #d4edda; padding: 10px; border-radius: 5px;">
         You posted to the server!
@@ -43,7 +61,29 @@ def htmxposting():
     """
 
 
+def cached_rows_to_volumes(rows):
+    """Re-packages cached_library rows into Google Books volume format."""
+    books = []
+    for row in rows:
+        books.append({
+            "kind": "books#volume",
+            "id": str(row.get("id")),
+            "volumeInfo": {
+                "title": row.get("title"),
+                "authors": row.get("authors", "").split(", ") if row.get("authors") else [],
+                "imageLinks": {"thumbnail": row.get("cover_url")},
+                "pageCount": row.get("pages"),
+                "description": row.get("description"),
+                "industryIdentifiers": [{"type": "ISBN_13", "identifier": row.get("isbn")}]
+            }
+        })
+    return books
+
+
 @htmx_bp.route("/search", methods=["GET"])
+# cache lookup, then on a miss Google Books and one batched cache write
+@round_trip_budget(3)
+@priority(INTERACTIVE)
 def htmx_search():
     query = request.args.get("search")
     
@@ -51,36 +91,34 @@ def htmx_search():
     cached_books = check_book_db(query)
     
     if cached_books:
-        # Re-package Supabase rows into Google Books format
-        books = []
-        for row in cached_books:
-            books.append({
-                "kind": "books#volume",
-                "id": str(row.get("id")),
-                "volumeInfo": {
-                    "title": row.get("title"),
-                    "authors": row.get("authors", "").split(", ") if row.get("authors") else [],
-                    "imageLinks": {"thumbnail": row.get("cover_url")},
-                    "pageCount": row.get("pages"),
-                    "description": row.get("description"),
-                    "industryIdentifiers": [{"type": "ISBN_13", "identifier": row.get("isbn")}]
-                }
-            })
+        books = cached_rows_to_volumes(cached_books)
     else:
         # 2. Fetch from Google Books if not in cache
         if query:
-            url = f"https://www.googleapis.com/books/v1/volumes?q=intitle:{query}&key={bookkey}"
-            response = requests.get(url)
-            data = response.json()
-            books = data.get("items", [])[:10]
-            for book in books:
-                save_book_to_cache(book)
+            url = f"{google_books_url}/volumes?q=intitle:{query}&key={bookkey}"
+            try:
+                with guard("google_books", "search", url) as call:
+                    response = get_requests().get(url, timeout=timeout_for("google_books"))
+                    call.status(response.status_code, len(response.content))
+                response.raise_for_status()
+                data = response.json()
+                books = data.get("items", [])[:10]
+                remember_search(query.lower(), books)
+                try:
+                    save_books_to_cache(books)
+                except Exception as e:
+                    # The results are good without the cache
+                    log.warning("search result caching failed", error=e)
+            except (get_requests().RequestException, CircuitOpenError, DeadlineExceeded) as e:
+                # Fall back to whatever we last got for this query
+                log.warning("google books unavailable, serving recent results", query=query, error=e)
+                books = recent_search(query.lower())
             # Optional: You could trigger an async background task here to cache 
             # these results into Supabase for next time.
         else:
             books = []
     if "Dart" in request.headers.get("User-Agent", ""):
-        print(books)
+        log.debug("search served", query=query, results=len(books))
         return {"books": books}
     else:
         return render_template("htmx_search.html", books=books)
@@ -93,12 +131,10 @@ from flask import request, current_app, jsonify
 
 
 @htmx_bp.route("/update_page", methods=["POST"])
+@priority(INTERACTIVE)
 def update_page():
     # 1. Extract Data
-    print(f"DEBUG: Headers: {request.headers}")
-    print(f"DEBUG: Form Data: {request.form}")
-    print(f"DEBUG: JSON Data: {request.get_json(silent=True)}")
-    print("Received form data:", request.form)  # Debugging line
+    log.debug("update_page", form=lazy(lambda: request.form.to_dict()))
     user_id = request.form.get("user_id")
     book_id_str = request.form.get("book_id")
     current_page_str = request.form.get("current_page")
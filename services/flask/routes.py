@@ -10,8 +10,7 @@ from flask import (
     jsonify,
     send_from_directory,
 )
-import supabase
-from supabase_auth import datetime
+from datetime import datetime
 from application.suggestions import (
     verify_token,
     app_callback,
@@ -19,8 +18,19 @@ from application.suggestions import (
     create_playlist,
     clear_session,
     get_profile_data,
+    profile_image,
 )
 from application.logic import get_book_recommendations, get_playlist_recommendations
+from application.breakers import CircuitOpenError, is_available
+from application.jobs import QueueFull, enqueue
+from application.roundtrips import round_trip_budget
+from application.assets import asset_url
+from application.fragments import library_version, stream_page
+from application.admission import EXPENSIVE, INTERACTIVE, Slots, admit, parse_quota, priority
+from application.log import get_logger
+from application.outbox import queue_message
+from application.directory import contacts as directory_contacts, display_names as directory_display_names
+from application import feed
 from application.database import (
     get_latest_messages_for_modal,
     get_top_five_by_username,
@@ -28,13 +38,17 @@ from application.database import (
     get_my_threads,
     get_my_inbox,
     is_new,
+    find_conversation,
+    create_conversation,
     get_supabase_client,
     send_message,
 )
 import json, ast
-from configfile import supabase_url, supabase_key
+import uuid
+from configfile import supabase_url, supabase_key, testgen_concurrency, testgen_quota
 
 app = Flask(__name__)
+log = get_logger(__name__)
 app.secret_key = "supersecretkey"
 app.template_folder = "../../templates"
 app.static_folder = "../../static"
@@ -106,6 +120,7 @@ def home():
 
 
 @app.route("/inbox")
+@round_trip_budget(2)
 def inbox():
     token = session.get("access_token")
     user_id = session.get("user_id")
@@ -113,9 +128,11 @@ def inbox():
     if not token:
         return redirect(url_for("login"))
 
-    inbox = get_my_inbox()
-    # This function now returns the full thread data with display names
-    return render_template("inbox.html", threads=inbox)
+    try:
+        threads = get_my_inbox()
+    except Exception as e:
+        return f"Could not load inbox. Error: {e}", 500
+    return render_template("inbox.html", threads=threads)
 
 
 @app.route("/about")
@@ -124,12 +141,14 @@ def about():
 
 
 @app.route("/allbooks")
+@round_trip_budget(1)
 def allbooks():
     data = get_library(session.get("user"))
     return data
 
 
 @app.route("/api/getuserbook")
+@round_trip_budget(1)
 def get_user_book():
     user_id = request.args.get("user_id") or session.get("user")
     if not user_id:
@@ -147,11 +166,12 @@ def login():
 
 
 @app.route("/set_session", methods=["POST"])
+@priority(INTERACTIVE)
 def set_session():
     data = request.json
     user_uuid = data.get("uuid")
     user_email = data.get("email")
-    print(data)
+    log.debug("session set", user=user_uuid, email=user_email)
     if user_uuid:
         session["access_token"] = data.get(
             "token"
@@ -167,17 +187,17 @@ def set_session():
 
 
 @app.route("/new_chat")
+@round_trip_budget(1)
 def new_chat_page():
     token = session.get("access_token")
     if not token:
         return redirect(url_for("login"))
 
-    supabase = get_supabase_client()
-    # Fetch all users so the current user can pick someone to message
-    # In a real app, you might want to filter this by 'friends' or 'contacts'
-    response = supabase.table("profiles").select("id, display_name").execute()
-
-    return render_template("create_thread.html", all_users=response.data)
+    # Only the user's contacts; everyone else is found through the
+    # /directory typeahead
+    return render_template(
+        "create_thread.html", all_users=directory_contacts(session.get("user_id"), token)
+    )
 
 
 @app.route("/terms")
@@ -197,6 +217,8 @@ def logout():
 
 
 @app.route("/profile")
+# profile, library, auth check, thread ids, latest messages
+@round_trip_budget(5)
 def profile():
     # Use the UUID stored in session (we set this as 'user_id' in previous steps)
     user_id = session.get("user_id")
@@ -214,13 +236,36 @@ def profile():
         profile_resp = (
             get_supabase_client()
             .table("profiles")
-            .select("display_name, avatar_url, role, badges")
+            .select(PROFILE_COLUMNS)
             .eq("id", user_id)
             .single()
             .execute()
         )
         profile_data = profile_resp.data
-        print(f"Fetched profile data for user {user_id}: {profile_data}")
+    except Exception as e:
+        log.warning("profile fetch failed", user=user_id, error=e)
+        profile_data = None
+
+    # 2. Fetch and organize library
+    library_data = get_library(session.get("user_id"))  # Pass the user_id
+
+    return render_profile(
+        profile_data, library_data, get_latest_messages_for_modal()
+    )
+
+
+PROFILE_COLUMNS = "display_name, avatar_url, role, badges"
+DEFAULT_AVATAR = "https://www.creativefabrica.com/wp-content/uploads/2020/03/08/open-book-in-circle-icon-Graphics-3393563-1.jpg"
+ROLE_BADGES = {"founder": "👑", "admin": "🛠️", "peanutbutter": "🥜"}
+
+
+def render_profile(profile_data, library_data, messages):
+    """
+    Streams profile.html from the profile row, library rows and latest
+    messages. Shared by the sync route and its async (ASGI) variant.
+    """
+    if profile_data:
+        log.debug("profile loaded", user=session.get("user_id"), profile=profile_data)
         session["display_name"] = profile_data.get("display_name")
         session["avatar_url"] = profile_data.get(
             "avatar_url"
@@ -230,28 +275,17 @@ def profile():
         )  # Store role in session for later use
         # Extract name and image with defaults
         user_display_name = session.get("display_name") or "New Explorer"
-        user_avatar = (
-            session.get("avatar_url")
-            or "https://www.creativefabrica.com/wp-content/uploads/2020/03/08/open-book-in-circle-icon-Graphics-3393563-1.jpg"
-        )
-    except Exception as e:
-        print(f"Error fetching profile: {e}")
+        user_avatar = session.get("avatar_url") or DEFAULT_AVATAR
+    else:
         user_display_name = "User"
-        user_avatar = "https://www.creativefabrica.com/wp-content/uploads/2020/03/08/open-book-in-circle-icon-Graphics-3393563-1.jpg"
+        user_avatar = DEFAULT_AVATAR
+        profile_data = {}
 
-    # 2. Fetch and organize library
-    library_data = get_library(session.get("user_id"))  # Pass the user_id
     sorted_books = organize_library(library_data)
-    role = session.get("role")
-    if role == "founder":
-        role = "👑"
-    elif role == "admin":
-        role = "🛠️"
-    elif role == "peanutbutter":
-        role = "🥜"
+    role = ROLE_BADGES.get(session.get("role"), session.get("role"))
 
     # Default to 'reader' if role is not set
-    return render_template(
+    return stream_page(
         "profile.html",
         img=user_avatar,  # Now comes from Supabase profiles
         user=user_display_name,  # Now comes from Supabase profiles
@@ -259,8 +293,10 @@ def profile():
         tbr=sorted_books["tbr"],
         completed=sorted_books["completed"],
         dnf=sorted_books["dnf"],
+        # Shelves are cached per library version (see fragments.py)
+        library_version=library_version(library_data),
         recs=[],
-        messages=get_latest_messages_for_modal(),  # Switched from hardcoded string to user_id
+        messages=messages,  # Switched from hardcoded string to user_id
         supabase_url=supabase_url,
         supabase_key=supabase_key,
         role={
@@ -283,7 +319,7 @@ def api_profile_data():
     # 2. Call your existing function from suggestions.py
     # This function uses get_spotify_client(user_id) which handles the token
     profile_data = get_profile_data(user_id)
-    print(profile_data)
+    log.debug("spotify profile", user=user_id, found=bool(profile_data))
     if profile_data:
         return jsonify(profile_data)
     else:
@@ -296,10 +332,12 @@ def moretesting():
 
 
 @app.route("/profile/<user>")
+# library, top five, Spotify token (lookup + refresh) and one profile call
+@round_trip_budget(5)
 def user_profile(user):
     # 1. Fetch library data (Returns a list of dictionaries from Supabase)
     tbr = get_library(user)
-    print(f"Raw data from Supabase: {tbr}")
+    log.debug("library loaded", user=user, books=len(tbr))
 
     better_data = []  # To Be Read (TBR)
     currentbook = []  # Currently Reading
@@ -321,7 +359,7 @@ def user_profile(user):
 
         # Ensure book_details is a list and has enough elements
         if not isinstance(book_details, list) or len(book_details) < 3:
-            print(f"Skipping book ID {book_id} due to invalid or missing book details.")
+            log.debug("skipping book with invalid details", sample=50, book_id=book_id)
             continue
 
         # Unpack the book details list
@@ -329,7 +367,7 @@ def user_profile(user):
         author = book_details[1]
         cover_url = book_details[2]
 
-        print(f"Processing book: {title}, Status: {status}")
+        log.debug("processing book", sample=100, title=title, status=status)
 
         # Construct the standardized dictionary for rendering
         book_dict = {
@@ -364,23 +402,27 @@ def user_profile(user):
     user = "Book Lover"
     img = "https://www.creativefabrica.com/wp-content/uploads/2020/03/08/open-book-in-circle-icon-Graphics-3393563-1.jpg"
 
-    if session and callable(globals().get("get_profile_data")):
+    if session:
+        # One Spotify lookup serves both the name and the picture
         profile_data = get_profile_data()
-        if profile_data and profile_data.get("display_name"):
-            user = profile_data["display_name"]
-
-        if callable(globals().get("get_profile")):
-            profile_img = get_profile()
-            if profile_img:
-                img = profile_img
+        if profile_data:
+            session["bot_user_id"] = profile_data["id"]
+            if profile_data.get("display_name"):
+                user = profile_data["display_name"]
+            img = profile_image(profile_data) or img
 
     books = [  # This seems like placeholder data, keeping for consistency
         {"title": "The Great Gatsby", "author": "F. Scott Fitzgerald"},
     ]
     # --- End other data initialization ---
 
-    print(f"Current Book: {currentbook}")
-    print(f"TBR: {better_data}")
+    log.debug(
+        "shelves sorted",
+        reading=len(currentbook),
+        tbr=len(better_data),
+        completed=len(completed),
+        dnf=len(dnf),
+    )
 
     return render_template(
         "userprofile.html",
@@ -391,6 +433,7 @@ def user_profile(user):
         tbr=better_data,
         completed=completed,
         dnf=dnf,
+        library_version=library_version(tbr),
         recs=recs,
     )
 
@@ -404,8 +447,15 @@ def auth_callback(code: str):
 
 
 @app.route("/friends")
+@round_trip_budget(2)
 def friends():
-    return render_template("friends.html")
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    activity = feed.read(user_id)
+    names = directory_display_names({item["user_id"] for item in activity})
+    return render_template("friends.html", feed=activity, names=names)
 
 
 @app.route("/reset-password", methods=["POST"])
@@ -415,15 +465,13 @@ def reset_password():
         return jsonify({"error": "Email is required"}), 400
 
     try:
-        supabase.auth.resetPasswordForEmail(
+        get_supabase_client().auth.reset_password_for_email(
             email,
-            {
-                redirectTo: window.location.origin + "/reset-password",
-            },
+            {"redirect_to": request.url_root + "reset-password"},
         )
         return jsonify({"message": "Password reset email sent!"})
     except Exception as e:
-        print(f"Error occurred: {e}")
+        log.warning("password reset failed", error=e)
         return jsonify({"error": "Failed to send password reset email"}), 500
 
 
@@ -436,7 +484,7 @@ def verify():
     # Spotify will pass this exact string back to our callback.
     auth_url = verify_token(platform)
 
-    print(f"Initiating login for platform: {platform}")
+    log.info("spotify login started", platform=platform)
     return redirect(auth_url)
 
 
@@ -454,7 +502,7 @@ def api_callback():
         "bot_user_id"
     )  # This is the ID your bot uses to fetch the token
 
-    print(f"Callback received. Platform: {platform}, User: {user_id}")
+    log.info("spotify callback", platform=platform, user=user_id)
 
     if platform == "flutter":
         # Redirect using the Custom Scheme to wake up the Flutter App
@@ -478,20 +526,40 @@ def send_message_supabase():
     thread_id = request.json.get("thread_id")
     content = request.json.get("message")
 
+    shared_data = request.json.get("data")
+
     if "Dart" in request.headers.get("User-Agent", ""):
         thread_id = request.json.get("thread_id")
         content = request.json.get("message")
         auth_header = request.headers.get("Authorization")
         token = auth_header.split(" ")[1] if auth_header else None
         sender_id = request.json.get("sender_id")
-        shared_data = request.json.get("data")
     else:
         token = session.get("access_token")
         sender_id = session.get("user_id")
 
-    send_message(thread_id, sender_id, content, token, shared_data)
+    client_id = request.json.get("client_id")
+    message = dict(
+        thread_id=thread_id,
+        sender_id=sender_id,
+        content=content,
+        token=token,
+        shared_data=shared_data,
+        client_id=client_id or str(uuid.uuid4()),
+    )
+
+    # Fire-and-forget: acknowledged once the send is queued in Redis, and
+    # stored by the outbox drainer. Without Redis it is sent inline below.
+    if "respond-async" in request.headers.get("Prefer", "") and queue_message(**message):
+        return jsonify({"client_id": message["client_id"], "status": "queued"}), 202
+
+    try:
+        stored = send_message(**message)
+    except Exception as e:
+        log.warning("message send failed", thread=thread_id, error=e)
+        return jsonify({"error": "Could not send message"}), 502
 
-    return {"data": "Message sent successfully!"}
+    return jsonify({"data": "Message sent successfully!", "message": stored})
 
 
 @app.route("/create_thread", methods=["POST"])
@@ -522,30 +590,47 @@ def create_thread():
             participant_names[0] if participant_names else "Private Chat"
         )
 
-    # Add yourself to the IDs
-    participant_ids.append(my_id)
+    try:
+        # A private chat that already exists is opened rather than created
+        # again; found ids are cached, so this is usually no round trip
+        if thread_type == "private":
+            thread_id = find_conversation(my_id, participant_ids, token)
+            if thread_id:
+                return redirect(url_for("chat_room", thread_id=thread_id))
+
+        thread_id = create_conversation(
+            my_id, participant_ids, final_display_name, thread_type, token
+        )
+        return redirect(url_for("chat_room", thread_id=thread_id))
 
-    supabase = get_supabase_client()
-    supabase.auth.set_session(token, "")
+    except Exception as e:
+        log.warning("create_new_chat failed", error=e)
+        return "Failed to create chat.", 500
 
-    try:
-        response = supabase.rpc(
-            "create_new_chat",
-            {
-                "participant_ids": participant_ids,
-                "thread_name": final_display_name,  # Stored in threads.display_name
-                "thread_type": thread_type,
-            },
-        ).execute()
 
-        return redirect(url_for("chat_room", thread_id=response.data))
+@app.route("/message/<user_id>")
+def message_user(user_id):
+    """Opens the private chat with user_id, creating it on first use."""
+    token = session.get("access_token")
+    my_id = session.get("user_id")
+
+    if not token:
+        return redirect(url_for("login"))
+
+    try:
+        thread_id = find_conversation(my_id, [user_id], token)
+        if not thread_id:
+            name = request.args.get("name") or "Private Chat"
+            thread_id = create_conversation(my_id, [user_id], name, "private", token)
+        return redirect(url_for("chat_room", thread_id=thread_id))
 
     except Exception as e:
-        print(f"Error: {e}")
+        log.warning("create_new_chat failed", error=e)
         return "Failed to create chat.", 500
 
 
 @app.route("/chat/<thread_id>")
+@round_trip_budget(3)
 def chat_room(thread_id):
     # 1. Session Check
     token = session.get("access_token")
@@ -582,11 +667,50 @@ def chat_room(thread_id):
         )
 
     except Exception as e:
-        print(f"Error loading chat: {e}")
+        log.warning("chat load failed", thread=thread_id, error=e)
         return "You do not have permission to view this chat.", 403
 
 
+@app.route("/chat/<thread_id>/messages")
+@round_trip_budget(1)
+@priority(INTERACTIVE)
+def chat_messages(thread_id):
+    """Messages after ?after=<created_at>, for chat pages that poll instead of streaming."""
+    token = session.get("access_token")
+    if not token:
+        return jsonify({"error": "Not signed in"}), 401
+
+    supabase = get_supabase_client()
+    supabase.postgrest.auth(token)
+    query = supabase.table("messages").select("*").eq("thread_id", thread_id)
+    after = request.args.get("after")
+    if after:
+        query = query.gt("created_at", after)
+    try:
+        response = query.order("created_at", desc=False).limit(100).execute()
+    except Exception as e:
+        log.warning("chat poll failed", thread=thread_id, error=e)
+        return jsonify({"error": "Could not load messages"}), 502
+    return jsonify(response.data)
+
+
+def queue_testgen():
+    """Answers /testgen by queueing the playlist when generation is at capacity."""
+    data_json = request.json
+    book = {"author": data_json.get("author"), "title": data_json.get("title")}
+    return queue_playlist(book, data_json.get("cover"))
+
+
+# Gemini plus Spotify and Pillow work: a few at a time per worker, and a
+# per-user quota
+TESTGEN_SLOTS = Slots("playlist generation", testgen_concurrency)
+TESTGEN_QUOTA = parse_quota("playlist generation", testgen_quota)
+
+
 @app.route("/testgen", methods=["POST"])
+# Gemini, Spotify token, me, create, add items, plus one search per song (20)
+@round_trip_budget(26)
+@admit(EXPENSIVE, concurrency=TESTGEN_SLOTS, quota=TESTGEN_QUOTA, overflow=queue_testgen)
 def testgen():
     # Extract data from the Flutter POST request
     data_json = request.json
@@ -600,23 +724,64 @@ def testgen():
     if not user_id:
         return jsonify({"error": "User not authenticated"}), 401
 
-    # 1. Get recommendations
-    data, books = get_playlist_recommendations(data={"author": author, "title": title})
+    book = {"author": author, "title": title}
+
+    # If Gemini or Spotify is down, queue the work instead of waiting on it
+    if not is_available("gemini", "spotify"):
+        return queue_playlist(book, image)
+
+    try:
+        # 1. Get recommendations
+        data, books = get_playlist_recommendations(data=book)
+    except CircuitOpenError:
+        return queue_playlist(book, image)
+
+    if not books:
+        return jsonify({"error": "Could not generate song recommendations"}), 502
 
     # 2. Create the playlist using the specific user_id
     # Your suggestions.py create_playlist function already accepts user_id!
     playlist = create_playlist(data, books, image)
 
-    print(f"Playlist created for {user_id}: {playlist}")
+    log.info("playlist created", user=user_id, playlist=playlist)
     return jsonify(playlist)
 
 
+def generate_playlist(book, image):
+    data, books = get_playlist_recommendations(data=book)
+    if not books:
+        raise ValueError("Could not generate song recommendations")
+    return create_playlist(data, books, image)
+
+
+def queue_playlist(book, image):
+    """Defers playlist generation until Gemini and Spotify are back."""
+    try:
+        job_id = enqueue(
+            "playlist", generate_playlist, book, image, upstreams=("gemini", "spotify")
+        )
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+
+    return (
+        jsonify(
+            {
+                "status": "queued",
+                "job_id": job_id,
+                "status_url": url_for("api.job_status", job_id=job_id),
+            }
+        ),
+        202,
+    )
+
+
 @app.route("/book/<booktitle>")
 def book_page(booktitle):
     return f"This is the page for the book: {booktitle}"
 
 
 @app.route("/<user>/tbr")
+@round_trip_budget(1)
 def user_tbr(user):
     if session.get("user") != user:
         return redirect(url_for("profile"))
@@ -626,6 +791,7 @@ def user_tbr(user):
 
 
 @app.route("/completed/<user>")
+@round_trip_budget(1)
 def get_completed(user):
     completed = []
     tbr = get_library(user)
@@ -633,9 +799,11 @@ def get_completed(user):
         status = book.get("status")
         if status == "completed":
             completed.append(book)
-        print(book)
+    log.debug("completed shelf", user=user, books=len(completed), of=len(tbr))
 
-    return render_template("completed.html", completed=completed)
+    return stream_page(
+        "completed.html", completed=completed, library_version=library_version(tbr)
+    )
 
 
 @app.route("/roadmap")
@@ -660,12 +828,13 @@ def clear():
 
 @app.route("/favicon.ico")
 def favicon():
-    return redirect(url_for("static", filename="favicon.ico"))
+    return redirect(asset_url("favicon.ico"))
 
 
 @app.route("/app_version")
+@priority(INTERACTIVE)
 def app_version():
-    print("Version check endpoint hit")
+    log.debug("version check")
     data = {
         "version_code": 10,
         "download_url": "https://mpmblozcvymuwujwvefy.supabase.co/storage/v1/object/public/cadence_storage/cadence.apk",
@@ -0,0 +1,48 @@
+-- Single-round-trip message send. Stores the message and bumps its thread in
+-- one transaction, then returns the stored row together with the thread's
+-- participants (who get the live events, see application/events.py).
+-- client_id makes a retried send (from the outbox, or a flaky connection)
+-- store the message only once.
+
+alter table public.messages add column if not exists client_id uuid;
+create unique index if not exists messages_client_id_key on public.messages (client_id);
+
+create or replace function public.send_message(
+  p_thread_id uuid,
+  p_sender_id uuid,
+  p_content text,
+  p_shared_data jsonb default null,
+  p_client_id uuid default null
+) returns table (message jsonb, participants jsonb)
+language plpgsql
+-- Runs as the caller, so the messages and threads RLS policies still apply
+security invoker
+set search_path = public
+as $$
+declare
+  stored public.messages;
+begin
+  insert into public.messages (thread_id, sender_id, content, shared_data, client_id)
+  values (p_thread_id, p_sender_id, p_content, p_shared_data, p_client_id)
+  on conflict (client_id) do nothing
+  returning * into stored;
+
+  if stored.id is null then
+    -- Stored by an earlier attempt; the thread was bumped then
+    select * into stored from public.messages m where m.client_id = p_client_id;
+  else
+    update public.threads set updated_at = stored.created_at where id = p_thread_id;
+  end if;
+
+  -- One row rather than a jsonb object: PostgREST clients expect a list
+  return query select
+    to_jsonb(stored),
+    (
+      select coalesce(jsonb_agg(tp.user_id), '[]'::jsonb)
+      from public.thread_participants tp
+      where tp.thread_id = p_thread_id
+    );
+end;
+$$;
+
+grant execute on function public.send_message(uuid, uuid, text, jsonb, uuid) to authenticated;
@@ -0,0 +1,97 @@
+-- One private thread per set of participants. Every thread gets a canonical
+-- participant_key (its participants' ids, sorted and comma-joined), and a
+-- unique index over the private threads' keys both finds a conversation in
+-- one indexed lookup and stops a double-submitted "new chat" from creating
+-- a second one.
+
+create or replace function public.participant_key(participant_ids uuid[])
+returns text
+language sql
+immutable
+as $$
+  select string_agg(distinct id::text, ',' order by id::text)
+  from unnest(participant_ids) as id
+$$;
+
+alter table public.threads add column if not exists participant_key text;
+
+update public.threads t
+set participant_key = (
+  select public.participant_key(array_agg(tp.user_id))
+  from public.thread_participants tp
+  where tp.thread_id = t.id
+)
+where t.participant_key is null;
+
+-- Existing duplicates keep their messages; only the oldest thread per key
+-- is found from now on
+update public.threads
+set participant_key = null
+where id in (
+  select id from (
+    select id, row_number() over (partition by participant_key order by created_at, id) as n
+    from public.threads
+    where type = 'private' and participant_key is not null
+  ) ranked
+  where n > 1
+);
+
+create unique index if not exists threads_private_participant_key
+  on public.threads (participant_key)
+  where type = 'private';
+
+-- The caller's private thread with exactly these participants, or null
+create or replace function public.find_conversation(participant_ids uuid[])
+returns uuid
+language sql
+stable
+-- Runs as the caller: the threads RLS policies hide other people's threads
+security invoker
+set search_path = public
+as $$
+  select id
+  from public.threads
+  where type = 'private' and participant_key = public.participant_key(participant_ids)
+$$;
+
+-- Creates a thread with its participants, or returns the existing private
+-- thread for the same participants
+create or replace function public.create_new_chat(
+  participant_ids uuid[],
+  thread_name text,
+  thread_type text
+) returns uuid
+language plpgsql
+-- Adds the other participants' rows, which their RLS policies would refuse
+security definer
+set search_path = public
+as $$
+declare
+  key text := public.participant_key(participant_ids);
+  created uuid;
+begin
+  if auth.uid() is null or not auth.uid() = any(participant_ids) then
+    raise exception 'not a participant' using errcode = '42501';
+  end if;
+
+  insert into public.threads (display_name, type, participant_key)
+  values (thread_name, thread_type, key)
+  on conflict (participant_key) where type = 'private' do nothing
+  returning id into created;
+
+  if created is null then
+    -- Waited for, and lost to, a concurrent create (or the chat exists)
+    return (select t.id from public.threads t where t.type = 'private' and t.participant_key = key);
+  end if;
+
+  insert into public.thread_participants (thread_id, user_id)
+  select created, user_id
+  from (select distinct unnest(participant_ids) as user_id) ids;
+
+  return created;
+end;
+$$;
+
+grant execute on function public.participant_key(uuid[]) to authenticated;
+grant execute on function public.find_conversation(uuid[]) to authenticated;
+grant execute on function public.create_new_chat(uuid[], text, text) to authenticated;
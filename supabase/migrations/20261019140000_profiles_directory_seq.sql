@@ -0,0 +1,31 @@
+-- Incremental sync for the user directory (application/directory.py). Every
+-- profile gets a directory_seq from a sequence, bumped whenever its
+-- display_name changes, so a worker's index fetches only the profiles
+-- changed since the highest seq it has seen, in one indexed range scan.
+
+create sequence if not exists public.profiles_directory_seq;
+
+-- A volatile default gives every existing row its own number
+alter table public.profiles
+  add column if not exists directory_seq bigint not null
+  default nextval('public.profiles_directory_seq');
+
+create unique index if not exists profiles_directory_seq_key
+  on public.profiles (directory_seq);
+
+create or replace function public.bump_directory_seq()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.directory_seq := nextval('public.profiles_directory_seq');
+  return new;
+end;
+$$;
+
+drop trigger if exists profiles_bump_directory_seq on public.profiles;
+create trigger profiles_bump_directory_seq
+  before update of display_name on public.profiles
+  for each row
+  when (old.display_name is distinct from new.display_name)
+  execute function public.bump_directory_seq();
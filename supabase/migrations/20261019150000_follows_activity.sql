@@ -0,0 +1,67 @@
+-- Friends activity feed (application/feed.py). follows is who follows whom;
+-- activity stores every feed item once, newest first per user. Feeds are
+-- normally read from per-follower Redis timelines; activity is read
+-- directly for accounts with too many followers to fan out to, and when
+-- Redis is unavailable.
+
+create table if not exists public.follows (
+  follower_id uuid not null references public.profiles (id) on delete cascade,
+  followee_id uuid not null references public.profiles (id) on delete cascade,
+  created_at timestamptz not null default now(),
+  primary key (follower_id, followee_id),
+  check (follower_id <> followee_id)
+);
+
+-- Fan-out reads an account's followers
+create index if not exists follows_followee_id_idx on public.follows (followee_id);
+
+alter table public.profiles add column if not exists follower_count integer not null default 0;
+
+create or replace function public.count_followers()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  if tg_op = 'INSERT' then
+    update public.profiles set follower_count = follower_count + 1 where id = new.followee_id;
+  else
+    update public.profiles set follower_count = follower_count - 1 where id = old.followee_id;
+  end if;
+  return null;
+end;
+$$;
+
+drop trigger if exists follows_count_followers on public.follows;
+create trigger follows_count_followers
+  after insert or delete on public.follows
+  for each row execute function public.count_followers();
+
+alter table public.follows enable row level security;
+
+create policy "follows are public" on public.follows
+  for select using (true);
+create policy "users follow as themselves" on public.follows
+  for insert with check (auth.uid() = follower_id);
+create policy "users unfollow as themselves" on public.follows
+  for delete using (auth.uid() = follower_id);
+
+create table if not exists public.activity (
+  id uuid primary key,
+  user_id uuid not null references public.profiles (id) on delete cascade,
+  kind text not null,
+  data jsonb not null default '{}'::jsonb,
+  created_at timestamptz not null default now()
+);
+
+-- Fan-out-on-read: one user's (or several users') newest activity
+create index if not exists activity_user_id_created_at_idx
+  on public.activity (user_id, created_at desc);
+
+alter table public.activity enable row level security;
+
+create policy "activity is public" on public.activity
+  for select using (true);
+create policy "users record their own activity" on public.activity
+  for insert with check (auth.uid() = user_id);
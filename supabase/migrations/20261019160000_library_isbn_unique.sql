@@ -0,0 +1,70 @@
+-- One library row per user and book. isbn_normalized is the ISBN reduced to
+-- its digits (and X), with ISBN-10s converted to ISBN-13, so the two forms of
+-- one edition match. A trigger keeps it in step with isbn, and a unique index
+-- over (user_id, isbn_normalized) stops imports and "add to library" from
+-- creating duplicates. Rows without a usable ISBN are left null and so are
+-- never in conflict.
+
+create or replace function public.normalize_isbn(raw text)
+returns text
+language plpgsql
+immutable
+as $$
+declare
+  isbn text := upper(regexp_replace(coalesce(raw, ''), '[^0-9Xx]', '', 'g'));
+  total int := 0;
+begin
+  if isbn ~ '^[0-9]{13}$' then
+    return isbn;
+  end if;
+  if isbn !~ '^[0-9]{9}[0-9X]$' then
+    return null;
+  end if;
+  -- ISBN-10 -> ISBN-13: prefix 978, drop the old check digit, add a new one
+  isbn := '978' || left(isbn, 9);
+  for i in 1..12 loop
+    total := total + substr(isbn, i, 1)::int * case when i % 2 = 0 then 3 else 1 end;
+  end loop;
+  return isbn || ((10 - total % 10) % 10)::text;
+end;
+$$;
+
+alter table public.library add column if not exists isbn_normalized text;
+
+create or replace function public.set_isbn_normalized()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.isbn_normalized := public.normalize_isbn(new.isbn);
+  return new;
+end;
+$$;
+
+drop trigger if exists library_set_isbn_normalized on public.library;
+create trigger library_set_isbn_normalized
+  before insert or update of isbn on public.library
+  for each row execute function public.set_isbn_normalized();
+
+update public.library set isbn_normalized = public.normalize_isbn(isbn);
+
+-- Existing duplicates: keep the row with the most reading history (a
+-- status, then the most pages read), else the oldest. The others are
+-- deleted for good; back up public.library first if they may be wanted
+delete from public.library
+where id in (
+  select id from (
+    select
+      id,
+      row_number() over (
+        partition by user_id, isbn_normalized
+        order by (coalesce(status, '') <> '') desc, pages_read desc nulls last, id
+      ) as n
+    from public.library
+    where isbn_normalized is not null
+  ) ranked
+  where n > 1
+);
+
+create unique index if not exists library_user_isbn_key
+  on public.library (user_id, isbn_normalized);